@@ -0,0 +1,88 @@
+import re
+import json
+import time
+import argparse
+from statistics import median
+
+from backend.test_functions import chunker
+from backend.ingest import available_subjects
+
+# Jämför den gamla rubrik-/årskursuppdelningen (en finditer per regex och rubrik,
+# regex byggd vid varje anrop) med SubjectScanner på hela korpusen.
+# Kör: python -m backend.benchmarks.bench_chunker [--repeat 20] [--scale 10]
+
+
+def legacy_sections(subject: str, text: str):
+    config = chunker.get_config(subject)
+    heading_regex = chunker.build_heading_regex(config)
+    sections = []
+    for heading, content in chunker.chunk_by_headings(text, heading_regex):
+        grade_chunks = chunker.split_by_year_levels(content, config["regex_grade_levels"])
+        if grade_chunks:
+            sections.extend((heading, grade, gc.strip()) for grade, gc in grade_chunks)
+        else:
+            sections.append((heading, None, content.strip()))
+    return sections
+
+
+def scanner_sections(subject: str, text: str):
+    return [
+        (heading, grade, text[start:end].strip())
+        for heading, grade, start, end in chunker.get_scanner(subject).sections(text)
+    ]
+
+
+def scanner_offsets(subject: str, text: str):
+    return list(chunker.get_scanner(subject).sections(text))
+
+
+def _time(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return median(samples)
+
+
+def run(repeat: int, scale: int) -> dict:
+    results = {}
+    for subject in available_subjects():
+        text = chunker.load_text(subject) * scale
+
+        expected = legacy_sections(subject, text)
+        actual = scanner_sections(subject, text)
+        if expected != actual:
+            raise SystemExit(f"FEL: Scannern gav andra avsnitt än den gamla uppdelningen för {subject}.")
+
+        chunker.get_scanner.cache_clear()
+        cold = _time(lambda: scanner_offsets(subject, text), 1)
+        results[subject] = {
+            "chars": len(text),
+            "sections": len(actual),
+            "legacy_ms": round(_time(lambda: legacy_sections(subject, text), repeat), 3),
+            "scanner_cold_ms": round(cold, 3),
+            "scanner_ms": round(_time(lambda: scanner_offsets(subject, text), repeat), 3),
+            "scanner_with_slices_ms": round(_time(lambda: scanner_sections(subject, text), repeat), 3),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark för chunkerns rubrik- och årskursscanner.")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--scale", type=int, default=1, help="Upprepa varje text N gånger för större indata.")
+    parser.add_argument("--json", help="Spara resultatet som JSON i filen.")
+    args = parser.parse_args()
+
+    # chunk_by_headings skriver ut varje rubrik; tysta det under mätningen
+    chunker.print = lambda *a, **k: None
+    results = run(args.repeat, args.scale)
+
+    print(f"{'ämne':<18}{'tecken':>10}{'avsnitt':>9}{'gammal ms':>11}{'scanner ms':>12}{'faktor':>8}")
+    for subject, r in results.items():
+        print(f"{subject:<18}{r['chars']:>10}{r['sections']:>9}{r['legacy_ms']:>11.2f}"
+              f"{r['scanner_ms']:>12.2f}{r['legacy_ms'] / max(r['scanner_ms'], 1e-6):>8.1f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,321 @@
+import os
+import sys
+import json
+import time
+import random
+import signal
+import asyncio
+import argparse
+import resource
+import subprocess
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import httpx
+
+from backend.utils.metrics import LatencyRecorder
+from backend.benchmarks.fakes import SUBJECTS, FakeGemini
+
+# Last- och latensbenchmark för hela kedjan /create-job -> /status/{job_id}.
+# backend.main:app startas i en egen uvicorn-process (backend/benchmarks/load_app.py) med
+# activity_jobs/match_chunks i minnet och GEMINI_API_BASE mot en falsk Gemini-server
+# i den här processen (latens, felandel och 429 styrs med flaggor).
+# Jobb skapas i jämn takt (öppen last, --rps) och varje jobb pollas tills det är klart.
+# Resultatet (p50/p95/p99, genomströmning, CPU/minne, API:ets /metrics) kan sparas som
+# JSON och jämföras med en tidigare körning via --compare.
+# Kör: python -m backend.benchmarks.bench_load [--rps 5] [--duration 30] [--json resultat.json]
+# Kräver uvicorn. API:et körs med en worker eftersom jobben bara finns i processens minne.
+
+APP = "backend.benchmarks.load_app:app"
+
+QUERIES = [
+    "Industriella revolutionen och dess följder",
+    "Klimatförändringar och hållbar utveckling",
+    "Världsreligionernas heliga skrifter",
+    "Demokrati och mänskliga rättigheter",
+    "Befolkningsförändringar och migration",
+    "Källkritik och historiska källor",
+    "Kalla kriget och blockpolitiken",
+    "Jordens naturresurser och handel",
+]
+
+TERMINAL_STATUSES = ("COMPLETED", "FAILED")
+
+# Nyckeltal som --compare jämför (lägre är bättre utom genomströmning)
+COMPARED = [
+    ("job_latency", "p50_ms"),
+    ("job_latency", "p95_ms"),
+    ("job_latency", "p99_ms"),
+    ("create_latency", "p95_ms"),
+    ("throughput", "completed_per_s"),
+]
+
+
+class LoadStats:
+    def __init__(self):
+        self.job_latency = LatencyRecorder(window=1_000_000)
+        self.create_latency = LatencyRecorder(window=1_000_000)
+        self.status_latency = LatencyRecorder(window=1_000_000)
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.http_errors = 0
+        self.timeouts = 0
+        self.polls = 0
+        self.not_modified = 0
+        self.errors: Dict[str, int] = {}
+
+    def error(self, message: str):
+        self.http_errors += 1
+        self.errors[message] = self.errors.get(message, 0) + 1
+
+
+async def run_job(client: httpx.AsyncClient, stats: LoadStats, request: dict, poll_interval: float, timeout: float):
+    started = time.perf_counter()
+    try:
+        response = await client.post("/create-job", json=request)
+        stats.create_latency.record((time.perf_counter() - started) * 1000)
+        if response.status_code != 202:
+            stats.error(f"create-job {response.status_code}")
+            return
+        job = response.json()
+        status, etag = job["status"], None
+
+        while status not in TERMINAL_STATUSES:
+            if time.perf_counter() - started > timeout:
+                stats.timeouts += 1
+                return
+            await asyncio.sleep(poll_interval)
+            polled = time.perf_counter()
+            response = await client.get(
+                f"/status/{job['job_id']}", headers={"If-None-Match": etag} if etag else None
+            )
+            stats.status_latency.record((time.perf_counter() - polled) * 1000)
+            stats.polls += 1
+            if response.status_code == 304:
+                stats.not_modified += 1
+                continue
+            if response.status_code != 200:
+                stats.error(f"status {response.status_code}")
+                return
+            etag = response.headers.get("ETag")
+            status = response.json()["status"]
+    except httpx.HTTPError as e:
+        stats.error(type(e).__name__)
+        return
+
+    stats.job_latency.record((time.perf_counter() - started) * 1000)
+    if status == "COMPLETED":
+        stats.completed += 1
+    else:
+        stats.failed += 1
+
+
+async def drive(base_url: str, args) -> dict:
+    """Öppen last: ett nytt jobb var 1/rps sekund oavsett hur snabbt tidigare jobb blir klara."""
+    stats = LoadStats()
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30.0) as client:
+        tasks = []
+        started = time.perf_counter()
+        interval = 1.0 / args.rps
+        next_at = started
+        while next_at - started < args.duration:
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            request = {
+                "query": rng.choice(QUERIES[:args.unique_queries]),
+                "subject": rng.choice(SUBJECTS),
+                "quiz_questions": 3,
+                "flashcard_items": 3,
+                "force_regenerate": rng.random() >= args.cache_share,
+                "user_id": f"elev-{rng.randrange(args.users)}",
+            }
+            tasks.append(asyncio.create_task(run_job(client, stats, request, args.poll_interval, args.job_timeout)))
+            stats.submitted += 1
+            next_at += interval
+        submitted_for = time.perf_counter() - started
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        metrics = (await client.get("/metrics")).json()
+
+    return {
+        "jobs": {
+            "submitted": stats.submitted,
+            "completed": stats.completed,
+            "failed": stats.failed,
+            "timeouts": stats.timeouts,
+            "http_errors": stats.http_errors,
+            "errors": stats.errors,
+        },
+        "job_latency": stats.job_latency.snapshot(),
+        "create_latency": stats.create_latency.snapshot(),
+        "status_latency": stats.status_latency.snapshot(),
+        "throughput": {
+            "offered_rps": stats.submitted / submitted_for if submitted_for else 0.0,
+            "completed_per_s": stats.completed / elapsed if elapsed else 0.0,
+            "elapsed_s": elapsed,
+        },
+        "polling": {
+            "polls": stats.polls,
+            "polls_per_job": stats.polls / stats.submitted if stats.submitted else 0.0,
+            "not_modified": stats.not_modified,
+        },
+        "app_metrics": metrics,
+    }
+
+
+async def wait_until_ready(base_url: str, process: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url, timeout=2.0) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise SystemExit(f"FEL: API-processen avslutades vid start (kod {process.returncode}).")
+            try:
+                if (await client.get("/ready")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise SystemExit("FEL: API:et blev inte redo i tid.")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _app_env(args, gemini_port: int) -> dict:
+    env = os.environ.copy()
+    env.update({
+        "GEMINI_API_KEY": "bench",
+        "GEMINI_API_BASE": f"http://127.0.0.1:{gemini_port}/v1beta",
+        "GEMINI_STREAMING": "1" if args.streaming else "0",
+        "EMBEDDING_BACKEND": "gemini",
+        "SUPABASE_URL": "http://in-memory",
+        "SUPABASE_SERVICE_ROLE_KEY": "bench",
+        "RETRIEVER_BACKEND": "supabase",
+        "RETRIEVER_HYBRID": "off",
+        "JOB_EXECUTION_MODE": "background",
+        "BENCH_DB_LATENCY_MS": str(args.db_latency_ms),
+        "BENCH_CHUNKS_PER_SUBJECT": str(args.chunks_per_subject),
+    })
+    # En eventuell lokal .env får inte styra om benchmarken mot riktiga tjänster
+    env.pop("EMBEDDING_CACHE_PATH", None)
+    return env
+
+
+async def run(args) -> dict:
+    import uvicorn
+
+    gemini = FakeGemini(
+        embed_latency_ms=args.embed_latency_ms,
+        generate_latency_ms=args.generate_latency_ms,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        seed=args.seed,
+    )
+    gemini_server = uvicorn.Server(uvicorn.Config(
+        gemini.app, host="127.0.0.1", port=args.gemini_port, log_level="warning", lifespan="off"
+    ))
+    gemini_task = asyncio.create_task(gemini_server.serve())
+    while not gemini_server.started:
+        if gemini_task.done():
+            raise SystemExit("FEL: Den falska Gemini-servern kunde inte starta.")
+        await asyncio.sleep(0.05)
+
+    log = open(args.app_log, "w", encoding="utf-8") if args.app_log else subprocess.DEVNULL
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", APP, "--host", "127.0.0.1", "--port", str(args.port), "--log-level", "warning"],
+        env=_app_env(args, args.gemini_port), stdout=log, stderr=subprocess.STDOUT,
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        await wait_until_ready(base_url, process)
+        results = await drive(base_url, args)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        if log is not subprocess.DEVNULL:
+            log.close()
+        gemini_server.should_exit = True
+        await gemini_task
+
+    # Barnprocessen (API:et) är avslutad, så RUSAGE_CHILDREN täcker hela dess körning
+    app_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    own_usage = resource.getrusage(resource.RUSAGE_SELF)
+    elapsed = results["throughput"]["elapsed_s"]
+    results["resources"] = {
+        "app_cpu_s": app_usage.ru_utime + app_usage.ru_stime,
+        "app_cpu_share": (app_usage.ru_utime + app_usage.ru_stime) / elapsed if elapsed else 0.0,
+        "app_max_rss_mb": app_usage.ru_maxrss / 1024,
+        "harness_cpu_s": own_usage.ru_utime + own_usage.ru_stime,
+    }
+    results["fake_gemini"] = gemini.stats()
+    results["config"] = {
+        key: value for key, value in vars(args).items() if key not in ("json", "compare", "app_log")
+    }
+    results["commit"] = _git_commit()
+    results["timestamp"] = datetime.now(timezone.utc).isoformat()
+    return results
+
+
+def compare(results: dict, baseline: dict):
+    print(f"\n{'jämfört med ' + str(baseline.get('commit')):<34}{'före':>12}{'nu':>12}{'ändring':>10}")
+    for section, key in COMPARED:
+        before, now = baseline[section][key], results[section][key]
+        change = (now - before) / before * 100 if before else 0.0
+        print(f"{section + '.' + key:<34}{before:>12.1f}{now:>12.1f}{change:>9.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Last- och latensbenchmark för /create-job och /status med falska Gemini och Supabase.")
+    parser.add_argument("--rps", type=float, default=5.0, help="Nya jobb per sekund.")
+    parser.add_argument("--duration", type=float, default=30.0, help="Sekunder som nya jobb skapas.")
+    parser.add_argument("--poll-interval", type=float, default=0.5)
+    parser.add_argument("--job-timeout", type=float, default=120.0)
+    parser.add_argument("--users", type=int, default=30, help="Antal olika user_id (rättvis köning).")
+    parser.add_argument("--unique-queries", type=int, default=len(QUERIES), help="Antal olika frågor (färre ger fler identiska jobb).")
+    parser.add_argument("--cache-share", type=float, default=0.0, help="Andel jobb som får använda resultatcachen.")
+    parser.add_argument("--streaming", action="store_true", help="Kör med GEMINI_STREAMING=1.")
+    parser.add_argument("--embed-latency-ms", type=float, default=30.0)
+    parser.add_argument("--generate-latency-ms", type=float, default=2000.0)
+    parser.add_argument("--jitter", type=float, default=0.2, help="Relativ spridning av latensen (0.2 = ±20 %%).")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Andel Gemini-anrop som svarar 500.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Andel Gemini-anrop som svarar 429 med Retry-After.")
+    parser.add_argument("--db-latency-ms", type=float, default=5.0, help="Simulerad latens per databasanrop.")
+    parser.add_argument("--chunks-per-subject", type=int, default=500)
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--gemini-port", type=int, default=8766)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--app-log", help="Skriv API-processens utskrifter till filen.")
+    parser.add_argument("--json", help="Spara resultatet som JSON i filen.")
+    parser.add_argument("--compare", help="Tidigare JSON-resultat att jämföra med.")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    jobs, latency, throughput = results["jobs"], results["job_latency"], results["throughput"]
+    print(f"jobb: {jobs['submitted']} skapade, {jobs['completed']} klara, {jobs['failed']} misslyckade, "
+          f"{jobs['timeouts']} timeout, {jobs['http_errors']} HTTP-fel")
+    print(f"jobblatens ms: p50 {latency['p50_ms']:.0f}  p95 {latency['p95_ms']:.0f}  p99 {latency['p99_ms']:.0f}")
+    print(f"create-job ms: p95 {results['create_latency']['p95_ms']:.1f}   status ms: p95 {results['status_latency']['p95_ms']:.1f}")
+    print(f"genomströmning: {throughput['completed_per_s']:.2f} jobb/s (erbjudet {throughput['offered_rps']:.2f}/s)")
+    print(f"API-process: {results['resources']['app_cpu_s']:.1f} s CPU, max {results['resources']['app_max_rss_mb']:.0f} MB RSS")
+    print(f"falsk Gemini: {results['fake_gemini']}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(results, json.load(f))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
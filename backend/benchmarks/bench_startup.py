@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+from statistics import median
+
+# Mäter kallstart för API:et i nya processer (som varje gunicorn-worker):
+# importtiden för backend.main, tiden tills lifespan har startat tjänsterna i
+# WARM_SERVICES, och vilka moduler som kostar mest vid import (python -X importtime).
+# Kör: python -m backend.benchmarks.bench_startup [--repeat 10] [--top 15]
+
+IMPORT_SNIPPET = """
+import time
+started = time.perf_counter()
+import backend.main
+print(time.perf_counter() - started)
+"""
+
+LIFESPAN_SNIPPET = """
+import json, time, asyncio
+started = time.perf_counter()
+import backend.main as main
+imported = time.perf_counter()
+
+async def run():
+    async with main.lifespan(main.app):
+        ready = time.perf_counter()
+        readiness = main.services.readiness()
+    return ready, readiness
+
+ready, readiness = asyncio.run(run())
+print(json.dumps({"import_s": imported - started, "ready_s": ready - started, "readiness": readiness}))
+"""
+
+
+def _python(code: str, *flags: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *flags, "-c", code],
+        capture_output=True, text=True, check=True, env=os.environ.copy(),
+    )
+
+
+def measure_import(repeat: int) -> float:
+    return median(float(_python(IMPORT_SNIPPET).stdout.strip().splitlines()[-1]) for _ in range(repeat))
+
+
+def measure_lifespan(repeat: int) -> dict:
+    runs = [json.loads(_python(LIFESPAN_SNIPPET).stdout.strip().splitlines()[-1]) for _ in range(repeat)]
+    return {
+        "import_ms": round(median(r["import_s"] for r in runs) * 1000, 1),
+        "ready_ms": round(median(r["ready_s"] for r in runs) * 1000, 1),
+        "readiness": runs[-1]["readiness"],
+    }
+
+
+def slowest_imports(top: int) -> list:
+    """Moduler med störst kumulativ importtid (bara toppnivåpaket och backend.*)."""
+    stderr = _python("import backend.main", "-X", "importtime").stderr
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if "." not in name or name.startswith("backend."):
+            modules.append((name, int(cumulative) / 1000))
+    modules.sort(key=lambda m: m[1], reverse=True)
+    return [{"module": name, "cumulative_ms": round(ms, 1)} for name, ms in modules[:top]]
+
+
+def run(repeat: int, top: int) -> dict:
+    return {
+        "import_ms": round(measure_import(repeat) * 1000, 1),
+        "lifespan": measure_lifespan(repeat),
+        "slowest_imports": slowest_imports(top),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark för importtid och kallstart av backend.main.")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15, help="Antal moduler i importtidslistan.")
+    parser.add_argument("--json", help="Spara resultatet som JSON i filen.")
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.top)
+
+    print(f"import backend.main: {results['import_ms']:.1f} ms (median av {args.repeat})")
+    print(f"redo efter lifespan: {results['lifespan']['ready_ms']:.1f} ms")
+    for name, status in results["lifespan"]["readiness"]["services"].items():
+        state = "varm" if status["ready"] else ("fel: " + status["error"] if status["error"] else "lazy")
+        print(f"  {name:<14}{state:<10}{status['start_seconds'] or 0:>8.3f} s")
+    print(f"\n{'modul':<40}{'ms':>10}")
+    for module in results["slowest_imports"]:
+        print(f"{module['module']:<40}{module['cumulative_ms']:>10.1f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,338 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Lokala ersättare för Gemini och Supabase i lastbenchmarken (bench_load.py).
+#
+# FakeGemini: en ASGI-app med embedContent, batchEmbedContents, generateContent och
+#   streamGenerateContent. Latens, felandel (500) och andel 429 (med Retry-After) är
+#   konfigurerbara. Inbäddningarna är deterministiska per text, så inbäddningscachen
+#   och resultatcachen beter sig som mot riktiga Gemini.
+# InMemorySupabase: minnesbaserad ersättare för den asynkrona Supabase-klienten med
+#   just de frågor SupabaseRepository bygger (activity_jobs och RPC:n match_chunks).
+
+EMBEDDING_DIMENSION = 768
+SUBJECTS = ("historia", "geografi", "religionskunskap", "samhallskunskap")
+
+
+def fake_embedding(text: str, dimension: int = EMBEDDING_DIMENSION) -> List[float]:
+    """Normaliserad pseudoslumpvektor som bara beror på texten."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def fake_activities(quiz_questions: int = 3, flashcard_items: int = 3) -> dict:
+    """Ett svar som klarar valideringen mot LearningActivityResponse."""
+    return {
+        "response_id": f"bench-{random.getrandbits(32):08x}",
+        "explanation": "En kort sammanfattning av ämnet som förbereder eleven för quizen.",
+        "quiz": {
+            "topic": "Benchmarkquiz",
+            "questions": [
+                {
+                    "question_id": i + 1,
+                    "type": "multiple_choice",
+                    "prompt": f"Fråga {i + 1}?",
+                    "alternatives": [
+                        {"id": "a", "text": "Rätt", "is_correct": True},
+                        {"id": "b", "text": "Fel", "is_correct": False},
+                        {"id": "c", "text": "Också fel", "is_correct": False},
+                    ],
+                    "explanation_correct": "Rätt, bra jobbat.",
+                    "explanation_incorrect": "Inte riktigt, läs stycket igen.",
+                    "source_reference": "Benchmark",
+                }
+                for i in range(quiz_questions)
+            ],
+        } if quiz_questions else None,
+        "flashcards": {
+            "topic": "Benchmarkkort",
+            "items": [
+                {
+                    "card_id": i + 1,
+                    "term": f"Begrepp {i + 1}",
+                    "definition": "En kort förklaring.",
+                    "image_generation_prompt": "a simple school illustration",
+                    "source_reference": "Benchmark",
+                }
+                for i in range(flashcard_items)
+            ],
+        } if flashcard_items else None,
+    }
+
+
+class FakeGemini:
+    """Konfigurerbar Gemini-ersättare. stats() visar anrop och injicerade fel per slutpunkt."""
+
+    def __init__(
+        self,
+        embed_latency_ms: float = 30.0,
+        generate_latency_ms: float = 2000.0,
+        jitter: float = 0.2,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after_seconds: float = 1.0,
+        stream_chunks: int = 8,
+        seed: Optional[int] = None,
+    ):
+        self.embed_latency_ms = embed_latency_ms
+        self.generate_latency_ms = generate_latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after_seconds = retry_after_seconds
+        self.stream_chunks = stream_chunks
+        self._random = random.Random(seed)
+
+        self.calls: Dict[str, int] = {}
+        self.injected_errors = 0
+        self.injected_429 = 0
+
+        self.app = FastAPI(title="Falsk Gemini")
+        self.app.post("/v1beta/models/{target}")(self._handle)
+
+    def _delay(self, latency_ms: float) -> float:
+        return max(0.0, latency_ms * (1 + self._random.uniform(-self.jitter, self.jitter))) / 1000
+
+    def _injected_failure(self) -> Optional[JSONResponse]:
+        roll = self._random.random()
+        if roll < self.rate_limit_rate:
+            self.injected_429 += 1
+            return JSONResponse(
+                {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}},
+                status_code=429,
+                headers={"Retry-After": str(self.retry_after_seconds)},
+            )
+        if roll < self.rate_limit_rate + self.error_rate:
+            self.injected_errors += 1
+            return JSONResponse({"error": {"code": 500, "status": "INTERNAL"}}, status_code=500)
+        return None
+
+    @staticmethod
+    def _usage(payload: bytes, output: str) -> dict:
+        prompt_tokens, output_tokens = len(payload) // 4, len(output) // 4
+        return {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens,
+        }
+
+    async def _handle(self, target: str, request: Request):
+        method = target.rsplit(":", 1)[-1]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        payload = await request.body()
+
+        failure = self._injected_failure()
+        if method in ("embedContent", "batchEmbedContents"):
+            await asyncio.sleep(self._delay(self.embed_latency_ms))
+            if failure is not None:
+                return failure
+            body = json.loads(payload)
+            if method == "embedContent":
+                return {"embedding": {"values": fake_embedding(body["content"]["parts"][0]["text"])}}
+            return {"embeddings": [
+                {"values": fake_embedding(item["content"]["parts"][0]["text"])} for item in body["requests"]
+            ]}
+
+        if method == "generateContent":
+            await asyncio.sleep(self._delay(self.generate_latency_ms))
+            if failure is not None:
+                return failure
+            text = json.dumps(fake_activities(), ensure_ascii=False)
+            return {
+                "candidates": [{"content": {"parts": [{"text": text}]}}],
+                "usageMetadata": self._usage(payload, text),
+            }
+
+        if method == "streamGenerateContent":
+            if failure is not None:
+                await asyncio.sleep(self._delay(self.embed_latency_ms))
+                return failure
+            return StreamingResponse(self._stream(payload), media_type="text/event-stream")
+
+        return JSONResponse({"error": {"code": 404, "message": f"Okänd metod {method}"}}, status_code=404)
+
+    async def _stream(self, payload: bytes):
+        text = json.dumps(fake_activities(), ensure_ascii=False)
+        size = -(-len(text) // self.stream_chunks)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        delay = self._delay(self.generate_latency_ms) / len(pieces)
+        for i, piece in enumerate(pieces):
+            await asyncio.sleep(delay)
+            chunk = {"candidates": [{"content": {"parts": [{"text": piece}]}}]}
+            if i == len(pieces) - 1:
+                chunk["usageMetadata"] = self._usage(payload, text)
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\r\n\r\n"
+
+    def stats(self) -> dict:
+        return {
+            "calls": dict(self.calls),
+            "injected_errors": self.injected_errors,
+            "injected_429": self.injected_429,
+        }
+
+
+# --- Supabase ---
+
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Query:
+    """Det urval av PostgREST-kedjan som SupabaseRepository och SupabaseJobQueue använder."""
+
+    def __init__(self, store: "InMemorySupabase", table: str):
+        self.store = store
+        self.table_name = table
+        self.action = "select"
+        self.values = None
+        self.columns: Optional[List[str]] = None
+        self.filters = []
+        self.order_by = None
+        self.max_rows = None
+        self.returning_minimal = False
+
+    def select(self, columns: str = "*"):
+        self.columns = None if columns.strip() == "*" else [c.strip() for c in columns.split(",")]
+        return self
+
+    def insert(self, rows, returning=None):
+        self.action, self.values = "insert", rows if isinstance(rows, list) else [rows]
+        self.returning_minimal = str(returning) == "minimal"
+        return self
+
+    def update(self, values: dict, returning=None):
+        self.action, self.values = "update", values
+        self.returning_minimal = str(returning) == "minimal"
+        return self
+
+    def eq(self, column: str, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def gt(self, column: str, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) > value)
+        return self
+
+    def in_(self, column: str, values):
+        allowed = set(values)
+        self.filters.append(lambda row: row.get(column) in allowed)
+        return self
+
+    def order(self, column: str, desc: bool = False):
+        self.order_by = (column, desc)
+        return self
+
+    def limit(self, count: int):
+        self.max_rows = count
+        return self
+
+    def _project(self, row: dict) -> dict:
+        if self.columns is None:
+            return dict(row)
+        return {c: row.get(c) for c in self.columns}
+
+    async def execute(self) -> _Result:
+        await self.store.round_trip()
+        table = self.store.tables.setdefault(self.table_name, {})
+        now = datetime.now(timezone.utc).isoformat()
+
+        if self.action == "insert":
+            for row in self.values:
+                table[row["job_id"]] = dict(row, updated_at=now)
+            return _Result([] if self.returning_minimal else [dict(r) for r in self.values])
+
+        matches = [row for row in table.values() if all(f(row) for f in self.filters)]
+        if self.action == "update":
+            for row in matches:
+                row.update(self.values, updated_at=now)
+            return _Result([] if self.returning_minimal else [self._project(r) for r in matches])
+
+        if self.order_by is not None:
+            column, desc = self.order_by
+            matches.sort(key=lambda row: row.get(column) or "", reverse=desc)
+        if self.max_rows is not None:
+            matches = matches[:self.max_rows]
+        return _Result([self._project(r) for r in matches])
+
+
+class _Rpc:
+    def __init__(self, store: "InMemorySupabase", name: str, params: dict):
+        self.store, self.name, self.params = store, name, params
+
+    async def execute(self) -> _Result:
+        await self.store.round_trip()
+        if self.name != "match_chunks":
+            raise ValueError(f"Okänd RPC {self.name}")
+        return _Result(self.store.match_chunks(**self.params))
+
+
+class _Postgrest:
+    async def aclose(self):
+        pass
+
+
+class InMemorySupabase:
+    """Ersätter AsyncClient: activity_jobs i minnet och match_chunks över syntetiska chunks."""
+
+    def __init__(self, chunks_per_subject: int = 500, latency_ms: float = 0.0, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.tables: Dict[str, Dict[str, dict]] = {"activity_jobs": {}}
+        self.postgrest = _Postgrest()
+        self.round_trips = 0
+
+        rng = random.Random(seed)
+        self.chunks: List[dict] = []
+        for subject in SUBJECTS:
+            for i in range(chunks_per_subject):
+                words = " ".join(rng.choice(("källor", "demokrati", "klimat", "religion", "samhälle", "karta", "tid"))
+                                 for _ in range(60))
+                self.chunks.append({
+                    "content": f"{subject} stycke {i}: {words}",
+                    "metadata": {"subject": subject, "grade_level": "7-9", "content_type": "kommentar"},
+                })
+        self.vectors = np.array([fake_embedding(c["content"]) for c in self.chunks], dtype=np.float32)
+
+    @classmethod
+    def from_env(cls) -> "InMemorySupabase":
+        return cls(
+            chunks_per_subject=int(os.getenv("BENCH_CHUNKS_PER_SUBJECT", "500")),
+            latency_ms=float(os.getenv("BENCH_DB_LATENCY_MS", "0")),
+        )
+
+    async def round_trip(self):
+        self.round_trips += 1
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, name)
+
+    def rpc(self, name: str, params: dict) -> _Rpc:
+        return _Rpc(self, name, params)
+
+    def match_chunks(self, query_embedding: List[float], match_count: int, filter: dict) -> List[dict]:
+        mask = np.array([
+            all(chunk["metadata"].get(k) == v for k, v in filter.items()) for chunk in self.chunks
+        ])
+        if not mask.any():
+            return []
+        indices = np.flatnonzero(mask)
+        scores = self.vectors[indices] @ np.asarray(query_embedding, dtype=np.float32)
+        top = indices[np.argsort(-scores)[:match_count]]
+        return [
+            dict(self.chunks[i], similarity=float(self.vectors[i] @ np.asarray(query_embedding, dtype=np.float32)))
+            for i in top
+        ]
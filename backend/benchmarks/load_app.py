@@ -0,0 +1,10 @@
+from backend import main
+from backend.benchmarks.fakes import InMemorySupabase
+
+# backend.main:app med activity_jobs och match_chunks i minnet, för bench_load.py.
+# Startas av benchmarken med: uvicorn backend.benchmarks.load_app:app
+# (SUPABASE_URL/-KEY sätts till dummyvärden så att repositoryt räknas som konfigurerat).
+
+main.db._client = InMemorySupabase.from_env()
+
+app = main.app
@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from supabase import create_client
+
+from backend.utils import http_client
+from backend.utils.embeddings import EmbeddingProvider, create_embedder
+from backend.utils.retrievers import export_snapshot_from_supabase
+from backend.utils.corpus import Corpus, corpus_dir_from_env, write_subject
+from backend.utils.text_splitter import normalize_whitespace
+from backend.test_functions.chunker import DATA_DIR, chunk_spans, get_config
+from backend.title_files.no_so_titles import ALL_CONFIGS
+
+# Inkrementell indexering av kommentarmaterialet till chunks-tabellen.
+# Starta med: python -m backend.ingest [--subjects historia geografi] [--snapshot DIR]
+#
+# Chunkningen skriver en minnesmappad korpus (backend/utils/corpus.py) i CORPUS_DIR.
+# Varje chunk får en content_hash (innehåll + metadata). Bara chunks vars hash
+# saknas i databasen inbäddas och skrivs; chunks som försvunnit ur texterna tas bort.
+# Efter byte av inbäddningsmotor (EMBEDDING_BACKEND) körs --reembed, som skriver om alla chunks.
+# Kräver backend/sql/chunks_content_hash.sql.
+# Importerar inte backend.main: inbäddningsmotorn byggs här med create_embedder().
+
+load_dotenv()
+
+CONTENT_TYPE = "kommentar"
+UPSERT_BATCH_SIZE = 200
+EMBED_BATCH_SIZE = 100
+PAGE_SIZE = 1000
+
+
+def content_hash(record: dict) -> str:
+    """Stabil hash för en chunk; ändras om texten eller dess metadata ändras."""
+    canonical = json.dumps(
+        {"content": record["content"], "metadata": record["metadata"]},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def build_subject(subject: str, corpus_dir: str) -> int:
+    """Chunkar ett ämne och skriver dess korpus (körs i en separat process). Returnerar antalet chunks."""
+    config = get_config(subject)
+    text, spans = chunk_spans(subject)
+
+    chunks, hashes = [], []
+    for start, end, heading, grade in spans:
+        # Samma bindestreck som läroplanschunksen ("7-9"), så att grade_level-filtret matchar
+        grade = (grade or "1–9").replace("–", "-")
+        hashes.append(content_hash({
+            "content": normalize_whitespace(text[start:end]),
+            "metadata": {
+                "subject": subject,
+                "grade_level": grade,
+                "content_type": config["content_type"],
+                "heading": heading,
+            },
+        }))
+        chunks.append((start, end, heading, grade))
+
+    write_subject(corpus_dir, subject, text, chunks, config["content_type"], hashes)
+    return len(chunks)
+
+
+def available_subjects() -> List[str]:
+    """Ämnen i ALL_CONFIGS som har en textfil i DATA_DIR."""
+    subjects = []
+    for config in ALL_CONFIGS:
+        if (DATA_DIR / f"{config['subject']}.txt").exists():
+            subjects.append(config["subject"])
+        else:
+            print(f"VARNING: Ingen text för '{config['subject']}' i {DATA_DIR}, hoppar över.")
+    return subjects
+
+
+def chunk_all(subjects: List[str], corpus_dir: str, processes: Optional[int] = None) -> Corpus:
+    """Chunkar alla ämnen parallellt till korpuskatalogen och öppnar den."""
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        list(pool.map(partial(build_subject, corpus_dir=corpus_dir), subjects))
+    return Corpus(corpus_dir)
+
+
+def fetch_existing(supabase, subjects: List[str]) -> Tuple[Dict[str, int], List[int]]:
+    """content_hash -> id för befintliga kommentar-chunks i de valda ämnena, samt id för rader utan hash.
+
+    Rader utan content_hash är från före backend/sql/chunks_content_hash.sql; de ersätts
+    av hashade rader och räknas därför alltid som inaktuella.
+    """
+    existing: Dict[str, int] = {}
+    legacy: List[int] = []
+    offset = 0
+    while True:
+        page = supabase.table('chunks') \
+            .select('id, content_hash') \
+            .eq('metadata->>content_type', CONTENT_TYPE) \
+            .in_('metadata->>subject', subjects) \
+            .range(offset, offset + PAGE_SIZE - 1) \
+            .execute().data
+        for row in page:
+            if row['content_hash'] is None:
+                legacy.append(row['id'])
+            else:
+                existing[row['content_hash']] = row['id']
+        if len(page) < PAGE_SIZE:
+            break
+        offset += PAGE_SIZE
+    return existing, legacy
+
+
+async def embed_documents(embedder: EmbeddingProvider, texts: List[str]) -> List[List[float]]:
+    """Inbäddar texter med samma motor som sökfrågorna (utan frågecachen, som är till för sökfrågor)."""
+    embeddings: List[List[float]] = []
+    for start in range(0, len(texts), EMBED_BATCH_SIZE):
+        embeddings.extend(await embedder.embed(texts[start:start + EMBED_BATCH_SIZE], kind="document"))
+        print(f"Inbäddade {len(embeddings)}/{len(texts)} chunks")
+    return embeddings
+
+
+def upsert_chunks(supabase, records: List[dict], embeddings: List[List[float]]):
+    """records: {"content", "metadata", "content_hash"}; skrivs i batchar med upsert på hashen."""
+    rows = [
+        {
+            "content": record["content"],
+            "metadata": record["metadata"],
+            "content_hash": record["content_hash"],
+            "embedding": embedding,
+        }
+        for record, embedding in zip(records, embeddings)
+    ]
+    for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+        supabase.table('chunks') \
+            .upsert(rows[start:start + UPSERT_BATCH_SIZE], on_conflict='content_hash') \
+            .execute()
+
+
+def delete_chunks(supabase, ids: List[int]):
+    for start in range(0, len(ids), UPSERT_BATCH_SIZE):
+        supabase.table('chunks').delete().in_('id', ids[start:start + UPSERT_BATCH_SIZE]).execute()
+
+
+async def ingest(
+    subjects: List[str],
+    processes: Optional[int] = None,
+    prune: bool = True,
+    dry_run: bool = False,
+    snapshot_dir: Optional[str] = None,
+    corpus_dir=None,
+    reembed: bool = False,
+    embedder: Optional[EmbeddingProvider] = None,
+) -> dict:
+    """Chunkar, jämför hashar mot databasen och skriver bara ändringarna.
+
+    reembed: inbädda och skriv om alla chunks (efter byte av inbäddningsmotor).
+    embedder: standard är create_embedder() (EMBEDDING_BACKEND), samma motor som API:et.
+    """
+    corpus_dir = corpus_dir or corpus_dir_from_env()
+    started = time.perf_counter()
+    supabase_url = os.getenv("SUPABASE_URL")
+    supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+    if not supabase_url or not supabase_key:
+        raise SystemExit("FEL: Supabase är inte konfigurerat (SUPABASE_URL/SUPABASE_SERVICE_ROLE_KEY).")
+    # Engångskörning i batchar: den synkrona klienten räcker här
+    supabase = create_client(supabase_url, supabase_key)
+
+    corpus = chunk_all(subjects, str(corpus_dir), processes)
+
+    # Identiska chunks (samma hash) lagras en gång; texten läses först för de nya
+    refs: Dict[str, Tuple[str, int]] = {}
+    for subject in subjects:
+        for i, h in enumerate(corpus.subject(subject).hashes):
+            refs.setdefault(h, (subject, i))
+    existing, legacy_ids = fetch_existing(supabase, subjects)
+
+    new_refs = [(h, ref) for h, ref in refs.items() if reembed or h not in existing]
+    stale_ids = [chunk_id for h, chunk_id in existing.items() if h not in refs] if prune else []
+    # Rader utan hash har samma innehåll som de nya hashade raderna: tas bort även med --keep-stale
+    stale_ids += legacy_ids
+
+    summary = {
+        "subjects": subjects,
+        "chunks": len(refs),
+        "unchanged": len(refs) - len(new_refs),
+        "embedded": 0,
+        "deleted": 0,
+        "legacy_without_hash": len(legacy_ids),
+    }
+    print(f"--- {len(refs)} chunks: {len(new_refs)} nya/ändrade, {len(stale_ids)} borttagna ({len(legacy_ids)} utan hash) ---")
+
+    if not dry_run:
+        if new_refs:
+            new_records = [
+                dict(corpus.subject(subject).record(i), content_hash=h)
+                for h, (subject, i) in new_refs
+            ]
+            if embedder is None:
+                embedder = create_embedder()
+                try:
+                    embeddings = await embed_documents(embedder, [r["content"] for r in new_records])
+                finally:
+                    await embedder.close()
+            else:
+                embeddings = await embed_documents(embedder, [r["content"] for r in new_records])
+            upsert_chunks(supabase, new_records, embeddings)
+            summary["embedded"] = len(new_records)
+        if stale_ids:
+            delete_chunks(supabase, stale_ids)
+            summary["deleted"] = len(stale_ids)
+        if snapshot_dir:
+            summary["snapshot_rows"] = export_snapshot_from_supabase(supabase, snapshot_dir, corpus=corpus)
+
+    summary["seconds"] = round(time.perf_counter() - started, 2)
+    return summary
+
+
+async def _main(args):
+    subjects = args.subjects or available_subjects()
+    if args.corpus_only:
+        # Bara korpusen (t.ex. för hybridsökningens BM25-index); ingen databas behövs
+        corpus = chunk_all(subjects, str(args.corpus_dir or corpus_dir_from_env()), args.processes)
+        print(f"Korpus skriven till {corpus.directory}: {sum(len(corpus.subject(s)) for s in subjects)} chunks")
+        return
+    embedder = create_embedder()
+    await http_client.start_http_client()
+    try:
+        summary = await ingest(
+            subjects,
+            processes=args.processes,
+            prune=not args.keep_stale,
+            dry_run=args.dry_run,
+            snapshot_dir=args.snapshot,
+            corpus_dir=args.corpus_dir,
+            reembed=args.reembed,
+            embedder=embedder,
+        )
+    finally:
+        await embedder.close()
+        await http_client.close_http_client()
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Indexerar kommentarmaterialet inkrementellt i chunks-tabellen.")
+    parser.add_argument("--subjects", nargs="*", help="Ämnen att indexera (standard: alla med textfil).")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("INGEST_PROCESSES", "0")) or None)
+    parser.add_argument("--snapshot", help="Skriv även en lokal ögonblicksbild för LocalVectorRetriever till katalogen.")
+    parser.add_argument("--corpus-dir", help="Katalog för den minnesmappade korpusen (standard: CORPUS_DIR).")
+    parser.add_argument("--corpus-only", action="store_true", help="Bygg bara korpusen, utan inbäddning och databas.")
+    parser.add_argument("--keep-stale", action="store_true", help="Ta inte bort chunks som inte längre finns i texterna.")
+    parser.add_argument("--reembed", action="store_true", help="Inbädda om alla chunks (efter byte av EMBEDDING_BACKEND).")
+    parser.add_argument("--dry-run", action="store_true", help="Visa vad som skulle ändras utan att skriva.")
+    asyncio.run(_main(parser.parse_args()))
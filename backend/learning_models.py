@@ -1,3 +1,5 @@
+import copy
+import json
 from pydantic import BaseModel, Field
 from typing import List, Dict, Optional, Literal, Union # Lade till Literal för Pydantic v2-kompatibilitet
 
@@ -49,6 +51,13 @@ class LearningActivityResponse(BaseModel):
     quiz: Optional[QuizActivity] = Field(None, description="Quiz-aktiviteten (om begärd).")
     flashcards: Optional[FlashcardActivity] = Field(None, description="Flashcard-aktiviteten (om begärd).")
     
+class PartialLearningActivityResponse(BaseModel):
+    """Delresultat under strömmad generering: bara de delar som hittills validerats."""
+    response_id: Optional[str] = None
+    explanation: Optional[str] = None
+    quiz: Optional[QuizActivity] = None
+    flashcards: Optional[FlashcardActivity] = None
+    
 # --- Datamodeller för FastAPI-Input (NY) ---
 
 class ActivityRequest(BaseModel):
@@ -58,11 +67,17 @@ class ActivityRequest(BaseModel):
     flashcard_items: int = Field(0, ge=0, le=5, description="Antal flashcard-begrepp att generera.")
     
     subject: str = "laroplan_1-9_fysik.txt"
+    force_regenerate: bool = Field(False, description="Hoppa över resultatcachen och generera ett nytt svar.")
+    user_id: Optional[str] = Field(None, description="Används för rättvis köning av Gemini-anrop mellan användare (annars ämnet).")
     # Validering: Minst en aktivitet måste begäras
     def check_min_activities(self):
         if self.quiz_questions + self.flashcard_items == 0:
             raise ValueError("Minst en quizfråga eller ett flashcard måste begäras.")
 
+class BatchActivityRequest(BaseModel):
+    """Modell för att skapa många jobb i ett anrop (t.ex. en hel arbetsområdesplanering)."""
+    requests: List[ActivityRequest] = Field(..., min_length=1, max_length=50, description="Förfrågningarna som ska bli jobb, i ordning.")
+
 # Modeller för LLM-generering:
 ACTIVITY_SCHEMA = LearningActivityResponse.model_json_schema()
 
@@ -74,6 +89,125 @@ class TextRequest(BaseModel):
 # --- NYA MODELLER FÖR JOBBHANTERING (FIXAT OCH TILLAGT) ---
 class JobStatusResponse(BaseModel):
     job_id: str = Field(..., description="Unikt ID för jobbet.")
-    status: str = Field(..., description="Status: PENDING, COMPLETED, FAILED.")
+    status: str = Field(..., description="Status: PENDING, RUNNING, COMPLETED, FAILED.")
     result: Optional[Union[LearningActivityResponse, dict]] = Field(None, description="Genererade aktiviteter om status är COMPLETED.")
     error_message: Optional[str] = Field(None, description="Felmeddelande om status är FAILED.")
+    partial_result: Optional[PartialLearningActivityResponse] = Field(None, description="Delresultat medan jobbet genereras (strömmat läge).")
+
+class BatchJobResponse(BaseModel):
+    status: str = Field(..., description="PENDING om minst ett jobb köades, annars COMPLETED.")
+    job_ids: List[str] = Field(..., description="Jobb-ID:n i samma ordning som förfrågningarna.")
+
+
+# --- SCHEMA-REGISTER FÖR GEMINI ---
+# Varje svarsmodell löses upp en gång (vid import/registrering) i stället för vid varje jobb.
+# PayloadTemplate håller hela generateContent-payloaden förserialiserad, så att bara
+# prompttexterna behöver skarvas in per anrop.
+
+def resolve_pydantic_schema(schema: dict) -> dict:
+    """Löser upp Pydantic-schemat (tar bort $defs och löser $ref:s) för Gemini API."""
+    schema_copy = json.loads(json.dumps(schema)) 
+    
+    if '$defs' not in schema_copy:
+        definitions = {}
+    else:
+        definitions = schema_copy.pop('$defs') 
+
+    def replace_refs(obj):
+        if isinstance(obj, dict):
+            if 'const' in obj:
+                const_value = obj.pop('const') 
+                obj['enum'] = [const_value]
+            
+            if '$ref' in obj and obj['$ref'].startswith('#/$defs/'):
+                def_name = obj['$ref'].split('/')[-1]
+                return replace_refs(definitions.get(def_name, obj).copy())
+
+            for key, value in obj.items():
+                obj[key] = replace_refs(value)
+            
+            if 'anyOf' in obj and isinstance(obj['anyOf'], list):
+                obj['anyOf'] = [replace_refs(item) for item in obj['anyOf']]
+
+            return obj
+
+        elif isinstance(obj, list):
+            return [replace_refs(item) for item in obj]
+            
+        return obj
+    
+    cleaned_properties = replace_refs(schema_copy['properties'])
+    
+    return {
+        "type": "object",
+        "title": schema_copy.get('title', 'GeneratedSchema'),
+        "properties": cleaned_properties,
+        "required": schema_copy.get('required', []) 
+    }
+
+
+class PayloadTemplate:
+    """Förserialiserad Gemini-payload med platshållare för användar- och systemprompt."""
+
+    _USER = "\x00USER_PROMPT\x00"
+    _SYSTEM = "\x00SYSTEM_INSTRUCTION\x00"
+
+    def __init__(self, response_schema: dict):
+        skeleton = {
+            "contents": [{"parts": [{"text": self._USER}]}],
+            "systemInstruction": {"parts": [{"text": self._SYSTEM}]},
+            "generationConfig": {
+                "responseMimeType": "application/json",
+                "responseSchema": response_schema
+            },
+        }
+        serialized = json.dumps(skeleton, ensure_ascii=False)
+        head, rest = serialized.split(json.dumps(self._USER, ensure_ascii=False))
+        middle, tail = rest.split(json.dumps(self._SYSTEM, ensure_ascii=False))
+        self._parts = (head, middle, tail)
+        self._system_json: Optional[str] = None
+
+    def bind_system(self, system_instruction: str) -> "PayloadTemplate":
+        """Kopia med en fast systemprompt som serialiseras en gång; render() behöver då bara användarprompten."""
+        bound = copy.copy(self)
+        bound._system_json = json.dumps(system_instruction, ensure_ascii=False)
+        return bound
+
+    def render(self, user_prompt: str, system_instruction: Optional[str] = None) -> str:
+        """Returnerar den färdiga JSON-kroppen; bara prompttexterna serialiseras."""
+        head, middle, tail = self._parts
+        system_json = self._system_json if system_instruction is None else json.dumps(system_instruction, ensure_ascii=False)
+        return (
+            head
+            + json.dumps(user_prompt, ensure_ascii=False)
+            + middle
+            + system_json
+            + tail
+        )
+
+
+_RESPONSE_SCHEMAS: Dict[type, dict] = {}
+_PAYLOAD_TEMPLATES: Dict[type, PayloadTemplate] = {}
+
+
+def register_response_model(model: type) -> type:
+    """Löser upp och cachar schemat och payload-mallen för en svarsmodell (kan användas som dekorator)."""
+    if model not in _RESPONSE_SCHEMAS:
+        schema = resolve_pydantic_schema(model.model_json_schema())
+        _RESPONSE_SCHEMAS[model] = schema
+        _PAYLOAD_TEMPLATES[model] = PayloadTemplate(schema)
+    return model
+
+
+def get_response_schema(model: type) -> dict:
+    """Det upplösta Gemini-schemat för modellen (delas, får inte ändras)."""
+    register_response_model(model)
+    return _RESPONSE_SCHEMAS[model]
+
+
+def get_payload_template(model: type) -> PayloadTemplate:
+    register_response_model(model)
+    return _PAYLOAD_TEMPLATES[model]
+
+
+register_response_model(LearningActivityResponse)
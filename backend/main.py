@@ -5,15 +5,16 @@ import uuid
 import time
 
 import asyncio
+from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks 
-from pydantic import BaseModel, Field
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 
 from dotenv import load_dotenv
-from supabase import create_client, Client
 
 from datetime import datetime, timezone 
-from typing import List, Optional, Union 
+from typing import Callable, List, Optional, Union 
 
 from starlette.concurrency import run_in_threadpool
 
@@ -22,246 +23,612 @@ from backend.learning_models import (
     LearningActivityResponse, 
     ActivityRequest, 
     ACTIVITY_SCHEMA, 
+    get_payload_template,
     TextRequest, 
-    JobStatusResponse
+    JobStatusResponse,
+    BatchActivityRequest,
+    BatchJobResponse,
+    PartialLearningActivityResponse,
+    QuizQuestion,
+    FlashcardItem
 ) 
+from backend.utils import http_client
+from backend.utils.embedding_cache import EmbeddingCache, normalize_query
+from backend.utils.embeddings import DEFAULT_GEMINI_API_BASE, EMBED_RETRY, create_embed_scheduler, create_embedding_provider
+from backend.utils.result_cache import SemanticResultCache
+from backend.utils.retrievers import create_retriever
+from backend.utils.repository import SupabaseRepository, JOB_PROGRESS_COLUMNS, JOB_RESULT_COLUMNS
+from backend.utils.services import ServiceContainer
+from backend.utils.single_flight import SingleFlight
+from backend.utils.context_builder import ContextBuilder, PromptStats
+from backend.utils.status_cache import FinishedJobCache, content_etag, etag_matches, finished_etag, progress_etag
+from backend.utils.job_events import JobEventBus, TERMINAL_STATUSES
+from backend.utils.stream_json import IncrementalJsonParser
+from backend.utils.metrics import LatencyRecorder
+from backend.utils.resilience import (
+    CircuitBreaker,
+    RetryPolicy,
+    call_with_resilience,
+    job_deadline,
+)
+from backend.utils.rate_limiter import QuotaScheduler, estimate_tokens, fairness_key
 
 
 load_dotenv()
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") 
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-09-2025:generateContent"
+# Kan pekas om, t.ex. mot den falska Gemini-servern i backend/benchmarks/bench_load.py
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", DEFAULT_GEMINI_API_BASE).rstrip("/")
+GEMINI_API_URL = f"{GEMINI_API_BASE}/models/gemini-2.5-flash-preview-09-2025:generateContent"
+GEMINI_STREAM_URL = f"{GEMINI_API_BASE}/models/gemini-2.5-flash-preview-09-2025:streamGenerateContent"
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-EMBEDDING_DIMENSION = 768
 
-if not GEMINI_API_KEY:
-    print("VARNING: GEMINI_API_KEY saknas i .env. LLM-generering kommer att misslyckas.")
+# "background": jobben körs som BackgroundTasks i API-workern (standard).
+# "worker": API:et skapar bara PENDING-rader och `python -m backend.worker` kör dem.
+JOB_EXECUTION_MODE = os.getenv("JOB_EXECUTION_MODE", "background").lower()
 
-def resolve_pydantic_schema(schema: dict) -> dict:
-    """Löser upp Pydantic-schemat (tar bort $defs och löser $ref:s) för Gemini API."""
-    schema_copy = json.loads(json.dumps(schema)) 
-    
-    if '$defs' not in schema_copy:
-        definitions = {}
-    else:
-        definitions = schema_copy.pop('$defs') 
+# Total tidsbudget per jobb (alla inbäddnings-, sök- och genereringsanrop inklusive retries)
+JOB_DEADLINE_SECONDS = float(os.getenv("JOB_DEADLINE_SECONDS", "90"))
 
-    def replace_refs(obj):
-        if isinstance(obj, dict):
-            if 'const' in obj:
-                const_value = obj.pop('const') 
-                obj['enum'] = [const_value]
-            
-            if '$ref' in obj and obj['$ref'].startswith('#/$defs/'):
-                def_name = obj['$ref'].split('/')[-1]
-                return replace_refs(definitions.get(def_name, obj).copy())
+# Antal extra genereringar när Gemini svarar med JSON som inte klarar valideringen
+SCHEMA_RETRIES = 1
 
-            for key, value in obj.items():
-                obj[key] = replace_refs(value)
-            
-            if 'anyOf' in obj and isinstance(obj['anyOf'], list):
-                obj['anyOf'] = [replace_refs(item) for item in obj['anyOf']]
+# Strömmad generering (streamGenerateContent) med delresultat i jobbposten
+GEMINI_STREAMING = os.getenv("GEMINI_STREAMING", "0").lower() in ("1", "true", "yes")
 
-            return obj
+# Asynkront dataåtkomstlager (AsyncClient ansluts i lifespan eller vid första anropet)
+db = SupabaseRepository.from_env()
 
-        elif isinstance(obj, list):
-            return [replace_refs(item) for item in obj]
-            
-        return obj
-    
-    cleaned_properties = replace_refs(schema_copy['properties'])
-    
-    final_schema = {
-        "type": "object",
-        "title": schema_copy.get('title', 'GeneratedSchema'),
-        "properties": cleaned_properties,
-        "required": schema_copy.get('required', []) 
-    }
-    print("DEBUG: JSON Schema sanerat (tog bort $defs, löste $ref, konverterade 'const' till 'enum').")
-    return final_schema
+# Vektorhämtning: Supabase-RPC (standard) eller lokalt index i processen
+retriever = create_retriever(db)
 
- 
 
-# Initiera Supabase-klienten
-try:
-    if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
-        raise ValueError("Supabase URL eller Service Key saknas i .env")
-        
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-    print("--- Supabase-klient initierad. ---")
-except Exception as e:
-    print(f"FEL: Kunde inte initiera Supabase: {e}")
-    supabase = None
-    
-print("API:et är nu redo för snabba förfrågningar!")
+def log_configuration():
+    """Skriver ut konfigurationen vid start (inte vid import, så att skript och workers importerar tyst)."""
+    if not GEMINI_API_KEY:
+        print("VARNING: GEMINI_API_KEY saknas i .env. LLM-generering kommer att misslyckas.")
+    if not db.configured:
+        print("FEL: Kunde inte initiera Supabase: Supabase URL eller Service Key saknas i .env")
+    print(f"--- Retriever: {retriever.name} ---")
+    print(f"--- Inbäddning: {embedder.name} ({embedder.model}) ---")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startar tjänsterna i WARM_SERVICES vid start och stänger alla startade tjänster vid avslut."""
+    log_configuration()
+    await services.start()
+    print("API:et är nu redo för snabba förfrågningar!")
+    try:
+        yield
+    finally:
+        await services.close()
+
 
 # --- FASTAPI SETUP ---
 app = FastAPI(
     title="Kriterium AI Aktivitetsgenerator",
     description="Lokal service för inbäddning, RAG och generering av olika lärandeaktiviteter med asynkron jobbskötsel.",
+    lifespan=lifespan,
 )
 
+# Cache för inbäddningar av frågor (samma frågor återkommer ofta)
+
+# Förserialiserad generateContent-payload för aktivitetsschemat
+ACTIVITY_PAYLOAD_TEMPLATE = get_payload_template(LearningActivityResponse)
+
+# Systemprompten är densamma för alla jobb (antal aktiviteter står i användarprompten),
+# så den serialiseras en gång tillsammans med schemat.
+SYSTEM_INSTRUCTION = """Du är en inspirerande och pedagogisk lärare som hjälper elever att bemästra skolämnen enligt den svenska läroplanen (Lgr22).
+
+DINA TVÅ KÄLLOR:
+1. LÄROPLANEN (RAG Chunks): Använd denna ENDAST för att kalibrera nivån (årskurs) och för att se vilka centrala begrepp som eleven förväntas lära sig.
+2. DIN EXPERTKUNSKAP: Använd din inbyggda kunskap för att förklara de faktiska ämnena (t.ex. fysik, biologi, historia).
+
+STRÄNGA INSTRUKTIONER:
+- FRÅGEFOKUS: Quizza ALDRIG på läroplanens formella text (t.ex. "vad står i betygskriterierna"). Quizza på ÄMNET (t.ex. "Vad är en foton?") utifrån den nivå läroplanen anger.
+- PEDAGOGIK: Förklara svåra koncept med liknelser som passar en elev i den aktuella årskursen.
+- JSON-FORMAT: Leverera ALLTID strikt JSON enligt schemat.
+- BILDER: 'image_generation_prompt' ska vara på engelska, beskrivande och visuellt inriktad.
+- MÅL: Skapa exakt så många quiz-frågor och flashcards om ämnet som användaren anger."""
+
+USER_PROMPT_TEMPLATE = """Generera följande aktiviteter med svårighet baserat på den hämtade läroplanstexten:
+
+- Antal QUIZ-frågor: {quiz_questions}
+- Antal FLASHCARDS: {flashcard_items}
+
+HÄMTAD KÄLLTEXT:
+---
+{chunks_text}
+---
+
+Användarens önskemål/fokus: "{query}"
+
+Viktigt: Leverera svaret i det strikta JSON-formatet. Om en aktivitet inte efterfrågas, sätt dess sektion till null."""
+
+GENERATION_PAYLOAD_TEMPLATE = ACTIVITY_PAYLOAD_TEMPLATE.bind_system(SYSTEM_INSTRUCTION)
+# Allt i indata som inte beror på jobbet: systemprompt, promptmall och payloaden med
+# svarsschemat (Gemini räknar även responseSchema som indatatokens)
+STATIC_PROMPT_TOKENS = estimate_tokens(GENERATION_PAYLOAD_TEMPLATE.render(
+    USER_PROMPT_TEMPLATE.format(quiz_questions=0, flashcard_items=0, chunks_text="", query="")
+))
+
+# RAG-kontext: relevansordning, nära dubbletter bort och tokenbudget (RAG_CONTEXT_TOKENS)
+context_builder = ContextBuilder.from_env()
+prompt_stats = PromptStats()
+
+# Semantisk cache för färdiga jobbresultat (nära dubbletter av tidigare frågor)
+result_cache = SemanticResultCache.from_env()
+
+# Serialiserade svar för färdiga jobb i /status/{job_id}
+finished_jobs = FinishedJobCache.from_env()
+
+# Pågående genereringar per dedup_key; identiska jobb ansluter i stället för att köra igen
+job_flights = SingleFlight()
+
+# Pub/sub för statusövergångar (matar /status/{job_id}/stream)
+job_events = JobEventBus()
+
+# Tid till första innehåll respektive total genereringstid (strömmat läge)
+time_to_first_content = LatencyRecorder()
+generation_latency = LatencyRecorder()
+
+# Hur ofta SSE-strömmen gör en lätt statusfråga när jobbet körs i en annan process
+SSE_FALLBACK_POLL_SECONDS = float(os.getenv("SSE_FALLBACK_POLL_SECONDS", "2.0"))
+
+# Retry-policyer och circuit breakers per utgående tjänst (inbäddningens EMBED_RETRY finns i backend/utils/embeddings.py)
+GENERATE_RETRY = RetryPolicy(max_attempts=3, base_delay=1.0, max_delay=10.0)
+STREAM_RETRY = RetryPolicy(max_attempts=1)  # delresultat har redan skickats, så ingen omstart
+RETRIEVER_RETRY = RetryPolicy(max_attempts=2, base_delay=0.2, max_delay=2.0)
+
+# Kvoter per Gemini-endpoint (anrop/min, tokens/min, samtidiga anrop).
+# Alla jobb i processen delar på dem och turas om per användare/ämne.
+embed_scheduler = create_embed_scheduler()
+generate_scheduler = QuotaScheduler.from_env("gemini-generate", "GEMINI_GENERATE", rpm=1000, tpm=1_000_000, concurrency=8)
+
+# Uppskattat antal svarstokens per generering (rättas i efterhand med usageMetadata)
+GENERATE_OUTPUT_TOKENS = int(os.getenv("GEMINI_GENERATE_OUTPUT_TOKENS", "2000"))
+
+gemini_embed_breaker = CircuitBreaker("gemini-embed")
+gemini_generate_breaker = CircuitBreaker("gemini-generate")
+retriever_breaker = CircuitBreaker("retriever")
+
+# Inbäddning av frågor: Gemini (standard) eller lokal ONNX-modell (EMBEDDING_BACKEND=local)
+embedder = create_embedding_provider(GEMINI_API_KEY, embed_scheduler, gemini_embed_breaker, EMBED_RETRY, GEMINI_API_BASE)
+
+# Cachen är per modell, så vektorer från olika motorer blandas aldrig
+embedding_cache = EmbeddingCache.from_env(embedder.model)
+
+# Delade backends startas en gång: i lifespan om de står i WARM_SERVICES, annars vid första användningen
+services = ServiceContainer.from_env()
+services.add("http", http_client.start_http_client, http_client.close_http_client)
+if db.configured:
+    services.add("db", db.connect, db.close)
+services.add("retriever", lambda: run_in_threadpool(retriever.load))
+services.add("embedder", embedder.warm, embedder.close)
+services.add("embedding_cache", embedding_cache.start, embedding_cache.close)
+services.add("result_cache", lambda: start_result_cache(), lambda: stop_result_cache())
+
 # Hjälpfunktioner
 
-async def fetch_relevant_chunks(query: str, subject: str, match_count: int = 8) -> List[str]:
-    """Hämtar relevanta chunks från Supabase m.h.a. vektor-sökning."""
-    if not GEMINI_API_KEY:
+def publish_job_event(job_ids: List[str], status: str, result: Optional[dict] = None, error_message: Optional[str] = None, partial: Optional[dict] = None):
+    """Publicerar en statusövergång (eller ett nytt delresultat) för alla angivna jobb."""
+    for job_id in job_ids:
+        job_events.publish(job_id, {
+            'job_id': job_id,
+            'status': status,
+            'result': result,
+            'error_message': error_message,
+            'partial': partial,
+        })
+
+
+def empty_partial() -> dict:
+    """Delresultat utan innehåll; publiceras också för att nollställa klienternas vy."""
+    return {"response_id": None, "explanation": None, "quiz": None, "flashcards": None}
+
+
+class PartialResultWriter:
+    """
+    Publicerar delresultat direkt och sparar dem i jobbposten (status RUNNING).
+    Skrivningar slås ihop: medan en skrivning pågår sparas bara det senaste delresultatet.
+    """
+
+    def __init__(self, job_ids: List[str], save: Callable):
+        self.job_ids = job_ids
+        self.save = save
+        self._latest: Optional[dict] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __call__(self, partial: dict):
+        publish_job_event(self.job_ids, 'RUNNING', partial=partial)
+        self._latest = partial
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        while self._latest is not None:
+            partial, self._latest = self._latest, None
+            try:
+                await self.save(self.job_ids, partial)
+            except Exception as e:
+                print(f"VARNING: Kunde inte spara delresultat: {e}")
+
+    async def drain(self):
+        """Väntar in pågående skrivning innan slutresultatet sparas."""
+        if self._task is not None:
+            await self._task
+
+
+async def save_partial_result(job_ids: List[str], partial: dict):
+    """Sparar ett delresultat i result_data medan jobbet fortfarande pågår."""
+    await db.save_partial(job_ids, partial)
+
+
+async def embed_query(query: str) -> List[float]:
+    """Skapar inbäddning för en fråga, via cachen om frågan redan har inbäddats."""
+    cached = await embedding_cache.get(query)
+    if cached is not None:
+        return cached
+
+    query_embedding = (await embedder.embed([query]))[0]
+    embedding_cache.put(query, query_embedding)
+    return query_embedding
+
+
+async def embed_queries(queries: List[str]) -> List[List[float]]:
+    """Inbäddar flera frågor; cachemissar skickas i ett batchanrop till inbäddningsmotorn."""
+    embeddings: List[Optional[List[float]]] = [await embedding_cache.get(q) for q in queries]
+    missing = list(dict.fromkeys(q for q, e in zip(queries, embeddings) if e is None))
+
+    fetched = dict(zip(missing, await embedder.embed(missing)))
+    for q, embedding in fetched.items():
+        embedding_cache.put(q, embedding)
+
+    return [e if e is not None else fetched[q] for q, e in zip(queries, embeddings)]
+
+
+# Resultatcachen fylls även med jobb som andra processer har gjort klart (se result_cache.py)
+RESULT_CACHE_REFRESH_BATCH = 200
+_result_cache_since: Optional[str] = None
+_result_cache_refresher: Optional[asyncio.Task] = None
+
+
+async def load_completed_jobs(rows: List[dict]) -> int:
+    """Lägger COMPLETED-rader från activity_jobs i resultatcachen; frågorna inbäddas i ett batchanrop."""
+    if not rows:
+        return 0
+    requests = [ActivityRequest.model_validate_json(row['request_data']) for row in rows]
+    embeddings = await embed_queries([r.query for r in requests])
+    loaded = 0
+    for row, request, query_embedding in zip(rows, requests, embeddings):
+        completed_at = datetime.fromisoformat(row['completed_at']).timestamp() if row.get('completed_at') else None
+        if result_cache.store(request, query_embedding, row['job_id'], row['result_data'], created_at=completed_at, skip_covered=True):
+            loaded += 1
+    result_cache.loaded += loaded
+    return loaded
+
+
+async def start_result_cache():
+    """Förvärmer resultatcachen med de senaste COMPLETED-jobben och startar den periodiska påfyllningen."""
+    global _result_cache_since, _result_cache_refresher
+    if not db.configured or not embedder.configured:
+        return
+
+    _result_cache_since = datetime.now(timezone.utc).isoformat()
+    if result_cache.warm_limit > 0:
+        try:
+            # Äldst först så att de nyaste hamnar sist (och överlever längst)
+            rows = list(reversed(await db.recent_completed(result_cache.warm_limit)))
+            if rows and rows[-1].get('completed_at'):
+                _result_cache_since = rows[-1]['completed_at']
+            loaded = await load_completed_jobs(rows)
+            print(f"--- Resultatcache förvärmd med {loaded} jobb. ---")
+        except Exception as e:
+            print(f"VARNING: Kunde inte förvärma resultatcachen: {e}")
+
+    if result_cache.refresh_seconds > 0 and _result_cache_refresher is None:
+        _result_cache_refresher = asyncio.create_task(refresh_result_cache())
+
+
+async def refresh_result_cache():
+    """Hämtar jobb som blivit klara sedan förra gången (även i andra workers)."""
+    global _result_cache_since
+    while True:
+        await asyncio.sleep(result_cache.refresh_seconds)
+        try:
+            rows = await db.completed_since(_result_cache_since, RESULT_CACHE_REFRESH_BATCH)
+            if rows:
+                _result_cache_since = rows[-1]['completed_at']
+                await load_completed_jobs(rows)
+        except Exception as e:
+            print(f"VARNING: Kunde inte fylla på resultatcachen: {e}")
+
+
+async def stop_result_cache():
+    global _result_cache_refresher
+    if _result_cache_refresher is not None:
+        _result_cache_refresher.cancel()
+        _result_cache_refresher = None
+
+
+async def fetch_relevant_chunks(query: str, subject: str, match_count: int = 8, query_embedding: Optional[List[float]] = None) -> List[dict]:
+    """Hämtar relevanta chunks m.h.a. vektor-sökning (via den konfigurerade retrievern).
+
+    Returnerar retrieverns rader ({"content", "similarity", "metadata"}, ev. "embedding").
+    """
+    if not embedder.configured:
         raise Exception("Gemeni nyckel saknas.")
 
     try:
-        # 1. Skapa inbäddning för användarens fråga (CPU-intensivt, körs i trådpool)
-        async with httpx.AsyncClient(timeout=10.0) as client: 
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/text-embedding-004:embedContent?key={GEMINI_API_KEY}"
-            payload = {
-                "model": "models/text-embedding-004",
-                "content": {"parts": [{"text": query}]}
-            }
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            query_embedding = response.json()['embedding']['values']
+        # 1. Skapa inbäddning för användarens fråga (cachad), om den inte redan är beräknad
+        if query_embedding is None:
+            query_embedding = await embed_query(query)
 
     except Exception as e:
         raise Exception(f"Kunde inte skapa inbäddning: {str(e)}")
 
-    # 2. Supabase-sökning via RPC
+    # 2. Vektorsökning (Supabase-RPC eller lokalt index, samma filter; i hybridläge BM25 först)
     try:
-        subject_filter = {"subject": subject}
-        print(f"DEBUG: Använder RAG-filter: {subject_filter}")    
-        def _supabase_rpc_call():
-            """Kallar RPC synkront i trådpoolen."""
-            subject_filter = {"subject": subject, 
-                              "grade_level": "7-9"}
-            
-            print(f"DEBUG: Använder RAG-filter: {subject_filter}")
-            
-            res = supabase.rpc(
-                'match_chunks', 
-                {
-                    'query_embedding': query_embedding,
-                    'match_count': match_count,
-                    'filter': subject_filter
-                }
-            ).execute()
-            return res.data
-        
-        
-        res_data: List[dict] =  await run_in_threadpool(_supabase_rpc_call)
-        print("found chunks", res_data)
+        subject_filter = {"subject": subject, 
+                          "grade_level": "7-9"}
+        print(f"DEBUG: Använder RAG-filter: {subject_filter} ({retriever.name})")
+        await services.ensure("retriever")
+
+        res_data: List[dict] = await call_with_resilience(
+            lambda: retriever.search(query_embedding, match_count, subject_filter, query_text=query),
+            breaker=retriever_breaker, policy=RETRIEVER_RETRY, name=f"{retriever.name}-sökning"
+        )
+        print(f"DEBUG: Hittade {len(res_data or [])} chunks")
         
         if not res_data:
             print("Varning: Ingen matchande data hittades i Supabase.")
             return []
 
-        chunks_content = [item['content'] for item in res_data]
-        return chunks_content
+        return res_data
         
     except Exception as e:
-        print(f"FEL vid Supabase RAG-sökning: {e}")
+        print(f"FEL vid RAG-sökning ({retriever.name}): {e}")
         raise Exception(f"Kunde inte söka i databasen. Kontrollera Supabase RPC-funktionens namn och definition: {str(e)}")
 
 
-async def generate_activities_with_llm(chunks: List[str], request: ActivityRequest) -> dict:
-    """Anropar Gemini LLM för att generera aktiviteter i strikt JSON-format."""
+def build_generation_payload(chunks: List[str], request: ActivityRequest) -> str:
+    """Bygger prompten och den serialiserade Gemini-payloaden (samma för vanlig och strömmad generering).
+
+    chunks är den färdiga kontexten från context_builder (redan rensad och inom budget).
+    """
+    user_query = USER_PROMPT_TEMPLATE.format(
+        quiz_questions=request.quiz_questions,
+        flashcard_items=request.flashcard_items,
+        chunks_text="\n---\n".join(chunks),
+        query=request.query,
+    )
+    # Schemat och systemprompten är redan serialiserade (se learning_models)
+    return GENERATION_PAYLOAD_TEMPLATE.render(user_query)
+
+
+async def generate_activities_with_llm(chunks: List[str], request: ActivityRequest, usage: Optional[dict] = None) -> dict:
+    """Anropar Gemini LLM för att generera aktiviteter i strikt JSON-format.
+
+    usage fylls med Geminis usageMetadata (t.ex. promptTokenCount) om den anges.
+    """
     if not GEMINI_API_KEY:
         raise Exception("Gemini API Key saknas. Kan inte generera aktiviteter.")
 
-    unique_chunks = list(dict.fromkeys(chunks))
-    
-    system_instruction = f"""
-    Du är en inspirerande och pedagogisk lärare som hjälper elever att bemästra skolämnen enligt den svenska läroplanen (Lgr22).
-
-    DINA TVÅ KÄLLOR:
-    1. LÄROPLANEN (RAG Chunks): Använd denna ENDAST för att kalibrera nivån (årskurs) och för att se vilka centrala begrepp som eleven förväntas lära sig.
-    2. DIN EXPERTKUNSKAP: Använd din inbyggda kunskap för att förklara de faktiska ämnena (t.ex. fysik, biologi, historia).
-
-    STRÄNGA INSTRUKTIONER:
-    - FRÅGEFOKUS: Quizza ALDRIG på läroplanens formella text (t.ex. "vad står i betygskriterierna"). Quizza på ÄMNET (t.ex. "Vad är en foton?") utifrån den nivå läroplanen anger.
-    - PEDAGOGIK: Förklara svåra koncept med liknelser som passar en elev i den aktuella årskursen.
-    - JSON-FORMAT: Leverera ALLTID strikt JSON enligt schemat.
-    - BILDER: 'image_generation_prompt' ska vara på engelska, beskrivande och visuellt inriktad.
-    
-    MÅL:
-    - Skapa exakt {request.quiz_questions} quiz-frågor om ämnet.
-    - Skapa exakt {request.flashcard_items} flashcards om ämnet.
+    payload = build_generation_payload(chunks, request)
+    estimated_tokens = estimate_tokens(payload) + GENERATE_OUTPUT_TOKENS
+    started = time.perf_counter()
+
+    async def _generate():
+        async with generate_scheduler.slot(tokens=estimated_tokens) as grant:
+            response = await http_client.post(
+                f"{GEMINI_API_URL}?key={GEMINI_API_KEY}",
+                headers={'Content-Type': 'application/json'},
+                content=payload,
+                timeout=http_client.GENERATE_TIMEOUT,
+            )
+            response.raise_for_status()
+            result = response.json()
+            grant.settle(result.get('usageMetadata', {}).get('totalTokenCount'))
+            if usage is not None:
+                usage.update(result.get('usageMetadata', {}))
+            return result
+
+    # Nätverks-/serverfel hanteras av resiliens-lagret (backoff, Retry-After, breaker).
+    # Ogiltig JSON från modellen är inget nätverksfel: då genereras svaret om direkt.
+    for attempt in range(SCHEMA_RETRIES + 1):
+        try:
+            result = await call_with_resilience(
+                _generate, breaker=gemini_generate_breaker, policy=GENERATE_RETRY, name="generateContent"
+            )
+        except Exception as e:
+            raise Exception(f"LLM-API-fel: {str(e)}")
+
+        try:
+            if 'candidates' not in result or not result['candidates']:
+                raise KeyError("Missing 'candidates' in Gemini response.")
+
+            json_text = result['candidates'][0]['content']['parts'][0]['text']
+            
+            validated_activities = LearningActivityResponse.model_validate_json(json_text) 
+            generation_latency.record((time.perf_counter() - started) * 1000)
+            
+            return validated_activities.model_dump() 
+            
+        except Exception as e:
+            if attempt < SCHEMA_RETRIES:
+                print(f"LLM-svaret klarade inte valideringen ({e}), genererar om...")
+                continue
+            raise Exception(f"LLM genererade ogiltig JSON efter {SCHEMA_RETRIES + 1} försök. Fel: {str(e)}")
+
+
+# Delar av svaret som valideras och visas så fort de är kompletta
+_STREAM_PATHS = {
+    ("response_id",),
+    ("explanation",),
+    ("quiz", "topic"),
+    ("quiz", "questions", "*"),
+    ("flashcards", "topic"),
+    ("flashcards", "items", "*"),
+}
+
+
+async def generate_activities_streaming(chunks: List[str], request: ActivityRequest, on_partial: Callable[[dict], None], usage: Optional[dict] = None) -> dict:
     """
-    
-    chunks_text = "\n---\n".join(unique_chunks) 
-    
-    user_query = f"""
-    Generera följande aktiviteter med svårighet baserat på den hämtade läroplanstexten:
-    
-    - Antal QUIZ-frågor: {request.quiz_questions}
-    - Antal FLASHCARDS: {request.flashcard_items}
-    
-    HÄMTAD KÄLLTEXT:
-    ---
-    {chunks_text}
-    ---
-    
-    Användarens önskemål/fokus: "{request.query}"
-    
-    Viktigt: Leverera svaret i det strikta JSON-formatet. Om en aktivitet inte efterfrågas, sätt dess sektion till null.
+    Strömmad generering via streamGenerateContent. Varje komplett quizfråga/flashcard
+    valideras direkt mot learning_models och skickas till on_partial som ett
+    PartialLearningActivityResponse. Returnerar det fullständiga, validerade svaret.
     """
-    
+    if not GEMINI_API_KEY:
+        raise Exception("Gemini API Key saknas. Kan inte generera aktiviteter.")
+
+    payload = build_generation_payload(chunks, request)
+    parser = IncrementalJsonParser(lambda path: path in _STREAM_PATHS)
+    partial = empty_partial()
+    skipped = 0
+    started = time.perf_counter()
+    first_content_at = None
+    estimated_tokens = estimate_tokens(payload) + GENERATE_OUTPUT_TOKENS
+
+    async def _stream():
+        nonlocal first_content_at, skipped
+        async with generate_scheduler.slot(tokens=estimated_tokens) as grant:
+            async with http_client.stream(
+                "POST",
+                f"{GEMINI_STREAM_URL}?alt=sse&key={GEMINI_API_KEY}",
+                headers={'Content-Type': 'application/json'},
+                content=payload,
+                timeout=http_client.GENERATE_TIMEOUT,
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    response.raise_for_status()
+
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    chunk = json.loads(line[len("data:"):])
+                    if 'usageMetadata' in chunk:
+                        grant.settle(chunk['usageMetadata'].get('totalTokenCount'))
+                        if usage is not None:
+                            usage.update(chunk['usageMetadata'])
+                    candidates = chunk.get('candidates') or []
+                    if not candidates:
+                        continue
+                    text = "".join(part.get('text', '') for part in candidates[0].get('content', {}).get('parts', []))
+
+                    updated = False
+                    for path, value in parser.feed(text):
+                        if path[-1] == "*":
+                            section, field = path[0], path[1]
+                            item_model = QuizQuestion if section == "quiz" else FlashcardItem
+                            try:
+                                item = item_model.model_validate(value).model_dump()
+                            except ValidationError as e:
+                                # Ett ogiltigt objekt ska inte kasta bort det som redan visats: hoppa över det
+                                skipped += 1
+                                print(f"VARNING: Hoppar över ogiltigt objekt i {section}.{field}: {e.errors()[0].get('msg')}")
+                                continue
+                            if partial[section] is None:
+                                partial[section] = {"topic": "", field: []}
+                            partial[section].setdefault(field, []).append(item)
+                        elif len(path) == 2:
+                            if partial[path[0]] is None:
+                                partial[path[0]] = {"topic": value, "questions" if path[0] == "quiz" else "items": []}
+                            else:
+                                partial[path[0]]["topic"] = value
+                        else:
+                            partial[path[0]] = value
+                        updated = True
+
+                    if updated:
+                        if first_content_at is None:
+                            first_content_at = time.perf_counter()
+                            time_to_first_content.record((first_content_at - started) * 1000)
+                        on_partial(PartialLearningActivityResponse.model_validate(partial).model_dump())
+
+    await call_with_resilience(
+        _stream, breaker=gemini_generate_breaker, policy=STREAM_RETRY, name="streamGenerateContent"
+    )
+
+    if skipped:
+        # Slutresultatet ska stämma med delresultaten: bara de objekt som validerades under strömningen
+        data = json.loads(parser.buffer)
+        for section, field in (("quiz", "questions"), ("flashcards", "items")):
+            if isinstance(data.get(section), dict):
+                data[section][field] = (partial[section] or {}).get(field, [])
+        validated_activities = LearningActivityResponse.model_validate(data)
+    else:
+        validated_activities = LearningActivityResponse.model_validate_json(parser.buffer)
+    generation_latency.record((time.perf_counter() - started) * 1000)
+    return validated_activities.model_dump()
+
+# --- NY PROCESS SOM KÖRS I BAKGRUNDEN (TILLAGT) ---
+
+
+async def _generate_for_request(job_id: str, request: ActivityRequest, query_embedding: List[float], on_partial: Optional[Callable[[dict], None]] = None) -> dict:
+    """RAG-hämtning och LLM-generering för ett jobb som inte fanns i resultatcachen."""
+    # 1. Hämta relevanta chunks (RAG Retrieval)
+    retrieved = await fetch_relevant_chunks(request.query, request.subject, query_embedding=query_embedding)
+
+    if not retrieved:
+        raise Exception("Hittade ingen relevant läroplanstext för frågan.")
+
+    # 2. Kontext inom tokenbudgeten, utan (nära) dubbletter
+    context = context_builder.build(retrieved)
+    estimated_prompt_tokens = STATIC_PROMPT_TOKENS + context.tokens + estimate_tokens(request.query)
+    print(
+        f"JOBB {job_id}: Hämtade {context.retrieved} chunks, {len(context.chunks)} i kontexten "
+        f"({context.tokens} tokens; {context.duplicates} dubbletter, {context.over_budget} över budget)"
+    )
+
+    # 3. Skicka chunks + prompt till LLM för generering (RAG Generation)
+    usage: dict = {}
     try:
-        cleaned_schema = resolve_pydantic_schema(ACTIVITY_SCHEMA)
-    except Exception as e:
-        print(f"FATALT FEL vid sanering av JSON-schema: {e}")
-        raise Exception(f"Internt fel: Kunde inte sanera JSON-schemat för LLM: {str(e)}")
-        
-    payload = {
-        "contents": [{"parts": [{"text": user_query}]}],
-        "systemInstruction": {"parts": [{"text": system_instruction}]},
-        "generationConfig": {
-            "responseMimeType": "application/json",
-            "responseSchema": cleaned_schema
-        },
-    }
+        if GEMINI_STREAMING and on_partial is not None:
+            try:
+                activities_data = await generate_activities_streaming(context.chunks, request, on_partial, usage)
+                print(f"JOBB {job_id}: Strömmad generering klar och JSON validerad.")
+                return activities_data
+            except Exception as e:
+                print(f"JOBB {job_id}: Strömmad generering misslyckades ({e}), försöker utan strömning.")
+                usage.clear()
+                # Nollställ delresultaten (SSE och result_data) så att klienterna inte visar
+                # objekt som kanske inte finns med i det nya svaret
+                on_partial(empty_partial())
 
-    max_retries = 3
+        activities_data = await generate_activities_with_llm(context.chunks, request, usage)
+        print(f"JOBB {job_id}: Generering klar och JSON validerad.")
+        return activities_data
+    finally:
+        prompt_tokens = usage.get('promptTokenCount')
+        prompt_stats.record(context, estimated_prompt_tokens, prompt_tokens)
+        print(f"JOBB {job_id}: Indatatokens {prompt_tokens if prompt_tokens is not None else '?'} (uppskattat {estimated_prompt_tokens})")
 
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        for attempt in range(max_retries):
+
+async def run_activity_pipeline(job_id: str, request: ActivityRequest, query_embedding: Optional[List[float]] = None, on_partial: Optional[Callable[[dict], None]] = None) -> dict:
+    """
+    Beräknar resultatet för ett jobb (resultatcache, RAG och LLM) utan att skriva till databasen.
+    Används både av bakgrundsuppgifterna och av den separata workern (backend/worker.py).
+    """
+    with job_deadline(JOB_DEADLINE_SECONDS), fairness_key(request.user_id or request.subject):
+        # 0. Återanvänd ett tidigare resultat för en nästan identisk fråga
+        if query_embedding is None:
             try:
-                print(f"Försök {attempt + 1}/{max_retries}: Anropar Gemini API...")
-                
-                response = await client.post( 
-                    f"{GEMINI_API_URL}?key={GEMINI_API_KEY}",
-                    headers={'Content-Type': 'application/json'},
-                    content=json.dumps(payload)
-                )
-                
-                if response.status_code != 200:
-                    response.raise_for_status() 
-                
-                result = response.json()
-                
-                if 'candidates' not in result or not result['candidates']:
-                    raise KeyError("Missing 'candidates' in Gemini response.")
-
-                json_text = result['candidates'][0]['content']['parts'][0]['text']
-                
-                validated_activities = LearningActivityResponse.model_validate_json(json_text) 
-                
-                return validated_activities.model_dump() 
-                
-            except httpx.HTTPError as e: 
-                if attempt < max_retries - 1:
-                    await time.sleep(2 ** attempt) 
-                    continue
-                raise Exception(f"LLM-API-fel efter {max_retries} försök: {str(e)}")
-                
+                query_embedding = await embed_query(request.query)
             except Exception as e:
-                if attempt < max_retries - 1:
-                    await time.sleep(2 ** attempt) 
-                    continue
-                raise Exception(f"LLM genererade ogiltig JSON efter {max_retries} försök. Fel: {str(e)}")
+                raise Exception(f"Kunde inte skapa inbäddning: {str(e)}")
 
-        raise Exception("Ett oväntat fel inträffade i LLM-genereringen.")
+        cached = result_cache.lookup(request, query_embedding)
+        if cached is not None:
+            print(f"JOBB {job_id}: Resultatcache-träff från jobb {cached.job_id} (likhet {cached.similarity:.3f})")
+            return cached.result
 
-# --- NY PROCESS SOM KÖRS I BAKGRUNDEN (TILLAGT) ---
+        activities_data = await _generate_for_request(job_id, request, query_embedding, on_partial)
+        result_cache.store(request, query_embedding, job_id, activities_data)
+        return activities_data
 
 
 async def process_activity_job(job_id: str, request: ActivityRequest):
@@ -269,57 +636,96 @@ async def process_activity_job(job_id: str, request: ActivityRequest):
     Den tunga processen: Hämtar chunks och anropar LLM.
     Uppdaterar Supabase-status när den är klar eller misslyckas.
     """
-    # FIX: Se till att time.time() kallas för att få en färsk timestamp
-    # FIX: Använd time.sleep utan await för synkron blockering (om LLM-fel inträffar i retry-loopen)
+    await process_activity_jobs([job_id], request)
+
+
+async def process_activity_jobs(job_ids: List[str], request: ActivityRequest, query_embedding: Optional[List[float]] = None):
+    """
+    Kör en generering för en eller flera identiska förfrågningar och
+    uppdaterar alla deras jobbrader med samma resultat.
+
+    Pågår redan en identisk generering i processen ansluts jobben till den (single-flight).
+    """
+    flight, leader = job_flights.join(dedup_key(request), job_ids)
+    if not leader:
+        print(f"--- JOBB {', '.join(job_ids)}: ansluter till pågående identisk generering ({flight.job_ids[0]}) ---")
+        publish_job_event(job_ids, 'RUNNING')
+        await flight.wait()
+        return
+
+    # Delad lista: jobb som ansluter under körningen får delresultat och slutresultat
+    job_ids = flight.job_ids
+    job_id = job_ids[0]
+    job_label = job_id if len(job_ids) == 1 else f"{job_id} (+{len(job_ids) - 1} identiska)"
     
-    print(f"\n--- JOBB {job_id} STARTAR: {request.query} ---")
+    print(f"\n--- JOBB {job_label} STARTAR: {request.query} ---")
+    publish_job_event(job_ids, 'RUNNING')
     
     # 1. Initiera som misslyckad, ifall något går fel
     error_detail = None
     activities_data = None
     
+    partial_writer = PartialResultWriter(job_ids, save_partial_result)
     try:
-        # 1. Hämta relevanta chunks (RAG Retrieval)
-        retrieved_chunks = await fetch_relevant_chunks(request.query, request.subject)
-        
-        if not retrieved_chunks:
-            raise Exception("Hittade ingen relevant läroplanstext för frågan.")
-            
-        unique_count = len(list(dict.fromkeys(retrieved_chunks)))
-        print(f"JOBB {job_id}: Hämtade {len(retrieved_chunks)} chunks ({unique_count} unika)")
-        
-        # 2. Skicka chunks + prompt till LLM för generering (RAG Generation)
-        activities_data = await generate_activities_with_llm(retrieved_chunks, request)
-        print(f"JOBB {job_id}: Generering klar och JSON validerad.")
-
-        # 3. Uppdatera Supabase: COMPLETED
-        
-        def _update_completed():
-             supabase.table('activity_jobs').update({
-                'status': 'COMPLETED',
-                'result_data': activities_data,
-                'completed_at': datetime.now(timezone.utc).isoformat() 
-            }).eq('job_id', job_id).execute()
+        activities_data = await run_activity_pipeline(job_id, request, query_embedding, partial_writer)
+        await partial_writer.drain()
 
-        await run_in_threadpool(_update_completed)
+        # 3. Uppdatera Supabase: COMPLETED (för alla jobb som hunnit ansluta)
+        job_ids = job_flights.close(flight)
+        await db.complete_jobs(job_ids, activities_data)
+        cache_finished_job(job_ids, 'COMPLETED', result=activities_data)
+        publish_job_event(job_ids, 'COMPLETED', result=activities_data)
         
     except Exception as e:
         error_detail = str(e)
-        print(f"JOBB {job_id} MISSLYCKADES: {error_detail}")
+        print(f"JOBB {job_label} MISSLYCKADES: {error_detail}")
+        await partial_writer.drain()
         
-        # 4. Uppdatera Supabase: FAILED
-         # 4. Uppdatera Supabase: FAILED 
-        def _update_failed():
-            supabase.table('activity_jobs').update({
-                'status': 'FAILED',
-                'error_message': error_detail,
-                'completed_at': datetime.now(timezone.utc).isoformat() 
-            }).eq('job_id', job_id).execute()
-            
-        await run_in_threadpool(_update_failed)
+        # 4. Uppdatera Supabase: FAILED 
+        job_ids = job_flights.close(flight)
+        await db.fail_jobs(job_ids, error_detail)
+        cache_finished_job(job_ids, 'FAILED', error_message=error_detail)
+        publish_job_event(job_ids, 'FAILED', error_message=error_detail)
         
     finally:
-        print(f"--- JOBB {job_id} AVSLUTAT (Status: {'COMPLETED' if activities_data else 'FAILED'}) ---")
+        job_flights.release(flight)
+        coalesced = f", {len(job_ids)} jobb" if len(job_ids) > 1 else ""
+        print(f"--- JOBB {job_id} AVSLUTAT (Status: {'COMPLETED' if activities_data else 'FAILED'}{coalesced}) ---")
+
+
+def dedup_key(request: ActivityRequest) -> tuple:
+    """Nyckel för förfrågningar som ger samma resultat (normaliserad fråga + parametrar)."""
+    return (
+        normalize_query(request.query),
+        request.subject,
+        request.quiz_questions,
+        request.flashcard_items,
+        request.force_regenerate,
+    )
+
+
+async def process_job_batch(jobs: List[tuple]):
+    """
+    Schemaläggare för /create-jobs: slår ihop identiska förfrågningar,
+    inbäddar alla unika frågor i batchanrop och kör grupperna parallellt.
+    """
+    groups = {}
+    for job_id, request in jobs:
+        groups.setdefault(dedup_key(request), (request, []))[1].append(job_id)
+    grouped = list(groups.values())
+    print(f"--- BATCH: {len(jobs)} jobb, {len(grouped)} unika förfrågningar ---")
+
+    try:
+        embeddings = await embed_queries([request.query for request, _ in grouped])
+    except Exception as e:
+        # Låt varje grupp försöka själv (och markeras FAILED vid fel)
+        print(f"VARNING: Batch-inbäddning misslyckades, inbäddar per jobb: {e}")
+        embeddings = [None] * len(grouped)
+
+    await asyncio.gather(*(
+        process_activity_jobs(job_ids, request, embedding)
+        for (request, job_ids), embedding in zip(grouped, embeddings)
+    ))
 
 
 # --- SLUTPUNKT 1: SKAPA JOBB (NY) ---
@@ -339,53 +745,194 @@ async def create_job_endpoint(request: ActivityRequest, background_tasks: Backgr
         
     job_id = str(uuid.uuid4())
     request_data = request.model_dump_json() # Spara Request som JSON-sträng
+    now = datetime.now(timezone.utc).isoformat()
+
+    # Snabbväg: om frågans inbäddning redan är cachad och ett nästan identiskt
+    # jobb redan är klart sparas jobbet direkt som COMPLETED (inget nätverksanrop till Gemini).
+    cached = None
+    cached_embedding = await embedding_cache.get(request.query, count=False)
+    if cached_embedding is not None:
+        cached = result_cache.lookup(request, cached_embedding)
+
+    job_row = {
+        'job_id': job_id,
+        'status': 'PENDING',
+        'request_data': request_data,
+        'created_at': now
+    }
+    if cached is not None:
+        print(f"JOBB {job_id}: Resultatcache-träff från jobb {cached.job_id} (likhet {cached.similarity:.3f})")
+        job_row.update({
+            'status': 'COMPLETED',
+            'result_data': cached.result,
+            'completed_at': now
+        })
 
-    # 1. Skapa jobbet i databasen med status PENDING
+    # 1. Skapa jobbet i databasen med status PENDING (eller COMPLETED vid cacheträff)
     try:
-        supabase.table('activity_jobs').insert([
-            {
-                'job_id': job_id,
-                'status': 'PENDING',
-                'request_data': request_data,
-                'created_at': datetime.now(timezone.utc).isoformat()
-            }
-        ]).execute()
+        await db.insert_jobs([job_row])
     except Exception as e:
         print(f"FEL: Kunde inte skapa jobbet i Supabase: {e}")
         raise HTTPException(status_code=500, detail=f"Kunde inte spara jobb i databasen: {str(e)}")
 
-    # 2. Starta den tunga bearbetningen i bakgrunden.
-    background_tasks.add_task(process_activity_job, job_id, request)
+    if cached is not None:
+        cache_finished_job([job_id], 'COMPLETED', result=cached.result)
+        return {"status": "COMPLETED", "job_id": job_id}
+
+    # 2. Starta den tunga bearbetningen i bakgrunden (om ingen separat worker används).
+    if JOB_EXECUTION_MODE != "worker":
+        background_tasks.add_task(process_activity_job, job_id, request)
     
     return {"status": "PENDING", "job_id": job_id}
 
 
+# --- SLUTPUNKT 1B: SKAPA MÅNGA JOBB ---
+
+@app.post("/create-jobs", status_code=202, response_model=BatchJobResponse)
+async def create_jobs_endpoint(batch: BatchActivityRequest, background_tasks: BackgroundTasks):
+    """
+    Skapar många jobb med en enda bulk-insert och en gemensam bakgrundsschemaläggare.
+    """
+    for i, request in enumerate(batch.requests):
+        try:
+            request.check_min_activities()
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Förfrågan {i}: {str(e)}")
+
+    now = datetime.now(timezone.utc).isoformat()
+    rows = []
+    pending = []
+    for request in batch.requests:
+        job_id = str(uuid.uuid4())
+        row = {
+            'job_id': job_id,
+            'status': 'PENDING',
+            'request_data': request.model_dump_json(),
+            'created_at': now
+        }
+
+        # Samma snabbväg som /create-job: redan cachat resultat sparas direkt som COMPLETED
+        cached = None
+        cached_embedding = await embedding_cache.get(request.query, count=False)
+        if cached_embedding is not None:
+            cached = result_cache.lookup(request, cached_embedding)
+        if cached is not None:
+            row.update({
+                'status': 'COMPLETED',
+                'result_data': cached.result,
+                'completed_at': now
+            })
+        else:
+            pending.append((job_id, request))
+        rows.append(row)
+
+    # 1. Skapa alla jobb i en enda bulk-insert
+    try:
+        await db.insert_jobs(rows)
+    except Exception as e:
+        print(f"FEL: Kunde inte skapa jobben i Supabase: {e}")
+        raise HTTPException(status_code=500, detail=f"Kunde inte spara jobb i databasen: {str(e)}")
+
+    for row in rows:
+        if row['status'] == 'COMPLETED':
+            cache_finished_job([row['job_id']], 'COMPLETED', result=row['result_data'])
+
+    # 2. En enda bakgrundsuppgift för hela batchen
+    if pending and JOB_EXECUTION_MODE != "worker":
+        background_tasks.add_task(process_job_batch, pending)
+
+    return BatchJobResponse(
+        status="PENDING" if pending else "COMPLETED",
+        job_ids=[row['job_id'] for row in rows],
+    )
+
+
 # --- SLUTPUNKT 2: HÄMTA JOBBSTATUS (NY) ---
 
+def _status_body(job_id: str, status: str, result_data: Optional[dict], error_message: Optional[str]) -> bytes:
+    """Serialiserat JobStatusResponse. Medan jobbet körs (strömmat läge) är result_data ett delresultat."""
+    finished = status == 'COMPLETED'
+    return JobStatusResponse(
+        job_id=job_id,
+        status=status,
+        result=result_data if finished else None,
+        error_message=error_message,
+        partial_result=None if finished or status == 'FAILED' else result_data
+    ).model_dump_json().encode()
+
+
+def cache_finished_job(job_ids: List[str], status: str, result: Optional[dict] = None, error_message: Optional[str] = None):
+    """Lägger färdiga jobb i statuscachen så att nästa poll inte behöver databasen."""
+    for job_id in job_ids:
+        finished_jobs.put(job_id, finished_etag(job_id, status), _status_body(job_id, status, result, error_message))
+
+
+def _json_response(body: bytes, etag: Optional[str]) -> Response:
+    headers = {"Cache-Control": "no-cache"}
+    if etag:
+        headers["ETag"] = etag
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @app.get("/status/{job_id}", response_model=JobStatusResponse)
-async def get_job_status(job_id: str):
+async def get_job_status(job_id: str, request: Request):
     """
     Hämtar statusen för ett asynkront jobb. Klienten ska "fråga" (poll) denna endpoint.
+
+    Svaret har en ETag; skicka den i If-None-Match så blir oförändrad status ett 304.
+    Färdiga jobb besvaras från cachen i processen utan databasfråga.
     """
-    if supabase is None:
+    if_none_match = request.headers.get("if-none-match")
+
+    # 1. Färdiga jobb ändras aldrig: cache eller 304 utan databasfråga
+    cached = finished_jobs.get(job_id)
+    if cached is not None:
+        etag, body = cached
+        if etag_matches(if_none_match, etag):
+            finished_jobs.not_modified += 1
+            return Response(status_code=304, headers={"ETag": etag})
+        return _json_response(body, etag)
+
+    if not db.configured:
         raise HTTPException(status_code=503, detail="Supabase-tjänsten är inte tillgänglig.")
         
     try:
-        res = supabase.table('activity_jobs').select('*').eq('job_id', job_id).limit(1).execute()
+        # 2. Lätt fråga utan result_data
+        job_record = await db.poll_job(job_id)
         
-        if not res.data:
+        if job_record is None:
             raise HTTPException(status_code=404, detail=f"Jobb med ID {job_id} hittades inte.")
-            
-        job_record = res.data[0]
-        
-        # Förbered resultatet för pydantic-modellen
-        return JobStatusResponse(
-            job_id=job_record['job_id'],
-            status=job_record['status'],
-            # Vi måste parsa result_data från JSON-strängen om den finns
-            result=job_record.get('result_data'), 
-            error_message=job_record.get('error_message')
-        )
+
+        status = job_record['status']
+        error_message = job_record.get('error_message')
+
+        # 3. Färdigt: hämta resultatet en gång och cacha svaret
+        if status in TERMINAL_STATUSES:
+            etag = finished_etag(job_id, status)
+            if etag_matches(if_none_match, etag):
+                finished_jobs.not_modified += 1
+                return Response(status_code=304, headers={"ETag": etag})
+            result_data = None
+            if status == 'COMPLETED':
+                result_data = (await db.get_job(job_id, JOB_RESULT_COLUMNS) or {}).get('result_data')
+            body = _status_body(job_id, status, result_data, error_message)
+            finished_jobs.put(job_id, etag, body)
+            return _json_response(body, etag)
+
+        # 4. Pågår: ETag från status + updated_at; delresultatet hämtas bara vid ändring
+        etag = progress_etag(job_id, status, job_record.get('updated_at'))
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        partial = None
+        if status == 'RUNNING' and GEMINI_STREAMING:
+            partial = (await db.get_job(job_id, JOB_RESULT_COLUMNS) or {}).get('result_data')
+        body = _status_body(job_id, status, partial, error_message)
+        if etag is None:
+            # Utan updated_at: ETag från svaret (status + delresultat)
+            etag = content_etag(job_id, status, body)
+            if etag_matches(if_none_match, etag):
+                return Response(status_code=304, headers={"ETag": etag})
+        return _json_response(body, etag)
         
     except HTTPException:
         # Vidarebefordra 404
@@ -395,5 +942,118 @@ async def get_job_status(job_id: str):
         raise HTTPException(status_code=500, detail=f"Internt databasfel: {str(e)}")
 
 
-# --- SLUTPUNKT 3: EMBED (Behålls som synkron för snabb åtkomst) --- tagits bort
+# --- SLUTPUNKT 2B: STATUSSTRÖM (SSE) ---
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.get("/status/{job_id}/stream")
+async def stream_job_status(job_id: str, request: Request):
+    """
+    Server-Sent Events: skickar statusövergångar och slutresultatet exakt en gång,
+    i stället för att klienten pollar /status/{job_id}.
+    """
+    if not db.configured:
+        raise HTTPException(status_code=503, detail="Supabase-tjänsten är inte tillgänglig.")
+
+    async def _fetch_status():
+        # Lätt projektion: inget result_data medan jobbet pågår
+        return await db.get_job(job_id, JOB_PROGRESS_COLUMNS)
+
+    async def _fetch_result():
+        record = await db.get_job(job_id, JOB_RESULT_COLUMNS)
+        return record.get('result_data') if record else None
+
+    async def _final_event(status: str, result: Optional[dict], error_message: Optional[str]) -> str:
+        if status == 'COMPLETED' and result is None:
+            result = await _fetch_result()
+        payload = JobStatusResponse(job_id=job_id, status=status, result=result, error_message=error_message)
+        return _sse('result', payload.model_dump(mode='json'))
+
+    async def events():
+        # Prenumerera före första läsningen så att ingen övergång missas
+        with job_events.subscribe(job_id) as queue:
+            record = await _fetch_status()
+            if record is None:
+                yield _sse('error', {'job_id': job_id, 'detail': f"Jobb med ID {job_id} hittades inte."})
+                return
+
+            last_status = record['status']
+            yield _sse('status', {'job_id': job_id, 'status': last_status})
+            if last_status in TERMINAL_STATUSES:
+                yield await _final_event(last_status, None, record.get('error_message'))
+                return
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_FALLBACK_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    # Reserv för jobb som körs i en annan worker-process
+                    record = await _fetch_status()
+                    if record is None:
+                        return
+                    event = {'status': record['status'], 'result': None, 'error_message': record.get('error_message')}
+                    if event['status'] == last_status:
+                        yield ": keep-alive\n\n"
+                        continue
+
+                if event['status'] != last_status:
+                    last_status = event['status']
+                    yield _sse('status', {'job_id': job_id, 'status': last_status})
+                if event.get('partial') is not None:
+                    yield _sse('partial', {'job_id': job_id, 'partial_result': event['partial']})
+                if last_status in TERMINAL_STATUSES:
+                    yield await _final_event(last_status, event.get('result'), event.get('error_message'))
+                    return
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# --- SLUTPUNKT 3: READINESS OCH METRIK ---
+
+@app.get("/ready")
+async def get_readiness():
+    """Readiness: 200 när tjänsterna i WARM_SERVICES är startade, annars 503. Visar vilka backends som är varma."""
+    readiness = services.readiness()
+    return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Returnerar enkla driftmått för den här workern."""
+    return {
+        "http_pool": http_client.pool_stats.snapshot(),
+        "embeddings": embedder.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "result_cache": result_cache.stats(),
+        "retriever": retriever.stats(),
+        "db": db.stats(),
+        "status_cache": finished_jobs.stats(),
+        "single_flight": job_flights.stats(),
+        "prompt": prompt_stats.snapshot(),
+        "job_events": job_events.stats(),
+        "gemini_quota": {
+            scheduler.name: scheduler.stats()
+            for scheduler in (embed_scheduler, generate_scheduler)
+        },
+        "circuit_breakers": {
+            breaker.name: breaker.stats()
+            for breaker in (gemini_embed_breaker, gemini_generate_breaker, retriever_breaker)
+        },
+        "generation": {
+            "streaming": GEMINI_STREAMING,
+            "time_to_first_content": time_to_first_content.snapshot(),
+            "total": generation_latency.snapshot(),
+        },
+    }
+
+
+# --- SLUTPUNKT 4: EMBED (Behålls som synkron för snabb åtkomst) --- tagits bort
 
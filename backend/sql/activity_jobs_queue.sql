@@ -0,0 +1,36 @@
+-- Kolumner och funktioner för den hållbara jobbkön (backend/worker.py).
+-- Körs en gång i Supabase SQL-editorn.
+
+alter table activity_jobs
+    add column if not exists claimed_by text,
+    add column if not exists lease_expires_at timestamptz,
+    add column if not exists attempts integer not null default 0;
+
+create index if not exists activity_jobs_pending_idx
+    on activity_jobs (created_at)
+    where status = 'PENDING';
+
+create index if not exists activity_jobs_running_lease_idx
+    on activity_jobs (lease_expires_at)
+    where status = 'RUNNING';
+
+-- Tar upp till p_limit PENDING-jobb åt en worker. SKIP LOCKED gör att flera
+-- workers kan hämta samtidigt utan att få samma jobb.
+create or replace function claim_activity_jobs(p_worker_id text, p_limit integer, p_lease_seconds integer)
+returns setof activity_jobs
+language sql
+as $$
+    update activity_jobs j
+    set status = 'RUNNING',
+        claimed_by = p_worker_id,
+        lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+        attempts = j.attempts + 1
+    where j.job_id in (
+        select job_id from activity_jobs
+        where status = 'PENDING'
+        order by created_at
+        limit p_limit
+        for update skip locked
+    )
+    returning j.*;
+$$;
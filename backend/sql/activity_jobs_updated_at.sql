@@ -0,0 +1,22 @@
+-- updated_at för den lätta statusfrågan i /status/{job_id} (ETag medan jobbet pågår).
+-- Körs en gång i Supabase SQL-editorn.
+
+alter table activity_jobs
+    add column if not exists updated_at timestamptz not null default now();
+
+-- Sätts vid varje uppdatering (statusövergång, delresultat, lease) utan att
+-- klienterna behöver skicka med kolumnen.
+create or replace function activity_jobs_touch_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.updated_at = now();
+    return new;
+end;
+$$;
+
+drop trigger if exists activity_jobs_updated_at on activity_jobs;
+create trigger activity_jobs_updated_at
+    before update on activity_jobs
+    for each row execute function activity_jobs_touch_updated_at();
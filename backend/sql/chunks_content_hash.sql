@@ -0,0 +1,10 @@
+-- Innehållshash för inkrementell indexering (backend/ingest.py).
+-- Körs en gång i Supabase SQL-editorn.
+
+alter table chunks
+    add column if not exists content_hash text;
+
+-- Unikt index så att ingest kan göra upsert på content_hash.
+-- Äldre rader utan hash (NULL) påverkas inte.
+create unique index if not exists chunks_content_hash_key
+    on chunks (content_hash);
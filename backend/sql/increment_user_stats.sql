@@ -0,0 +1,36 @@
+-- Atomisk ökning av user_stats-räknare för badgemotorns stat-deltan.
+-- deltas: [{"user_id": "...", "stats": {"quizzes_completed": 1, ...}}, ...]
+-- Returnerar en rad per ändrad räknare med värdet efter ökningen; motorn räknar
+-- fram värdet före (value - delta) och utvärderar bara trösklarna däremellan.
+-- Varje UPDATE låser användarens rad, så samtidiga quizinlämningar serialiseras
+-- och varje tröskel passeras av exakt en av dem.
+-- Kräver en unik nyckel på user_stats.user_id. Körs en gång i Supabase SQL-editorn.
+
+create or replace function increment_user_stats(deltas jsonb)
+returns table (user_id uuid, stat text, value numeric)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+    item jsonb;
+    target uuid;
+    stat_name text;
+    amount numeric;
+begin
+    for item in select * from jsonb_array_elements(deltas) loop
+        target := (item->>'user_id')::uuid;
+        insert into user_stats (user_id) values (target)
+            on conflict (user_id) do nothing;
+        for stat_name, amount in select key, delta::numeric from jsonb_each_text(item->'stats') as s(key, delta) loop
+            -- %I citerar kolumnnamnet; okända kolumner ger fel i stället för injektion
+            execute format(
+                'update user_stats set %I = coalesce(%I, 0) + $1 where user_stats.user_id = $2 returning %I',
+                stat_name, stat_name, stat_name
+            ) into value using amount, target;
+            user_id := target;
+            stat := stat_name;
+            return next;
+        end loop;
+    end loop;
+end;
+$$;
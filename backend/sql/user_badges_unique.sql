@@ -0,0 +1,14 @@
+-- En badge kan bara tas en gång per användare. Krävs för badgemotorns upsert
+-- (on_conflict user_id,badge_id med ignore_duplicates), som skriver alla nya badges
+-- för en hel klass i ett anrop.
+-- Körs en gång i Supabase SQL-editorn.
+
+-- Ta bort eventuella dubbletter som skrivits tidigare
+delete from user_badges a
+    using user_badges b
+    where a.ctid > b.ctid
+      and a.user_id = b.user_id
+      and a.badge_id = b.badge_id;
+
+create unique index if not exists user_badges_user_badge_idx
+    on user_badges (user_id, badge_id);
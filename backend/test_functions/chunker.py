@@ -1,9 +1,11 @@
 import re
+from functools import lru_cache
 from pathlib import Path
-from titlefiles.no_so import ALL_CONFIGS
+from backend.title_files.no_so_titles import ALL_CONFIGS
+from backend.utils.text_splitter import DEFAULT_MAX_TOKENS, DEFAULT_OVERLAP_TOKENS, normalize_whitespace, split_spans
 
 
-DATA_DIR = Path(__file__).parent / "data" / "kommentarsmatrial"
+DATA_DIR = Path(__file__).resolve().parent.parent / "data" / "kommentarsmatrial"
 
 
 # ---------------------------------------------------------
@@ -81,47 +83,140 @@ def split_by_year_levels(text: str, grade_levels):
     return sub_chunks
 
 
+# ---------------------------------------------------------
+# SINGLE-PASS SCANNER: RUBRIKER + ÅRSKURSER I EN REGEX
+# ---------------------------------------------------------
+
+_REGEX_META = set("\\.^$*+?{}[]|()")
+
+
+def _first_char_class(regexes):
+    """Teckenklass för alla möjliga första tecken (radbrytning + årskursrubrikernas
+    första bokstav i båda skiftlägena), eller None om någon regex börjar med ett specialtecken."""
+    chars = {"\n"}
+    for regex in regexes:
+        if not regex or regex[0] in _REGEX_META:
+            return None
+        chars.update((regex[0].lower(), regex[0].upper()))
+    return "[" + "".join(re.escape(c) for c in sorted(chars)) + "]"
+
+
+class SubjectScanner:
+    """Förkompilerad scanner per ämne som hittar alla rubrik- och årskursgränser i ett pass.
+
+    Rubrikerna ligger i en lookahead efter radbrytningen, så en årskursrubrik på
+    samma rad hittas ändå. En lookahead med möjliga första tecken låter regexmotorn
+    hoppa över de flesta positioner direkt. Resultatet är offsets; inga avsnitt kopieras ut.
+    """
+
+    def __init__(self, config):
+        heading_line = rf"[^\S\n]*(?:{'|'.join(config['regex_headings'])})[^\S\n]*$"
+        alternatives = [rf"\n(?=(?P<heading>{heading_line}))"]
+
+        self.grade_groups = []
+        for i, (regex, label) in enumerate(config["regex_grade_levels"]):
+            name = f"grade_{i}"
+            self.grade_groups.append((name, label))
+            alternatives.append(rf"(?i:(?P<{name}>{regex}))")
+
+        prefilter = _first_char_class([regex for regex, _ in config["regex_grade_levels"]])
+        self.pattern = re.compile(
+            (f"(?={prefilter})" if prefilter else "") + "(?:" + "|".join(alternatives) + ")",
+            flags=re.MULTILINE,
+        )
+        # En rubrik allra först i texten har ingen radbrytning före sig
+        self._heading_at_start = re.compile(heading_line, flags=re.MULTILINE)
+
+    def boundaries(self, text: str):
+        """Lista med (typ, etikett, start, slut); typ är "heading" eller "grade"."""
+        found = []
+        m = self._heading_at_start.match(text)
+        if m:
+            found.append(("heading", m.group().strip(), m.start(), m.end()))
+        for m in self.pattern.finditer(text):
+            if m.start("heading") != -1:
+                found.append(("heading", m.group("heading").strip(), m.start("heading"), m.end("heading")))
+                continue
+            for name, label in self.grade_groups:
+                if m.start(name) != -1:
+                    found.append(("grade", label, m.start(name), m.end(name)))
+                    break
+        return found
+
+    def sections(self, text: str):
+        """Ger (rubrik, årskurs, start, slut) för varje avsnitt, i dokumentordning.
+
+        Har en rubrik årskursrubriker blir varje årskurs ett eget avsnitt (texten
+        efter årskursrubriken); annars är årskurs None och avsnittet hela rubriken.
+        Utan rubriker behandlas hela texten som "FULL_DOCUMENT".
+        """
+        heading, heading_start = None, 0
+        grades = []  # (etikett, start, slut) inom aktuell rubrik
+
+        def flush(end):
+            if not grades:
+                yield heading, None, heading_start, end
+                return
+            for i, (label, _, grade_end) in enumerate(grades):
+                section_end = grades[i + 1][1] if i + 1 < len(grades) else end
+                yield heading, label, grade_end, section_end
+
+        for kind, label, start, end in self.boundaries(text):
+            if kind == "grade":
+                grades.append((label, start, end))
+                continue
+            if heading is not None:
+                yield from flush(start)
+            # text före första rubriken (även årskurser där) hör inte till något avsnitt
+            heading, heading_start, grades = label, start, []
+
+        if heading is None:
+            heading = "FULL_DOCUMENT"
+        yield from flush(len(text))
+
+
+@lru_cache(maxsize=None)
+def get_scanner(subject: str) -> SubjectScanner:
+    """Scannern byggs en gång per ämne och återanvänds."""
+    return SubjectScanner(get_config(subject))
+
+
 # ---------------------------------------------------------
 # MAIN PIPELINE: RETURN AI-VÄNLIGA CHUNKS
 # ---------------------------------------------------------
 
-def make_chunks(subject: str):
-    config = get_config(subject)
+def chunk_spans(subject: str, max_tokens: int = DEFAULT_MAX_TOKENS, overlap_tokens: int = DEFAULT_OVERLAP_TOKENS):
+    """Som make_chunks men utan att kopiera text: (text, [(start, slut, rubrik, årskurs), ...])."""
     text = load_text(subject)
 
     last_grade = None
+    spans = []
 
-    heading_regex = build_heading_regex(config)
-    heading_chunks = chunk_by_headings(text, heading_regex)
-
-    final_chunks = []
-
-    for heading, content in heading_chunks:
-        # testa om rubriken innehåller årskurser
-        grade_chunks = split_by_year_levels(content, config["regex_grade_levels"])
-
-        if grade_chunks:
-            # skapa chunks per årskurs
-            for grade, gc in grade_chunks:
-                last_grade = grade
-                final_chunks.append({
-                    "subject": subject,
-                    "heading": heading,
-                    "grade": grade,
-                    "content_type": config["content_type"],
-                    "content": gc.strip(),
-                })
-        else:
-            final_chunks.append({
-                "subject": subject,
-                "heading": heading,
-                "grade": last_grade,   # <-- här är fixen!
-                "content_type": config["content_type"],
-                "content": content.strip(),
-            })
-
-
-    return final_chunks
+    for heading, grade, start, end in get_scanner(subject).sections(text):
+        if grade is not None:
+            last_grade = grade
+
+        # dela långa avsnitt i mindre bitar med överlapp (avsnitt utan egen årskurs ärver föregående)
+        for part_start, part_end in split_spans(text, max_tokens, overlap_tokens, start=start, end=end):
+            spans.append((part_start, part_end, heading, last_grade))
+
+    return text, spans
+
+
+def make_chunks(subject: str, max_tokens: int = DEFAULT_MAX_TOKENS, overlap_tokens: int = DEFAULT_OVERLAP_TOKENS):
+    config = get_config(subject)
+    text, spans = chunk_spans(subject, max_tokens, overlap_tokens)
+
+    return [
+        {
+            "subject": subject,
+            "heading": heading,
+            "grade": grade,
+            "content_type": config["content_type"],
+            "content": normalize_whitespace(text[start:end]),
+        }
+        for start, end, heading, grade in spans
+    ]
 
 
 # ---------------------------------------------------------
@@ -1,13 +1,11 @@
 import os
 from pathlib import Path
 import asyncio
-from titlefiles.no_so import ALL_CONFIGS
+from backend.title_files.no_so_titles import ALL_CONFIGS
+from backend.utils.text_splitter import DEFAULT_MAX_TOKENS, DEFAULT_OVERLAP_TOKENS, split_text
 import re
 
-DATA_DIR = '../data/kommentarsmatrial'
-CONFIG_FILE_PATH = Path(__file__).parent / 'titlefiles' / 'no_so.py'
-
-DATA_DIR = Path(__file__).parent / "data" / "kommentarsmatrial"
+DATA_DIR = Path(__file__).resolve().parent.parent / "data" / "kommentarsmatrial"
 
 
 def load_text(subject: str) -> str:
@@ -53,7 +51,6 @@ def chunk_text_by_headings(text, heading_regex):
 
     return chunks
 
-d
 
 # ---------- MAIN EXAMPLE ----------
 if __name__ == "__main__":
@@ -91,18 +88,9 @@ def split_by_year_levels(text, grade_levels):
     return sub_chunks
 
 # ----------------- SPLIT LARGE CHUNKS -----------------
-def split_into_small_chunks(text, max_chars=1200):
-    words = text.split()
-    chunks = []
-    current = []
-    for w in words:
-        if sum(len(x) for x in current) + len(w) + len(current) > max_chars:
-            chunks.append(" ".join(current))
-            current = []
-        current.append(w)
-    if current:
-        chunks.append(" ".join(current))
-    return chunks
+def split_into_small_chunks(text, max_tokens=DEFAULT_MAX_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+    # Generator: delar på meningsgränser med tokenbudget och överlapp (linjär tid)
+    return split_text(text, max_tokens=max_tokens, overlap_tokens=overlap_tokens)
 
 # ----------------- FULL CHUNKING -----------------
 def chunk_document(subject: str):
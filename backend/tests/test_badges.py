@@ -0,0 +1,189 @@
+import uuid
+
+from backend.utils.badges.engine import BadgeCatalog, BadgeEngine
+
+# BadgeEngine mot en falsk Supabase-klient: trösklar på exakt gränsen, cachen över
+# redan tagna badges, att en upprepad utdelning inte skriver något och att apply_deltas
+# matchar RPC-svaret (kanoniska uuid) mot anroparens uuid oavsett skrivsätt.
+
+BADGES = [
+    {"id": "quiz-10", "requirement_type": "quizzes_completed", "requirement_value": 10},
+    {"id": "quiz-1", "requirement_type": "quizzes_completed", "requirement_value": 1},
+    {"id": "quiz-5", "requirement_type": "quizzes_completed", "requirement_value": 5},
+    {"id": "streak-3", "requirement_type": "streak_days", "requirement_value": 3},
+]
+
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+
+class _Query:
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.action = "select"
+        self.rows = None
+        self.user_ids = None
+
+    def select(self, columns):
+        return self
+
+    def in_(self, column, values):
+        assert column == "user_id"
+        self.user_ids = set(values)
+        return self
+
+    def upsert(self, rows, on_conflict=None, ignore_duplicates=False):
+        assert on_conflict == "user_id,badge_id" and ignore_duplicates
+        self.action, self.rows = "upsert", rows
+        return self
+
+    def execute(self):
+        self.db.calls.append((self.table, self.action))
+        if self.table == "badges":
+            return _Result([dict(b) for b in BADGES])
+        if self.table == "user_stats":
+            return _Result([dict(row) for user_id, row in self.db.stats.items() if user_id in self.user_ids])
+        if self.action == "select":
+            return _Result([{"user_id": u, "badge_id": b} for u, b in self.db.earned if u in self.user_ids])
+        # Som ON CONFLICT DO NOTHING: bara nya rader kommer tillbaka
+        inserted = [row for row in self.rows if (row["user_id"], row["badge_id"]) not in self.db.earned]
+        self.db.earned.update((row["user_id"], row["badge_id"]) for row in inserted)
+        return _Result(inserted)
+
+
+class _Rpc:
+    def __init__(self, db, params):
+        self.db = db
+        self.params = params
+
+    def execute(self):
+        self.db.calls.append(("rpc", "increment_user_stats"))
+        out = []
+        for item in self.params["deltas"]:
+            # Som Postgres uuid-typ: svaret kommer alltid i kanonisk form
+            user_id = str(uuid.UUID(item["user_id"]))
+            row = self.db.stats.setdefault(user_id, {"user_id": user_id})
+            for stat, amount in item["stats"].items():
+                row[stat] = row.get(stat, 0) + amount
+                out.append({"user_id": user_id, "stat": stat, "value": row[stat]})
+        return _Result(out)
+
+
+class FakeSupabase:
+    def __init__(self, stats=None, earned=()):
+        self.stats = {row["user_id"]: row for row in (stats or [])}
+        self.earned = set(earned)
+        self.calls = []
+
+    def table(self, name):
+        return _Query(self, name)
+
+    def rpc(self, name, params):
+        assert name == "increment_user_stats"
+        return _Rpc(self, params)
+
+    def writes(self):
+        return [call for call in self.calls if call[1] in ("upsert", "increment_user_stats")]
+
+
+def test_crossed_includes_exact_threshold():
+    catalog = BadgeCatalog(FakeSupabase())
+
+    assert catalog.crossed("quizzes_completed", 0) == []
+    assert [b["id"] for b in catalog.crossed("quizzes_completed", 1)] == ["quiz-1"]
+    assert [b["id"] for b in catalog.crossed("quizzes_completed", 9)] == ["quiz-1", "quiz-5"]
+    assert [b["id"] for b in catalog.crossed("quizzes_completed", 10)] == ["quiz-1", "quiz-5", "quiz-10"]
+    assert catalog.crossed("quizzes_completed", None) == []
+    assert catalog.crossed("okänd", 100) == []
+
+
+def test_crossed_between_is_half_open():
+    catalog = BadgeCatalog(FakeSupabase())
+
+    # Från exakt en tröskel räknas den inte igen; till exakt en tröskel räknas den
+    assert [b["id"] for b in catalog.crossed_between("quizzes_completed", 1, 5)] == ["quiz-5"]
+    assert [b["id"] for b in catalog.crossed_between("quizzes_completed", 0, 10)] == ["quiz-1", "quiz-5", "quiz-10"]
+    assert catalog.crossed_between("quizzes_completed", 5, 9) == []
+    assert catalog.crossed_between("quizzes_completed", 4, 4) == []
+
+
+def test_award_writes_only_new_badges_and_repeat_is_noop():
+    db = FakeSupabase(
+        stats=[
+            {"user_id": "u1", "quizzes_completed": 5, "streak_days": 3},
+            {"user_id": "u2", "quizzes_completed": 0, "streak_days": 0},
+        ],
+        earned=[("u1", "quiz-1")],
+    )
+    engine = BadgeEngine(db)
+
+    first = engine.check_and_award(["u1", "u2"])
+    assert first == {"u1": ["quiz-5", "streak-3"]}
+    assert db.earned == {("u1", "quiz-1"), ("u1", "quiz-5"), ("u1", "streak-3")}
+
+    db.calls.clear()
+    assert engine.check_and_award(["u1", "u2"]) == {}
+    # Redan tagna badges finns i cachen: ingen upsert och ingen ny läsning av user_badges
+    assert db.calls == [("user_stats", "select")]
+
+
+def test_badge_awarded_elsewhere_is_not_reported_twice():
+    db = FakeSupabase(stats=[{"user_id": "u1", "quizzes_completed": 1}])
+    engine = BadgeEngine(db)
+    engine.fetch_earned(["u1"])
+
+    # En annan process delar ut badgen efter att cachen lästes
+    db.earned.add(("u1", "quiz-1"))
+    assert engine.check_and_award(["u1"]) == {}
+    assert ("user_badges", "upsert") in db.calls
+
+    db.calls.clear()
+    assert engine.check_and_award(["u1"]) == {}
+    assert db.writes() == []
+
+
+def test_earned_cache_is_bounded():
+    db = FakeSupabase(stats=[{"user_id": f"u{i}", "quizzes_completed": 1} for i in range(5)])
+    engine = BadgeEngine(db)
+    engine.earned.max_users = 2
+
+    engine.check_and_award([f"u{i}" for i in range(5)])
+
+    assert engine.earned.get("u4") == {"quiz-1"}
+    assert engine.earned.get("u0") is None
+
+
+def test_uuid_forms_hit_the_same_stats_row():
+    user = uuid.UUID("6f1c2d3e-4a5b-4c6d-8e7f-901234567890")
+    db = FakeSupabase()
+    engine = BadgeEngine(db)
+
+    # Versaler, måsvingar och utan bindestreck är samma användare; ökningarna adderas
+    first = engine.apply_deltas({str(user).upper(): {"quizzes_completed": 2}})
+    second = engine.apply_deltas({
+        "{" + str(user) + "}": {"quizzes_completed": 2},
+        user.hex: {"quizzes_completed": 1, "streak_days": 0},
+    })
+
+    assert list(db.stats) == [str(user)]
+    assert db.stats[str(user)]["quizzes_completed"] == 5
+    assert "streak_days" not in db.stats[str(user)]
+    # Resultatet har anroparens nyckel
+    assert first == {str(user).upper(): ["quiz-1"]}
+    assert second == {"{" + str(user) + "}": ["quiz-5"]}
+
+
+def test_apply_deltas_awards_each_threshold_once():
+    db = FakeSupabase()
+    engine = BadgeEngine(db)
+    user = str(uuid.uuid4())
+
+    awarded = [engine.apply_deltas({user: {"quizzes_completed": 1}}) for _ in range(10)]
+
+    assert [a for a in awarded if a] == [{user: ["quiz-1"]}, {user: ["quiz-5"]}, {user: ["quiz-10"]}]
+    # Ökningar som inte passerar någon tröskel skriver inga badges
+    assert sum(1 for call in db.calls if call == ("user_badges", "upsert")) == 3
+    assert engine.apply_deltas({user: {"quizzes_completed": 0}}) == {}
@@ -0,0 +1,65 @@
+from backend.utils.context_builder import ContextBuilder
+from backend.utils.rate_limiter import estimate_tokens
+
+# ContextBuilder: dubblettrensning med inbäddning (lokalt index) och med 3-gram
+# (match_chunks via Supabase returnerar ingen embedding), samt tokenbudgeten.
+
+PARAGRAPH = (
+    "Eleverna ska ges förutsättningar att utveckla kunskaper om hur människor i olika "
+    "tider har använt källor för att förstå sin omvärld och sin egen historia"
+)
+
+
+def test_supabase_rows_use_shingle_fallback():
+    rows = [
+        {"content": PARAGRAPH + " i årskurs 7-9.", "similarity": 0.90},
+        {"content": PARAGRAPH + " i årskurs 4-6.", "similarity": 0.88},
+        {"content": "Fotosyntesen omvandlar ljusenergi till kemisk energi i växternas klorofyll.", "similarity": 0.80},
+    ]
+
+    context = ContextBuilder(max_tokens=1000).build(rows)
+
+    assert context.duplicates == 1
+    assert context.chunks == [rows[0]["content"], rows[2]["content"]]
+
+
+def test_embeddings_decide_when_present():
+    rows = [
+        {"content": "Vulkaner bildas där plattor möts.", "similarity": 0.9, "embedding": [1.0, 0.0, 0.0]},
+        # Annan ordalydelse men samma innehåll enligt inbäddningen
+        {"content": "Vid plattgränser uppstår vulkaner.", "similarity": 0.8, "embedding": [0.99, 0.05, 0.0]},
+        # Nästan samma text men olika inbäddning: inbäddningen avgör, så den behålls
+        {"content": "Vulkaner bildas där plattor möts!", "similarity": 0.7, "embedding": [0.0, 1.0, 0.0]},
+    ]
+
+    context = ContextBuilder(max_tokens=1000).build(rows)
+
+    assert context.duplicates == 1
+    assert context.chunks == [rows[0]["content"], rows[2]["content"]]
+
+
+def test_budget_orders_by_relevance_and_truncates_first():
+    long_text = " ".join(["ord"] * 400)
+    rows = [
+        {"content": "kort men mindre relevant", "similarity": 0.1},
+        {"content": long_text, "similarity": 0.9},
+    ]
+
+    context = ContextBuilder(max_tokens=50).build(rows)
+
+    assert len(context.chunks) == 1
+    assert context.chunks[0].startswith("ord ord")
+    assert context.tokens <= 50
+    assert context.over_budget == 1
+
+
+def test_static_prompt_estimate_includes_schema_and_payload():
+    from backend import main
+    from backend.learning_models import LearningActivityResponse, get_response_schema
+
+    prompt = main.USER_PROMPT_TEMPLATE.format(quiz_questions=2, flashcard_items=2, chunks_text="", query="")
+    payload = main.GENERATION_PAYLOAD_TEMPLATE.render(prompt)
+    schema_tokens = estimate_tokens(str(get_response_schema(LearningActivityResponse)))
+
+    assert main.STATIC_PROMPT_TOKENS > schema_tokens
+    assert abs(main.STATIC_PROMPT_TOKENS - estimate_tokens(payload)) <= 2
@@ -0,0 +1,70 @@
+import asyncio
+import sqlite3
+import time
+
+from backend.utils.embedding_cache import EmbeddingCache
+
+# SQLite-nivån i EmbeddingCache: delas mellan instanser (workers), skrivs i bakgrunden
+# och rensas från utgångna rader.
+
+
+def _rows(path: str) -> int:
+    with sqlite3.connect(path) as db:
+        return db.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+
+
+def test_persistent_tier_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+
+    async def run():
+        writer = EmbeddingCache("m", persistent_path=path)
+        writer.put("Fotosyntes?", [0.25, 0.5])
+        writer.put("demokrati", [1.0, 2.0])
+        await writer.close()
+
+        reader = EmbeddingCache("m", persistent_path=path)
+        hit = await reader.get(" fotosyntes ")
+        miss = await reader.get("vulkaner")
+        other_model = await EmbeddingCache("annan", persistent_path=path).get("fotosyntes")
+        return writer, reader, hit, miss, other_model
+
+    writer, reader, hit, miss, other_model = asyncio.run(run())
+    assert hit == [0.25, 0.5]
+    assert miss is None
+    assert other_model is None
+    assert writer.stats()["persistent_writes"] == 2
+    assert reader.stats()["persistent_hits"] == 1
+
+
+def test_put_does_not_write_on_the_event_loop(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+
+    async def run():
+        cache = EmbeddingCache("m", persistent_path=path)
+        for i in range(20):
+            cache.put(f"fråga {i}", [float(i)])
+        # Minnesnivån svarar direkt; SQLite har ännu inte skrivits
+        pending = cache.stats()["pending_writes"]
+        assert await cache.get("fråga 3") == [3.0]
+        await cache.close()
+        return pending
+
+    assert asyncio.run(run()) == 20
+    assert _rows(path) == 20
+
+
+def test_expired_rows_are_swept(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite3")
+    cache = EmbeddingCache("m", ttl_seconds=60, persistent_path=path)
+    cache.put("gammal", [1.0])
+    cache.put("ny", [2.0])
+    with sqlite3.connect(path) as db:
+        db.execute("UPDATE query_embeddings SET created_at = ? WHERE key = 'm:gammal'", (time.time() - 120,))
+
+    asyncio.run(cache.start())
+
+    assert cache.stats()["swept"] == 1
+    assert _rows(path) == 1
+    fresh = EmbeddingCache("m", ttl_seconds=60, persistent_path=path)
+    assert asyncio.run(fresh.get("gammal")) is None
+    assert asyncio.run(fresh.get("ny")) == [2.0]
@@ -0,0 +1,50 @@
+from backend import ingest
+
+# fetch_existing: rader från före content_hash-migreringen (NULL) ska alla räknas som
+# inaktuella i stället för att slås ihop till en nyckel.
+
+
+class _Query:
+    def __init__(self, rows):
+        self.rows = rows
+        self.bounds = (0, len(rows))
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        return self
+
+    def in_(self, column, values):
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end + 1)
+        return self
+
+    def execute(self):
+        class Result:
+            pass
+        result = Result()
+        result.data = self.rows[self.bounds[0]:self.bounds[1]]
+        return result
+
+
+class _Client:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def table(self, name):
+        assert name == "chunks"
+        return _Query(self.rows)
+
+
+def test_rows_without_hash_are_all_returned_as_legacy(monkeypatch):
+    monkeypatch.setattr(ingest, "PAGE_SIZE", 3)
+    rows = [{"id": i, "content_hash": None} for i in range(4)]
+    rows += [{"id": 10, "content_hash": "a"}, {"id": 11, "content_hash": "b"}]
+
+    existing, legacy = ingest.fetch_existing(_Client(rows), ["historia"])
+
+    assert existing == {"a": 10, "b": 11}
+    assert legacy == [0, 1, 2, 3]
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+
+from backend.learning_models import ActivityRequest
+from backend.utils.job_queue import SQLiteJobQueue
+
+# Leasesemantiken i SQLiteJobQueue: ingen dubbelleverans, återställning efter utgången
+# lease och att en worker som har förlorat leasen inte kan skriva slutstatus.
+# Kör: python -m pytest backend/tests
+
+
+def _request(query: str = "fotosyntes") -> ActivityRequest:
+    return ActivityRequest(query=query, quiz_questions=1)
+
+
+def test_concurrent_claim_delivers_each_job_once(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    setup = SQLiteJobQueue(path)
+    for i in range(50):
+        setup.enqueue(f"job-{i}", _request(f"fråga {i}"))
+
+    # Varje worker har en egen anslutning, som separata processer mot samma databas
+    claimed = {}
+
+    def work(worker_id: str):
+        queue = SQLiteJobQueue(path)
+        jobs = []
+        while True:
+            batch = asyncio.run(queue.claim(worker_id, 3, 60))
+            if not batch:
+                break
+            jobs.extend(job.job_id for job in batch)
+        claimed[worker_id] = jobs
+
+    threads = [threading.Thread(target=work, args=(f"w{i}",)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    all_ids = [job_id for jobs in claimed.values() for job_id in jobs]
+    assert len(all_ids) == 50
+    assert set(all_ids) == {f"job-{i}" for i in range(50)}
+    for worker_id, jobs in claimed.items():
+        for job_id in jobs:
+            assert setup.get(job_id)["claimed_by"] == worker_id
+
+
+def test_expired_lease_is_reclaimed():
+    queue = SQLiteJobQueue(max_attempts=3)
+    queue.enqueue("job", _request())
+
+    first = asyncio.run(queue.claim("w1", 1, -1))
+    assert [job.job_id for job in first] == ["job"]
+    assert asyncio.run(queue.claim("w2", 1, 60)) == []
+
+    assert asyncio.run(queue.recover_expired()) == 1
+    job = queue.get("job")
+    assert job["status"] == "PENDING"
+    assert job["claimed_by"] is None
+
+    second = asyncio.run(queue.claim("w2", 1, 60))
+    assert [job.job_id for job in second] == ["job"]
+    assert second[0].attempts == 2
+    assert not asyncio.run(queue.extend_lease("job", "w1", 60))
+    assert asyncio.run(queue.extend_lease("job", "w2", 60))
+
+
+def test_expired_lease_fails_after_max_attempts():
+    queue = SQLiteJobQueue(max_attempts=1)
+    queue.enqueue("job", _request())
+
+    asyncio.run(queue.claim("w1", 1, -1))
+    assert asyncio.run(queue.recover_expired()) == 1
+    assert queue.get("job")["status"] == "FAILED"
+    assert asyncio.run(queue.claim("w2", 1, 60)) == []
+
+
+def test_stale_owner_cannot_finish():
+    queue = SQLiteJobQueue()
+    queue.enqueue("job", _request())
+
+    asyncio.run(queue.claim("w1", 1, -1))
+    asyncio.run(queue.recover_expired())
+    asyncio.run(queue.claim("w2", 1, 60))
+
+    # w1 fortsatte efter att leasen gick ut: delresultat, complete och fail ska ignoreras
+    asyncio.run(queue.save_partial(["job"], {"explanation": "gammalt delresultat"}, "w1"))
+    assert queue.get("job")["result_data"] is None
+    asyncio.run(queue.save_partial(["job"], {"explanation": "delresultat"}, "w2"))
+    assert queue.get("job")["result_data"] == {"explanation": "delresultat"}
+
+    assert asyncio.run(queue.complete(["job"], {"explanation": "gammal"}, "w1")) == []
+    assert asyncio.run(queue.fail(["job"], "timeout", "w1")) == []
+    job = queue.get("job")
+    assert job["status"] == "RUNNING"
+    assert job["claimed_by"] == "w2"
+    assert job["result_data"] == {"explanation": "delresultat"}
+
+    assert asyncio.run(queue.complete(["job"], {"explanation": "ny"}, "w2")) == ["job"]
+    job = queue.get("job")
+    assert job["status"] == "COMPLETED"
+    assert job["result_data"] == {"explanation": "ny"}
+
+    # Ett redan avslutat jobb skrivs inte över, inte ens av ägaren
+    assert asyncio.run(queue.fail(["job"], "sent fel", "w2")) == []
+    assert queue.get("job")["status"] == "COMPLETED"
@@ -0,0 +1,69 @@
+import asyncio
+
+import httpx
+import pytest
+
+from backend.utils.resilience import CircuitBreaker, CircuitOpenError, RetryPolicy, call_with_resilience
+
+# Brytaren ska bara räkna fel hos tjänsten (5xx, nätverksfel), inte kvotbegränsning (429).
+
+
+def _status_error(status: int, retry_after: str = "0") -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://gemini.test/v1beta/models/x:generateContent")
+    response = httpx.Response(status, headers={"Retry-After": retry_after}, request=request)
+    return httpx.HTTPStatusError(f"{status}", request=request, response=response)
+
+
+def _responses(*outcomes):
+    """fn() som kastar eller returnerar utfallen i tur och ordning."""
+    remaining = list(outcomes)
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        outcome = remaining.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return fn, calls
+
+
+def test_rate_limits_do_not_open_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=3)
+    fn, calls = _responses(*[_status_error(429) for _ in range(6)], "ok")
+
+    result = asyncio.run(call_with_resilience(fn, breaker=breaker, policy=RetryPolicy(max_attempts=10), name="test"))
+
+    assert result == "ok"
+    assert len(calls) == 7
+    assert breaker.state == "closed"
+    assert breaker.times_opened == 0
+
+
+def test_rate_limit_honors_retry_after(monkeypatch):
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+    fn, _ = _responses(_status_error(429, retry_after="1.5"), "ok")
+    policy = RetryPolicy(max_attempts=2, base_delay=0.01, max_delay=0.01)
+
+    assert asyncio.run(call_with_resilience(fn, breaker=CircuitBreaker("test"), policy=policy)) == "ok"
+    assert delays == [1.5]
+
+
+def test_server_errors_open_breaker():
+    breaker = CircuitBreaker("test", failure_threshold=3)
+    fn, calls = _responses(*[_status_error(503) for _ in range(5)])
+    policy = RetryPolicy(max_attempts=5, base_delay=0, max_delay=0)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(call_with_resilience(fn, breaker=breaker, policy=policy))
+    assert len(calls) == 3
+    assert breaker.state == "open"
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(call_with_resilience(_responses("ok")[0], breaker=breaker, policy=policy))
@@ -0,0 +1,45 @@
+import time
+
+from backend.learning_models import ActivityRequest
+from backend.utils.result_cache import SemanticResultCache
+
+# SemanticResultCache: träffar får eget response_id, och jobb som läses in från
+# activity_jobs (förvärmning/påfyllning) dubbleras inte och respekterar TTL.
+
+REQUEST = ActivityRequest(query="fotosyntes", quiz_questions=2, subject="biologi")
+RESULT = {"response_id": "original", "explanation": "Växter gör socker av ljus."}
+
+
+def test_hit_gets_its_own_response_id():
+    cache = SemanticResultCache(threshold=0.9)
+    cache.store(REQUEST, [1.0, 0.0], "job-1", RESULT)
+
+    first = cache.lookup(REQUEST, [0.99, 0.05])
+    second = cache.lookup(REQUEST, [0.99, 0.05])
+
+    assert first.job_id == "job-1"
+    assert first.result["explanation"] == RESULT["explanation"]
+    assert first.result["response_id"] not in ("original", second.result["response_id"])
+    assert RESULT["response_id"] == "original"
+
+
+def test_other_partition_misses():
+    cache = SemanticResultCache(threshold=0.9)
+    cache.store(REQUEST, [1.0, 0.0], "job-1", RESULT)
+    other = ActivityRequest(query="fotosyntes", quiz_questions=3, subject="biologi")
+    assert cache.lookup(other, [1.0, 0.0]) is None
+
+
+def test_loaded_jobs_skip_covered_and_expired():
+    cache = SemanticResultCache(threshold=0.9, ttl_seconds=3600)
+    assert cache.store(REQUEST, [1.0, 0.0], "job-1", RESULT)
+
+    # Samma jobb igen (t.ex. processens eget jobb i påfyllningen) och en cacheträff som sparats som eget jobb
+    assert not cache.store(REQUEST, [1.0, 0.0], "job-1", RESULT, skip_covered=True)
+    assert not cache.store(REQUEST, [0.99, 0.05], "job-2", RESULT, skip_covered=True)
+    # En annan fråga läggs till, ett för gammalt jobb inte
+    assert cache.store(REQUEST, [0.0, 1.0], "job-3", RESULT, created_at=time.time() - 60, skip_covered=True)
+    assert not cache.store(REQUEST, [0.6, 0.8], "job-4", RESULT, created_at=time.time() - 7200, skip_covered=True)
+
+    assert cache.stats()["entries"] == 2
+    assert cache.lookup(REQUEST, [0.0, 1.0]).job_id == "job-3"
@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+import httpx
+
+from backend import main
+from backend.learning_models import ActivityRequest
+from backend.utils import http_client
+
+# Strömmad generering: ett ogiltigt objekt hoppas över utan att strömmen avbryts,
+# och vid omgenerering utan strömning nollställs delresultaten först.
+
+REQUEST = ActivityRequest(query="fotosyntes", quiz_questions=3)
+
+
+def _question(question_id: int, **overrides) -> dict:
+    question = {
+        "question_id": question_id,
+        "type": "multiple_choice",
+        "prompt": f"Fråga {question_id}?",
+        "alternatives": [{"id": "a", "text": "Rätt", "is_correct": True}],
+        "explanation_correct": "Rätt.",
+        "explanation_incorrect": "Fel.",
+    }
+    question.update(overrides)
+    return question
+
+
+def _sse_handler(document: dict):
+    text = json.dumps(document, ensure_ascii=False)
+
+    def handler(request):
+        body = "".join(
+            f"data: {json.dumps({'candidates': [{'content': {'parts': [{'text': text[i:i + 40]}]}}]})}\r\n\r\n"
+            for i in range(0, len(text), 40)
+        )
+        return httpx.Response(200, content=body.encode(), headers={"content-type": "text/event-stream"})
+
+    return handler
+
+
+def test_invalid_streamed_item_is_skipped(monkeypatch):
+    document = {
+        "response_id": "r1",
+        "explanation": "Förklaring",
+        "quiz": {"topic": "Växter", "questions": [_question(1), _question(2, type="essay"), _question(3)]},
+        "flashcards": None,
+    }
+    monkeypatch.setattr(http_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(_sse_handler(document))))
+    monkeypatch.setattr(main, "GEMINI_API_KEY", "test")
+    partials = []
+
+    result = asyncio.run(main.generate_activities_streaming(["kontext"], REQUEST, partials.append))
+
+    assert [q["question_id"] for q in result["quiz"]["questions"]] == [1, 3]
+    # Slutresultatet motsäger inte det som redan har visats
+    assert partials[-1]["quiz"]["questions"] == result["quiz"]["questions"]
+    assert all(q["question_id"] != 2 for p in partials if p["quiz"] for q in p["quiz"]["questions"])
+
+
+def test_fallback_resets_published_partials(monkeypatch):
+    async def fetch(query, subject, match_count=8, query_embedding=None):
+        return [{"content": "Fotosyntesen sker i kloroplasterna.", "similarity": 0.9}]
+
+    async def streaming(chunks, request, on_partial, usage=None):
+        on_partial({"response_id": None, "explanation": "Första försöket", "quiz": None, "flashcards": None})
+        raise ValueError("avbruten ström")
+
+    async def non_streaming(chunks, request, usage=None):
+        return {"response_id": "r2", "explanation": "Andra försöket", "quiz": None, "flashcards": None}
+
+    monkeypatch.setattr(main, "GEMINI_STREAMING", True)
+    monkeypatch.setattr(main, "fetch_relevant_chunks", fetch)
+    monkeypatch.setattr(main, "generate_activities_streaming", streaming)
+    monkeypatch.setattr(main, "generate_activities_with_llm", non_streaming)
+    partials = []
+
+    result = asyncio.run(main._generate_for_request("job", REQUEST, [1.0, 0.0], partials.append))
+
+    assert result["explanation"] == "Andra försöket"
+    assert partials[-1] == main.empty_partial()
@@ -0,0 +1,32 @@
+from backend.utils.text_splitter import approx_tokens, normalize_whitespace, split_spans, split_text
+
+# Tokenbudgeten ska hålla även när ett enskilt ord (URL, base64, tabellrad utan
+# blanksteg) är större än max_tokens.
+
+
+def test_oversize_word_is_hard_split():
+    word = "x" * 5000
+    text = f"Inledning. {word} och sedan text efter ordet."
+
+    spans = list(split_spans(text, max_tokens=100, overlap_tokens=10))
+    chunks = [normalize_whitespace(text[s:e]) for s, e in spans]
+
+    assert all(approx_tokens(chunk) <= 100 for chunk in chunks)
+    # Inget av ordet tappas bort
+    assert "".join(chunk.replace(" ", "") for chunk in chunks).count("x") >= 5000
+    assert chunks[-1].endswith("efter ordet.")
+
+
+def test_oversize_word_in_stream_is_hard_split():
+    word = "y" * 5000
+    chunks = list(split_text(iter(["Början. ", word, " slut."]), max_tokens=100, overlap_tokens=10))
+
+    assert all(approx_tokens(chunk) <= 100 for chunk in chunks)
+    assert sum(chunk.count("y") for chunk in chunks) >= 5000
+
+
+def test_custom_length_fn_is_respected():
+    # En length_fn med 1 token per tecken: bitarna krymps tills de ryms
+    chunks = list(split_text("a" * 250, max_tokens=100, overlap_tokens=0, length_fn=len))
+
+    assert [len(chunk) for chunk in chunks] == [100, 100, 50]
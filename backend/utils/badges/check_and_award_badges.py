@@ -1,26 +1,29 @@
-from backend.utils.supabase_client import supabase
+from typing import Dict, List, Optional
 
-def check_and_award_badges(user_id):
-    # 1. Get user stats
-    stats = supabase.table("user_stats").select("*").eq("user_id", user_id).single().execute().data
+from backend.utils.supabase_client import get_supabase
+from backend.utils.badges.engine import BadgeEngine
 
-    # 2. Get all badges
-    badges = supabase.table("badges").select("*").execute().data
+_engine: Optional[BadgeEngine] = None
 
-    # 3. Get already earned badges
-    earned = supabase.table("user_badges").select("badge_id").eq("user_id", user_id).execute().data
-    earned_ids = {b["badge_id"] for b in earned}
 
-    # 4. Check badge conditions
-    for badge in badges:
-        if badge["id"] in earned_ids:
-            continue
+def get_badge_engine() -> BadgeEngine:
+    """Delad motor (och därmed delad badgekatalog) per process."""
+    global _engine
+    if _engine is None:
+        _engine = BadgeEngine(get_supabase())
+    return _engine
 
-        req_type = badge["requirement_type"]
-        req_val = badge["requirement_value"]
 
-        if stats.get(req_type, 0) >= req_val:
-            supabase.table("user_badges").insert({
-                "user_id": user_id,
-                "badge_id": badge["id"]
-            }).execute()
+def check_and_award_badges(user_id) -> List[str]:
+    """Delar ut badges som användarens statistik kvalificerar för. Returnerar nya badge_id."""
+    return get_badge_engine().check_and_award([user_id]).get(user_id, [])
+
+
+def check_and_award_badges_many(user_ids: List[str]) -> Dict[str, List[str]]:
+    """Samma sak för många användare (t.ex. en hel klass efter ett quiz) i ett par anrop."""
+    return get_badge_engine().check_and_award(user_ids)
+
+
+def submit_stat_deltas(deltas: Dict[str, Dict[str, float]]) -> Dict[str, List[str]]:
+    """Ökar statistiken, t.ex. {user_id: {"quizzes_completed": 1}}, och delar ut upplåsta badges."""
+    return get_badge_engine().apply_deltas(deltas)
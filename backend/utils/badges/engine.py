@@ -0,0 +1,284 @@
+import os
+import time
+import uuid
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Badgemotor: utvärderar många användare per anrop.
+# Badgekatalogen (tabellen badges) ändras sällan och cachas därför med TTL, indexerad
+# per requirement_type med trösklarna sorterade. För ett statistikvärde ger bisect
+# direkt alla badges vars tröskel är passerad, i stället för att gå igenom hela katalogen.
+# Redan tagna badges per användare cachas (LRU), så att bara nyss passerade trösklar
+# skrivs. De skrivs med en enda upsert (ignore_duplicates) för alla användare; databasen
+# skyddar fortfarande mot dubbletter om en annan process hann dela ut samma badge.
+# Med apply_deltas() skickar anroparen bara ändringarna (quizzes_completed += 1): räknarna
+# ökas atomiskt och bara trösklarna som ökningen passerade kontrolleras.
+# Kräver backend/sql/user_badges_unique.sql (och increment_user_stats.sql för apply_deltas).
+
+DEFAULT_CATALOG_TTL_SECONDS = 300.0
+DEFAULT_EARNED_CACHE_USERS = 10_000
+UPSERT_BATCH_SIZE = 500
+
+
+def normalize_user_id(user_id) -> str:
+    """Kanonisk form (gemener, med bindestreck) så att uuid från anroparen och databasen kan jämföras."""
+    try:
+        return str(uuid.UUID(str(user_id)))
+    except ValueError:
+        return str(user_id)
+
+
+class BadgeCatalog:
+    """Cachad badgekatalog: requirement_type -> (sorterade trösklar, badges i samma ordning)."""
+
+    def __init__(self, client, ttl_seconds: float = DEFAULT_CATALOG_TTL_SECONDS):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self._index: Optional[Dict[str, Tuple[List[float], List[dict]]]] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+        self.loads = 0
+
+    @classmethod
+    def from_env(cls, client) -> "BadgeCatalog":
+        return cls(client, ttl_seconds=float(os.getenv("BADGE_CATALOG_TTL", DEFAULT_CATALOG_TTL_SECONDS)))
+
+    @staticmethod
+    def build_index(badges: Iterable[dict]) -> Dict[str, Tuple[List[float], List[dict]]]:
+        grouped: Dict[str, List[dict]] = {}
+        for badge in badges:
+            grouped.setdefault(badge["requirement_type"], []).append(badge)
+        index = {}
+        for requirement_type, group in grouped.items():
+            group.sort(key=lambda b: b["requirement_value"])
+            index[requirement_type] = ([b["requirement_value"] for b in group], group)
+        return index
+
+    def invalidate(self):
+        """Tvingar omladdning vid nästa anrop (t.ex. efter att badges har ändrats)."""
+        with self._lock:
+            self._index = None
+
+    def index(self) -> Dict[str, Tuple[List[float], List[dict]]]:
+        with self._lock:
+            if self._index is None or time.monotonic() - self._loaded_at > self.ttl_seconds:
+                badges = self.client.table("badges").select("id, requirement_type, requirement_value").execute().data
+                self._index = self.build_index(badges)
+                self._loaded_at = time.monotonic()
+                self.loads += 1
+            return self._index
+
+    def requirement_types(self) -> List[str]:
+        return list(self.index())
+
+    def crossed(self, requirement_type: str, value) -> List[dict]:
+        """Alla badges för requirement_type vars tröskel är uppnådd av value."""
+        entry = self.index().get(requirement_type)
+        if entry is None or value is None:
+            return []
+        thresholds, badges = entry
+        return badges[:bisect_right(thresholds, value)]
+
+    def crossed_between(self, requirement_type: str, before, after) -> List[dict]:
+        """Badges vars tröskel passerades när värdet gick från before till after."""
+        entry = self.index().get(requirement_type)
+        if entry is None:
+            return []
+        thresholds, badges = entry
+        return badges[bisect_right(thresholds, before):bisect_right(thresholds, after)]
+
+
+class EarnedBadgeCache:
+    """LRU: user_id -> badge_id som användaren redan har."""
+
+    def __init__(self, max_users: int = DEFAULT_EARNED_CACHE_USERS):
+        self.max_users = max_users
+        self._entries: "OrderedDict[str, Set]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "EarnedBadgeCache":
+        return cls(max_users=int(os.getenv("BADGE_EARNED_CACHE_USERS", DEFAULT_EARNED_CACHE_USERS)))
+
+    def get(self, user_id: str) -> Optional[Set]:
+        with self._lock:
+            earned = self._entries.get(user_id)
+            if earned is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return earned
+
+    def put(self, user_id: str, badge_ids: Iterable):
+        with self._lock:
+            self._entries[user_id] = set(badge_ids)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def add(self, user_id: str, badge_ids: Iterable):
+        """Lägger till nyss utdelade badges för en användare som redan finns i cachen."""
+        with self._lock:
+            earned = self._entries.get(user_id)
+            if earned is not None:
+                earned.update(badge_ids)
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """Glömmer en användare (t.ex. om en badge har tagits bort manuellt) eller hela cachen."""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+
+class BadgeEngine:
+    """Utvärderar och delar ut badges för många användare med få anrop mot databasen."""
+
+    def __init__(self, client, catalog: Optional[BadgeCatalog] = None, earned: Optional[EarnedBadgeCache] = None):
+        self.client = client
+        self.catalog = catalog or BadgeCatalog.from_env(client)
+        self.earned = earned or EarnedBadgeCache.from_env()
+
+        self.evaluated_users = 0
+        self.awarded = 0
+        self.earned_loads = 0
+
+    def evaluate(self, stats_by_user: Dict[str, dict]) -> Dict[str, List[dict]]:
+        """Badges som varje användares statistik kvalificerar för (även redan tagna)."""
+        qualified: Dict[str, List[dict]] = {}
+        types = self.catalog.requirement_types()
+        for user_id, stats in stats_by_user.items():
+            badges = []
+            for requirement_type in types:
+                badges.extend(self.catalog.crossed(requirement_type, stats.get(requirement_type)))
+            qualified[user_id] = badges
+        return qualified
+
+    def fetch_stats(self, user_ids: List[str]) -> Dict[str, dict]:
+        """user_stats för alla användarna i en fråga."""
+        rows = self.client.table("user_stats").select("*").in_("user_id", user_ids).execute().data
+        return {row["user_id"]: row for row in rows}
+
+    def fetch_earned(self, user_ids: List[str]) -> Dict[str, Set]:
+        """Redan tagna badges; användare som saknas i cachen läses i en fråga."""
+        earned: Dict[str, Set] = {}
+        missing = []
+        for user_id in user_ids:
+            cached = self.earned.get(user_id)
+            if cached is None:
+                missing.append(user_id)
+            else:
+                earned[user_id] = cached
+        if missing:
+            rows = self.client.table("user_badges").select("user_id, badge_id").in_("user_id", missing).execute().data
+            self.earned_loads += 1
+            for user_id in missing:
+                earned[user_id] = set()
+            for row in rows or []:
+                earned.setdefault(row["user_id"], set()).add(row["badge_id"])
+            for user_id in missing:
+                self.earned.put(user_id, earned[user_id])
+        return earned
+
+    def award(self, stats_by_user: Dict[str, dict]) -> Dict[str, List[str]]:
+        """Delar ut badges vars tröskel är passerad men som användaren inte har. Returnerar user_id -> nyss tagna badge_id."""
+        self.evaluated_users += len(stats_by_user)
+        qualified = self.evaluate(stats_by_user)
+        earned = self.fetch_earned(list(qualified))
+        new = {}
+        for user_id, badges in qualified.items():
+            badges = [badge for badge in badges if badge["id"] not in earned[user_id]]
+            if badges:
+                new[user_id] = badges
+        # Vanligast är att inget nytt har låsts upp: då blir det ingen skrivning alls
+        return self._insert(new)
+
+    def apply_deltas(self, deltas: Dict[str, Dict[str, float]]) -> Dict[str, List[str]]:
+        """Ökar räknarna (t.ex. {"u1": {"quizzes_completed": 1}}) och delar ut de badges som ökningen låser upp.
+
+        Bara badges med en requirement_type som ändrades och en tröskel mellan värdet före och
+        efter utvärderas. Ökningen sker atomiskt i databasen (backend/sql/increment_user_stats.sql).
+        """
+        # Databasen svarar med uuid i kanonisk form; anroparens form kan skilja sig (versaler, utan bindestreck)
+        normalized: Dict[str, Dict[str, float]] = {}
+        caller_ids: Dict[str, object] = {}
+        for user_id, stats in deltas.items():
+            key = normalize_user_id(user_id)
+            caller_ids.setdefault(key, user_id)
+            merged = normalized.setdefault(key, {})
+            for stat, amount in stats.items():
+                if amount:
+                    merged[stat] = merged.get(stat, 0) + amount
+        payload = [{"user_id": user_id, "stats": stats} for user_id, stats in normalized.items() if stats]
+        if not payload:
+            return {}
+        updated = self.client.rpc("increment_user_stats", {"deltas": payload}).execute().data or []
+        self.evaluated_users += len(payload)
+
+        crossed: Dict[str, List[dict]] = {}
+        for row in updated:
+            user_id = normalize_user_id(row["user_id"])
+            amount = normalized.get(user_id, {}).get(row["stat"])
+            if amount is None:
+                print(f"VARNING: increment_user_stats svarade med okänd rad ({row['user_id']}, {row['stat']}).")
+                continue
+            after = row["value"]
+            before = after - amount
+            # Redan tagna badges (enligt cachen) kan finnas om statistiken har minskat tidigare
+            earned = self.earned.get(user_id) or set()
+            badges = [b for b in self.catalog.crossed_between(row["stat"], before, after) if b["id"] not in earned]
+            if badges:
+                crossed.setdefault(user_id, []).extend(badges)
+        # Oftast låser ökningen inte upp något: då blir det ingen skrivning alls
+        awarded = self._insert(crossed)
+        return {caller_ids.get(normalize_user_id(user_id), user_id): ids for user_id, ids in awarded.items()}
+
+    def _insert(self, badges_by_user: Dict[str, List[dict]]) -> Dict[str, List[str]]:
+        """Idempotent insert i user_badges; svaret innehåller bara de rader som faktiskt skrevs."""
+        if not badges_by_user:
+            return {}
+        rows = [
+            {"user_id": user_id, "badge_id": badge["id"]}
+            for user_id, badges in badges_by_user.items()
+            for badge in badges
+        ]
+        awarded: Dict[str, List[str]] = {}
+        for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+            inserted = self.client.table("user_badges").upsert(
+                rows[start:start + UPSERT_BATCH_SIZE],
+                on_conflict="user_id,badge_id",
+                ignore_duplicates=True,
+            ).execute().data
+            for row in inserted or []:
+                awarded.setdefault(row["user_id"], []).append(row["badge_id"])
+                self.awarded += 1
+        # Även rader som databasen hoppade över (utdelade av en annan process) är tagna nu
+        for user_id, badges in badges_by_user.items():
+            self.earned.add(user_id, (badge["id"] for badge in badges))
+        return awarded
+
+    def check_and_award(self, user_ids: List[str]) -> Dict[str, List[str]]:
+        """Läser statistiken för användarna och delar ut nya badges (högst tre anrop oavsett antal användare)."""
+        if not user_ids:
+            return {}
+        caller_ids = {normalize_user_id(user_id): user_id for user_id in user_ids}
+        awarded = self.award(self.fetch_stats(list(user_ids)))
+        return {caller_ids.get(normalize_user_id(user_id), user_id): ids for user_id, ids in awarded.items()}
+
+    def stats(self) -> dict:
+        return {
+            "catalog_loads": self.catalog.loads,
+            "evaluated_users": self.evaluated_users,
+            "awarded": self.awarded,
+            "earned_loads": self.earned_loads,
+            "earned_cache_hits": self.earned.hits,
+            "earned_cache_misses": self.earned.misses,
+        }
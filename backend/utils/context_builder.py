@@ -0,0 +1,173 @@
+import os
+import re
+import json
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from backend.utils.text_splitter import approx_tokens
+
+# Bygger RAG-kontexten till genereringsprompten.
+# Sökträffarna (rader från retrievern) sorteras på relevans, nära dubbletter tas
+# bort och resten tas med tills tokenbudgeten är slut. Nära dubbletter känns igen
+# på inbäddningen när raden har en ("embedding", från LocalVectorRetriever), annars
+# på ordöverlapp (3-gram), så att samma stycke i två årskurser eller två nästan lika
+# kursplaneavsnitt inte skickas två gånger.
+# match_chunks (SupabaseRetriever) returnerar avsiktligt inte embedding: 768 flyttal
+# per träff skulle mångdubbla svaret för varje sökning. Där används alltid 3-gram,
+# som för textnära dubbletter ger samma urval.
+
+DEFAULT_MAX_TOKENS = 1500
+# Cosinuslikhet över vilken två chunks räknas som samma innehåll
+DEFAULT_DUPLICATE_SIMILARITY = 0.95
+# Jaccard-likhet för ord-3-gram när inbäddning saknas
+DEFAULT_DUPLICATE_OVERLAP = 0.8
+
+_WORD = re.compile(r"\w+")
+
+
+@dataclass
+class Context:
+    chunks: List[str] = field(default_factory=list)
+    tokens: int = 0
+    retrieved: int = 0
+    duplicates: int = 0
+    over_budget: int = 0
+
+
+def _unit_vector(embedding) -> Optional[np.ndarray]:
+    if embedding is None:
+        return None
+    if isinstance(embedding, str):
+        # pgvector via PostgREST kommer som "[0.1,0.2,...]"
+        embedding = json.loads(embedding)
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else None
+
+
+def _shingles(text: str) -> frozenset:
+    words = _WORD.findall(text.lower())
+    if len(words) < 3:
+        return frozenset(words)
+    return frozenset(zip(words, words[1:], words[2:]))
+
+
+def _truncate(text: str, max_tokens: int, length_fn: Callable[[str], int]) -> str:
+    """Kortar texten vid ordgräns så att den ryms i max_tokens."""
+    words = text.split(" ")
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if length_fn(" ".join(words[:middle])) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return " ".join(words[:low])
+
+
+class ContextBuilder:
+    """Relevansordning, dubblettrensning och tokenbudget för RAG-kontexten."""
+
+    def __init__(
+        self,
+        max_tokens: int = DEFAULT_MAX_TOKENS,
+        duplicate_similarity: float = DEFAULT_DUPLICATE_SIMILARITY,
+        duplicate_overlap: float = DEFAULT_DUPLICATE_OVERLAP,
+        length_fn: Callable[[str], int] = approx_tokens,
+    ):
+        self.max_tokens = max_tokens
+        self.duplicate_similarity = duplicate_similarity
+        self.duplicate_overlap = duplicate_overlap
+        self.length_fn = length_fn
+
+    @classmethod
+    def from_env(cls) -> "ContextBuilder":
+        """RAG_CONTEXT_TOKENS, RAG_DUPLICATE_SIMILARITY och RAG_DUPLICATE_OVERLAP."""
+        return cls(
+            max_tokens=int(os.getenv("RAG_CONTEXT_TOKENS", DEFAULT_MAX_TOKENS)),
+            duplicate_similarity=float(os.getenv("RAG_DUPLICATE_SIMILARITY", DEFAULT_DUPLICATE_SIMILARITY)),
+            duplicate_overlap=float(os.getenv("RAG_DUPLICATE_OVERLAP", DEFAULT_DUPLICATE_OVERLAP)),
+        )
+
+    def build(self, rows: List[dict]) -> Context:
+        """rows: {"content", "similarity", ev. "embedding"} i valfri ordning."""
+        context = Context(retrieved=len(rows))
+        ordered = sorted(rows, key=lambda row: row.get("similarity") or 0.0, reverse=True)
+
+        kept_texts = set()
+        kept_vectors: List[np.ndarray] = []
+        kept_shingles: List[frozenset] = []
+
+        for row in ordered:
+            text = row["content"]
+            if text in kept_texts:
+                context.duplicates += 1
+                continue
+
+            vector = _unit_vector(row.get("embedding"))
+            if vector is not None and kept_vectors:
+                if float(np.max(np.stack(kept_vectors) @ vector)) >= self.duplicate_similarity:
+                    context.duplicates += 1
+                    continue
+            shingles = _shingles(text)
+            if vector is None and shingles:
+                if any(
+                    len(shingles & other) / len(shingles | other) >= self.duplicate_overlap
+                    for other in kept_shingles
+                ):
+                    context.duplicates += 1
+                    continue
+
+            tokens = self.length_fn(text)
+            remaining = self.max_tokens - context.tokens
+            if tokens > remaining:
+                if context.chunks:
+                    context.over_budget += 1
+                    continue
+                # Även den mest relevanta chunken ska med, men kortad till budgeten
+                text = _truncate(text, remaining, self.length_fn)
+                tokens = self.length_fn(text)
+
+            context.chunks.append(text)
+            context.tokens += tokens
+            kept_texts.add(row["content"])
+            kept_shingles.append(shingles)
+            if vector is not None:
+                kept_vectors.append(vector)
+
+        return context
+
+
+class PromptStats:
+    """Summor per jobb för /metrics: kontext, uppskattade och faktiska indatatokens."""
+
+    def __init__(self):
+        self.jobs = 0
+        self.context_tokens = 0
+        self.estimated_prompt_tokens = 0
+        self.prompt_tokens = 0
+        self.reported_jobs = 0
+        self.duplicates = 0
+        self.over_budget = 0
+
+    def record(self, context: Context, estimated_prompt_tokens: int, prompt_tokens: Optional[int]):
+        self.jobs += 1
+        self.context_tokens += context.tokens
+        self.estimated_prompt_tokens += estimated_prompt_tokens
+        self.duplicates += context.duplicates
+        self.over_budget += context.over_budget
+        if prompt_tokens is not None:
+            self.reported_jobs += 1
+            self.prompt_tokens += prompt_tokens
+
+    def snapshot(self) -> dict:
+        return {
+            "jobs": self.jobs,
+            "avg_context_tokens": self.context_tokens / self.jobs if self.jobs else 0.0,
+            "avg_estimated_prompt_tokens": self.estimated_prompt_tokens / self.jobs if self.jobs else 0.0,
+            "avg_prompt_tokens": self.prompt_tokens / self.reported_jobs if self.reported_jobs else 0.0,
+            "duplicates_dropped": self.duplicates,
+            "over_budget_dropped": self.over_budget,
+        }
@@ -0,0 +1,183 @@
+import os
+import json
+import mmap
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from backend.utils.text_splitter import normalize_whitespace
+
+# Kompakt, minnesmappad representation av chunkad kurstext.
+# Per ämne finns tre filer i korpuskatalogen:
+#   <ämne>.txt         källtexten som UTF-8 (mappas med mmap, delas av alla processer)
+#   <ämne>.chunks.npy  chunktabell: start/slut (byte-offsets) + index till rubrik/årskurs
+#   <ämne>.json        internerade rubriker och årskurser, content_type och innehållshashar
+# Chunkens text skapas först när den efterfrågas (bytes -> str + normaliserade blanksteg).
+
+CHUNK_DTYPE = np.dtype([
+    ("start", "<u4"),
+    ("end", "<u4"),
+    ("heading", "<u2"),
+    ("grade", "<u2"),
+])
+
+DEFAULT_CORPUS_DIR = Path(__file__).resolve().parent.parent / "data" / "corpus"
+
+
+def corpus_dir_from_env() -> Path:
+    return Path(os.getenv("CORPUS_DIR", str(DEFAULT_CORPUS_DIR)))
+
+
+def _byte_offsets(text: str, offsets: Iterable[int]) -> Dict[int, int]:
+    """Teckenoffset -> byteoffset i UTF-8, i ett pass över de sorterade offseten."""
+    mapping: Dict[int, int] = {}
+    previous, position = 0, 0
+    for offset in sorted(set(offsets)):
+        position += len(text[previous:offset].encode("utf-8"))
+        mapping[offset] = position
+        previous = offset
+    return mapping
+
+
+def _save_array(path: Path, array: np.ndarray):
+    # Via filobjekt: np.save(path) skulle lägga till .npy på .tmp-namnet
+    with open(path, "wb") as f:
+        np.save(f, array)
+
+
+def write_subject(
+    corpus_dir,
+    subject: str,
+    text: str,
+    chunks: List[Tuple[int, int, str, Optional[str]]],
+    content_type: str,
+    hashes: Optional[List[str]] = None,
+):
+    """Skriver ett ämnes korpus. chunks är (start, slut, rubrik, årskurs) med teckenoffsets i text."""
+    directory = Path(corpus_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    headings: Dict[str, int] = {}
+    grades: Dict[Optional[str], int] = {}
+    to_bytes = _byte_offsets(text, (o for start, end, _, _ in chunks for o in (start, end)))
+
+    table = np.empty(len(chunks), dtype=CHUNK_DTYPE)
+    for i, (start, end, heading, grade) in enumerate(chunks):
+        table[i] = (
+            to_bytes[start],
+            to_bytes[end],
+            headings.setdefault(heading, len(headings)),
+            grades.setdefault(grade, len(grades)),
+        )
+
+    # Skriv till temporära filer och byt namn, så att läsare aldrig ser en halv korpus
+    for suffix, write in (
+        (".txt", lambda p: p.write_bytes(text.encode("utf-8"))),
+        (".chunks.npy", lambda p: _save_array(p, table)),
+        (".json", lambda p: p.write_text(json.dumps({
+            "subject": subject,
+            "content_type": content_type,
+            "headings": list(headings),
+            "grades": list(grades),
+            "hashes": hashes or [],
+        }, ensure_ascii=False), encoding="utf-8")),
+    ):
+        target = directory / f"{subject}{suffix}"
+        tmp = target.with_name(target.name + ".tmp")
+        write(tmp)
+        os.replace(tmp, target)
+
+
+class SubjectCorpus:
+    """Ett ämnes chunks. Texten ligger kvar i den mappade filen tills text(i) anropas."""
+
+    def __init__(self, directory: Path, subject: str):
+        info = json.loads((directory / f"{subject}.json").read_text(encoding="utf-8"))
+        self.subject = subject
+        self.content_type: str = info["content_type"]
+        self.headings: List[str] = info["headings"]
+        self.grades: List[Optional[str]] = info["grades"]
+        self.hashes: List[str] = info["hashes"]
+        self.table = np.load(directory / f"{subject}.chunks.npy", mmap_mode="r")
+
+        with open(directory / f"{subject}.txt", "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+        # Metadata-dictarna delas av alla chunks med samma rubrik och årskurs
+        self._metadata: Dict[Tuple[int, int], dict] = {}
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def text(self, i: int) -> str:
+        row = self.table[i]
+        return normalize_whitespace(self._blob[int(row["start"]):int(row["end"])].decode("utf-8"))
+
+    def metadata(self, i: int) -> dict:
+        """Delad (read-only) metadata-dict på chunks-tabellens form."""
+        row = self.table[i]
+        key = (int(row["heading"]), int(row["grade"]))
+        metadata = self._metadata.get(key)
+        if metadata is None:
+            metadata = self._metadata[key] = {
+                "subject": self.subject,
+                "grade_level": self.grades[key[1]],
+                "content_type": self.content_type,
+                "heading": self.headings[key[0]],
+            }
+        return metadata
+
+    def record(self, i: int) -> dict:
+        return {"content": self.text(i), "metadata": self.metadata(i)}
+
+    def close(self):
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+
+
+class Corpus:
+    """Alla ämnen i en korpuskatalog; varje ämne öppnas (mappas) först när det används."""
+
+    def __init__(self, corpus_dir=None):
+        self.directory = Path(corpus_dir) if corpus_dir is not None else corpus_dir_from_env()
+        self._subjects: Dict[str, SubjectCorpus] = {}
+        self._by_hash: Optional[Dict[str, Tuple[str, int]]] = None
+        self._lock = threading.Lock()
+
+    def subjects(self) -> List[str]:
+        return sorted(p.name[:-len(".json")] for p in self.directory.glob("*.json"))
+
+    def subject(self, subject: str) -> SubjectCorpus:
+        corpus = self._subjects.get(subject)
+        if corpus is None:
+            with self._lock:
+                corpus = self._subjects.get(subject)
+                if corpus is None:
+                    corpus = self._subjects[subject] = SubjectCorpus(self.directory, subject)
+        return corpus
+
+    def text(self, subject: str, i: int) -> str:
+        return self.subject(subject).text(i)
+
+    def iter_refs(self, subjects: Optional[Iterable[str]] = None) -> Iterator[Tuple[str, int]]:
+        for subject in subjects if subjects is not None else self.subjects():
+            for i in range(len(self.subject(subject))):
+                yield subject, i
+
+    def find(self, content_hash: str) -> Optional[Tuple[str, int]]:
+        """(ämne, index) för en chunk med given innehållshash, om den finns i korpusen."""
+        if self._by_hash is None:
+            by_hash = {}
+            for subject in self.subjects():
+                for i, h in enumerate(self.subject(subject).hashes):
+                    by_hash.setdefault(h, (subject, i))
+            self._by_hash = by_hash
+        return self._by_hash.get(content_hash)
+
+    def close(self):
+        for corpus in self._subjects.values():
+            corpus.close()
+        self._subjects.clear()
@@ -0,0 +1,287 @@
+import os
+import re
+import time
+import asyncio
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+# Cache för inbäddningar av användarfrågor.
+# Nivå 1: LRU i processen med TTL och en övre gräns i bytes.
+# Nivå 2 (valfri): SQLite-fil som överlever omstarter och delas mellan gunicorn-workers.
+# SQLite anropas aldrig på event-loopen: läsningar körs i trådpoolen och skrivningar
+# samlas och skrivs i bakgrunden i en transaktion per omgång. Utgångna rader tas bort
+# (DELETE ... WHERE created_at < ?) vid start och därefter högst en gång per sweep-intervall.
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600.0
+DEFAULT_SWEEP_INTERVAL_SECONDS = 3600.0
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_EDGE_PUNCT = " \t\n\"'.,!?;:()[]{}"
+
+# Ungefärlig fast kostnad per post (nyckel, tupel, OrderedDict-nod)
+_ENTRY_OVERHEAD_BYTES = 128
+
+
+def normalize_query(query: str) -> str:
+    """Normaliserar en fråga så att 'Fotosyntes ' och 'fotosyntes?' ger samma nyckel."""
+    text = unicodedata.normalize("NFC", query).lower()
+    text = _WHITESPACE_RE.sub(" ", text)
+    return text.strip(_EDGE_PUNCT)
+
+
+class EmbeddingCache:
+    """LRU-cache med TTL och bytebudget för float32-vektorer, med valfri SQLite-nivå."""
+
+    def __init__(
+        self,
+        model: str,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        persistent_path: Optional[str] = None,
+        sweep_interval_seconds: float = DEFAULT_SWEEP_INTERVAL_SECONDS,
+    ):
+        self.model = model
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.persistent_path = persistent_path
+        self.sweep_interval_seconds = sweep_interval_seconds
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_pid: Optional[int] = None
+        # Anslutningen används från trådpoolen, en tråd i taget
+        self._db_lock = threading.Lock()
+        self._last_sweep = 0.0
+
+        # Skrivningar som väntar på bakgrundsskrivaren (nyckel -> vektor)
+        self._pending: Dict[str, array] = {}
+        self._writer: Optional[asyncio.Task] = None
+
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.persistent_writes = 0
+        self.swept = 0
+
+    @classmethod
+    def from_env(cls, model: str) -> "EmbeddingCache":
+        """Skapar cachen från miljövariabler (EMBEDDING_CACHE_MAX_BYTES, _TTL, _PATH)."""
+        return cls(
+            model=model,
+            max_bytes=int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+            ttl_seconds=float(os.getenv("EMBEDDING_CACHE_TTL", DEFAULT_TTL_SECONDS)),
+            # t.ex. /tmp/kriterium_embeddings.sqlite3 för att dela mellan workers
+            persistent_path=os.getenv("EMBEDDING_CACHE_PATH") or None,
+            sweep_interval_seconds=float(os.getenv("EMBEDDING_CACHE_SWEEP_INTERVAL", DEFAULT_SWEEP_INTERVAL_SECONDS)),
+        )
+
+    # --- Nycklar ---
+
+    def _key(self, query: str) -> str:
+        return f"{self.model}:{normalize_query(query)}"
+
+    # --- Nivå 1: minne ---
+
+    def _memory_get(self, key: str) -> Optional[array]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, vector, size = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self._bytes -= size
+            return None
+        self._entries.move_to_end(key)
+        return vector
+
+    def _memory_put(self, key: str, vector: array, ttl_seconds: float):
+        size = len(key) + vector.itemsize * len(vector) + _ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[2]
+        self._entries[key] = (time.monotonic() + ttl_seconds, vector, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    # --- Nivå 2: SQLite (körs i trådpoolen) ---
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        if not self.persistent_path:
+            return None
+        # En anslutning per process (gunicorn forkar workers efter import)
+        if self._db is None or self._db_pid != os.getpid():
+            db = sqlite3.connect(self.persistent_path, timeout=5.0, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                " key TEXT PRIMARY KEY,"
+                " vector BLOB NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            db.commit()
+            self._db = db
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _persistent_get(self, key: str) -> Optional[tuple]:
+        try:
+            with self._db_lock:
+                db = self._connection()
+                if db is None:
+                    return None
+                row = db.execute(
+                    "SELECT vector, created_at FROM query_embeddings WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"VARNING: Inbäddningscachen (SQLite) kunde inte läsas: {e}")
+            return None
+        if row is None:
+            return None
+        blob, created_at = row
+        remaining = created_at + self.ttl_seconds - time.time()
+        if remaining <= 0:
+            return None
+        vector = array("f")
+        vector.frombytes(blob)
+        return vector, remaining
+
+    def _persistent_write(self, items: List[Tuple[str, array]]):
+        """Skriver en omgång i en transaktion och rensar utgångna rader när det är dags."""
+        now = time.time()
+        try:
+            with self._db_lock:
+                db = self._connection()
+                if db is None:
+                    return
+                with db:
+                    db.executemany(
+                        "INSERT OR REPLACE INTO query_embeddings (key, vector, created_at) VALUES (?, ?, ?)",
+                        [(key, vector.tobytes(), now) for key, vector in items],
+                    )
+                self.persistent_writes += len(items)
+                if now - self._last_sweep >= self.sweep_interval_seconds:
+                    self._sweep(db, now)
+        except sqlite3.Error as e:
+            print(f"VARNING: Inbäddningscachen (SQLite) kunde inte skrivas: {e}")
+
+    def _sweep(self, db: sqlite3.Connection, now: float):
+        with db:
+            deleted = db.execute(
+                "DELETE FROM query_embeddings WHERE created_at < ?", (now - self.ttl_seconds,)
+            ).rowcount
+        self._last_sweep = now
+        self.swept += deleted
+
+    def _persistent_sweep(self):
+        try:
+            with self._db_lock:
+                db = self._connection()
+                if db is not None:
+                    self._sweep(db, time.time())
+        except sqlite3.Error as e:
+            print(f"VARNING: Inbäddningscachen (SQLite) kunde inte rensas: {e}")
+
+    async def _write_pending(self):
+        while True:
+            with self._lock:
+                items = list(self._pending.items())
+                self._pending.clear()
+            if not items:
+                # Ingen await mellan kontrollen och återställningen, så put() ser alltid en aktiv skrivare
+                self._writer = None
+                return
+            await asyncio.to_thread(self._persistent_write, items)
+
+    # --- Publikt API ---
+
+    async def get(self, query: str, count: bool = True) -> Optional[List[float]]:
+        """Returnerar den cachade inbäddningen för frågan, eller None vid miss.
+
+        count=False används för uppslag som inte ska synas i träff/miss-räknarna.
+        """
+        key = self._key(query)
+        with self._lock:
+            vector = self._memory_get(key)
+            if vector is not None:
+                self.memory_hits += count
+                return vector.tolist()
+
+        stored = await asyncio.to_thread(self._persistent_get, key) if self.persistent_path else None
+        with self._lock:
+            if stored is not None:
+                vector, remaining = stored
+                self._memory_put(key, vector, remaining)
+                self.persistent_hits += count
+                return vector.tolist()
+            self.misses += count
+            return None
+
+    def put(self, query: str, embedding: List[float]):
+        """Sparar inbäddningen i minnet direkt; SQLite-nivån skrivs av bakgrundsskrivaren."""
+        key = self._key(query)
+        vector = array("f", embedding)
+        with self._lock:
+            self._memory_put(key, vector, self.ttl_seconds)
+            if not self.persistent_path:
+                return
+            self._pending[key] = vector
+        if self._writer is None:
+            try:
+                self._writer = asyncio.get_running_loop().create_task(self._write_pending())
+            except RuntimeError:
+                # Ingen event-loop (t.ex. ett skript): skriv direkt
+                self._persistent_write(list(self._pending.items()))
+                self._pending.clear()
+
+    async def start(self):
+        """Rensar utgångna rader i SQLite-nivån (anropas från lifespan)."""
+        if self.persistent_path:
+            await asyncio.to_thread(self._persistent_sweep)
+
+    async def close(self):
+        """Väntar in väntande skrivningar och stänger SQLite-anslutningen."""
+        if self._writer is not None:
+            await self._writer
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def clear(self):
+        """Tömmer minnesnivån (den beständiga nivån lämnas orörd)."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.persistent_hits + self.misses
+        hits = self.memory_hits + self.persistent_hits
+        return {
+            "memory_hits": self.memory_hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "persistent": bool(self.persistent_path),
+            "persistent_writes": self.persistent_writes,
+            "pending_writes": len(self._pending),
+            "swept": self.swept,
+        }
@@ -0,0 +1,415 @@
+import os
+import json
+import time
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from backend.utils import http_client
+from backend.utils.metrics import LatencyRecorder
+from backend.utils.rate_limiter import QuotaScheduler, estimate_tokens
+from backend.utils.resilience import CircuitBreaker, RetryPolicy, call_with_resilience
+
+# Utbytbara inbäddningsmotorer (EMBEDDING_BACKEND=gemini|local).
+#
+# gemini: text-embedding-004 via embedContent/batchEmbedContents (standard).
+# local:  en ONNX-exporterad, int8-kvantiserad modell (t.ex. intfloat/multilingual-e5-base)
+#         som körs på CPU i en separat processpool. Samtidiga frågor samlas några
+#         millisekunder och kodas som en batch. onnxruntime och modellen laddas först
+#         i poolprocessen vid första anropet, så API-workern förblir liten.
+#
+# Frågor och chunks måste inbäddas med samma motor: byt motor och kör sedan
+# python -m backend.ingest --reembed så att chunks-tabellen får nya vektorer.
+# Modellkatalogen skapas med: python -m backend.utils.embeddings export --out <katalog>
+# (kräver pip install -r backend/requirements-export.txt)
+
+DEFAULT_GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+GEMINI_MODEL = "models/text-embedding-004"
+GEMINI_BATCH_EMBED_LIMIT = 100
+
+DEFAULT_LOCAL_MODEL = "intfloat/multilingual-e5-base"
+MODEL_INFO_FILE = "embedding.json"
+ONNX_FILE = "model_int8.onnx"
+MAX_SEQUENCE_LENGTH = 512
+
+DEFAULT_BATCH_WINDOW_MS = 5.0
+DEFAULT_MAX_BATCH = 32
+
+EMBED_RETRY = RetryPolicy(max_attempts=3, base_delay=0.25, max_delay=4.0)
+
+
+class EmbeddingProvider:
+    """Basklass: embed() tar texter och returnerar normaliserade vektorer i samma ordning."""
+
+    name = "base"
+
+    def __init__(self, model: str, dimension: int):
+        self.model = model
+        self.dimension = dimension
+        self.texts = 0
+        self.latency = LatencyRecorder()
+
+    @property
+    def configured(self) -> bool:
+        return True
+
+    async def _embed(self, texts: List[str], kind: str) -> List[List[float]]:
+        raise NotImplementedError
+
+    async def embed(self, texts: List[str], kind: str = "query") -> List[List[float]]:
+        """kind: "query" (sökfrågor) eller "document" (chunks vid indexering)."""
+        if not texts:
+            return []
+        started = time.perf_counter()
+        try:
+            return await self._embed(texts, kind)
+        finally:
+            self.texts += len(texts)
+            self.latency.record((time.perf_counter() - started) * 1000)
+
+    async def warm(self):
+        """Förbereder motorn i förväg (t.ex. laddar modellen), så att första frågan inte betalar för det."""
+
+    async def close(self):
+        """Frigör resurser (processpool m.m.). Anropas från lifespan."""
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "model": self.model,
+            "texts": self.texts,
+            "latency": self.latency.snapshot(),
+        }
+
+
+class GeminiEmbeddingProvider(EmbeddingProvider):
+    """text-embedding-004 via Gemini, med kvotschemaläggare och resiliens-lager."""
+
+    name = "gemini"
+
+    def __init__(self, api_key: Optional[str], scheduler, breaker, policy, api_base: str = DEFAULT_GEMINI_API_BASE):
+        super().__init__(GEMINI_MODEL, 768)
+        self.api_key = api_key
+        self.embed_url = f"{api_base}/{GEMINI_MODEL}:embedContent"
+        self.batch_embed_url = f"{api_base}/{GEMINI_MODEL}:batchEmbedContents"
+        self.scheduler = scheduler
+        self.breaker = breaker
+        self.policy = policy
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    async def _embed_one(self, text: str) -> List[float]:
+        payload = {"model": self.model, "content": {"parts": [{"text": text}]}}
+
+        async def _call():
+            async with self.scheduler.slot(tokens=estimate_tokens(text)):
+                response = await http_client.post(
+                    f"{self.embed_url}?key={self.api_key}",
+                    json=payload,
+                    timeout=http_client.EMBED_TIMEOUT,
+                )
+            response.raise_for_status()
+            return response.json()['embedding']['values']
+
+        return await call_with_resilience(_call, breaker=self.breaker, policy=self.policy, name="embedContent")
+
+    async def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        payload = {
+            "requests": [
+                {"model": self.model, "content": {"parts": [{"text": text}]}}
+                for text in batch
+            ]
+        }
+
+        async def _call():
+            async with self.scheduler.slot(tokens=sum(estimate_tokens(t) for t in batch)):
+                response = await http_client.post(
+                    f"{self.batch_embed_url}?key={self.api_key}",
+                    json=payload,
+                    timeout=http_client.EMBED_TIMEOUT,
+                )
+            response.raise_for_status()
+            return response.json()['embeddings']
+
+        items = await call_with_resilience(_call, breaker=self.breaker, policy=self.policy, name="batchEmbedContents")
+        return [item['values'] for item in items]
+
+    async def _embed(self, texts: List[str], kind: str) -> List[List[float]]:
+        if len(texts) == 1:
+            return [await self._embed_one(texts[0])]
+        embeddings: List[List[float]] = []
+        for start in range(0, len(texts), GEMINI_BATCH_EMBED_LIMIT):
+            embeddings.extend(await self._embed_batch(texts[start:start + GEMINI_BATCH_EMBED_LIMIT]))
+        return embeddings
+
+
+# --- Lokal motor: körs i poolprocessen ---
+
+_session = None
+_tokenizer = None
+_input_names: Tuple[str, ...] = ()
+
+
+def _load_model(model_dir: str, threads: int):
+    """Laddar ONNX-sessionen och tokenizern en gång per poolprocess."""
+    global _session, _tokenizer, _input_names
+    if _session is not None:
+        return
+    try:
+        import onnxruntime
+        from tokenizers import Tokenizer
+    except ImportError as e:
+        raise RuntimeError(f"EMBEDDING_BACKEND=local kräver paketen onnxruntime och tokenizers: {e}")
+
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    _session = onnxruntime.InferenceSession(
+        str(Path(model_dir) / ONNX_FILE), options, providers=["CPUExecutionProvider"]
+    )
+    _input_names = tuple(i.name for i in _session.get_inputs())
+
+    tokenizer = Tokenizer.from_file(str(Path(model_dir) / "tokenizer.json"))
+    tokenizer.enable_truncation(MAX_SEQUENCE_LENGTH)
+    tokenizer.enable_padding()
+    _tokenizer = tokenizer
+
+
+def _onnx_encode(model_dir: str, threads: int, texts: List[str]) -> np.ndarray:
+    """Tokeniserar, kör modellen och medelvärdespoolar över tokens (e5). Returnerar L2-normaliserade rader."""
+    _load_model(model_dir, threads)
+    encodings = _tokenizer.encode_batch(texts)
+    input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+    attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+    feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+    if "token_type_ids" in _input_names:
+        feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+    hidden = _session.run(None, feeds)[0]
+    mask = attention_mask[..., None].astype(np.float32)
+    pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+    pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+    return pooled.astype(np.float32)
+
+
+class MicroBatcher:
+    """Samlar texter i upp till window_ms (eller max_batch st) och kodar dem i ett anrop."""
+
+    def __init__(self, encode: Callable[[List[str]], "asyncio.Future"], window_ms: float, max_batch: int):
+        self.encode = encode
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._full: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+        self.batches = 0
+        self.batched_texts = 0
+
+    async def submit(self, text: str) -> List[float]:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((text, future))
+        if self._flusher is None or self._flusher.done():
+            self._full = asyncio.Event()
+            self._flusher = asyncio.create_task(self._flush_after_window())
+        elif len(self._pending) >= self.max_batch:
+            self._full.set()
+        return await future
+
+    async def _flush_after_window(self):
+        try:
+            await asyncio.wait_for(self._full.wait(), timeout=self.window)
+        except asyncio.TimeoutError:
+            pass
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            batch = [(text, future) for text, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+            self.batches += 1
+            self.batched_texts += len(batch)
+            try:
+                vectors = await self.encode([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "avg_batch_size": self.batched_texts / self.batches if self.batches else 0.0,
+        }
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """ONNX/int8-modell på CPU i en egen processpool, med mikrobatchning av frågor."""
+
+    name = "local"
+
+    def __init__(
+        self,
+        model_dir: str,
+        processes: int = 1,
+        threads: int = 2,
+        window_ms: float = DEFAULT_BATCH_WINDOW_MS,
+        max_batch: int = DEFAULT_MAX_BATCH,
+    ):
+        info_path = Path(model_dir) / MODEL_INFO_FILE
+        info = json.loads(info_path.read_text(encoding="utf-8")) if info_path.exists() else {}
+        super().__init__(info.get("model", DEFAULT_LOCAL_MODEL), int(info.get("dimension", 768)))
+        self.model_dir = str(model_dir)
+        self.processes = processes
+        self.threads = threads
+        self.max_batch = max_batch
+        # e5-modellerna förväntar sig prefix som skiljer frågor från dokument
+        self.prefixes = {
+            "query": info.get("query_prefix", "query: "),
+            "document": info.get("document_prefix", "passage: "),
+        }
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.batcher = MicroBatcher(self._encode, window_ms, max_batch)
+
+    @classmethod
+    def from_env(cls) -> "LocalEmbeddingProvider":
+        model_dir = os.getenv("LOCAL_EMBEDDING_DIR")
+        if not model_dir:
+            raise ValueError("EMBEDDING_BACKEND=local kräver att LOCAL_EMBEDDING_DIR är satt.")
+        return cls(
+            model_dir,
+            processes=int(os.getenv("LOCAL_EMBEDDING_PROCESSES", "1")),
+            threads=int(os.getenv("LOCAL_EMBEDDING_THREADS", "2")),
+            window_ms=float(os.getenv("LOCAL_EMBEDDING_BATCH_WINDOW_MS", str(DEFAULT_BATCH_WINDOW_MS))),
+            max_batch=int(os.getenv("LOCAL_EMBEDDING_MAX_BATCH", str(DEFAULT_MAX_BATCH))),
+        )
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: poolprocessen ärver inte API-workerns minne eller event-loop
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.processes, mp_context=multiprocessing.get_context("spawn")
+            )
+            print(f"--- Lokal inbäddning: processpool startad ({self.processes} st, modell {self.model}) ---")
+        return self._pool
+
+    async def _encode(self, texts: List[str]) -> List[List[float]]:
+        loop = asyncio.get_running_loop()
+        vectors = await loop.run_in_executor(self._get_pool(), _onnx_encode, self.model_dir, self.threads, texts)
+        return vectors.tolist()
+
+    async def _embed(self, texts: List[str], kind: str) -> List[List[float]]:
+        prefix = self.prefixes.get(kind, "")
+        texts = [prefix + text for text in texts]
+        if kind == "query":
+            return list(await asyncio.gather(*(self.batcher.submit(text) for text in texts)))
+        # Dokument (indexering) kommer redan i stora mängder: inget väntefönster
+        embeddings: List[List[float]] = []
+        for start in range(0, len(texts), self.max_batch):
+            embeddings.extend(await self._encode(texts[start:start + self.max_batch]))
+        return embeddings
+
+    async def warm(self):
+        # Startar poolprocessen och laddar modellen där (_load_model cachas per process)
+        await self._encode([self.prefixes["query"] + "uppvärmning"])
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update(self.batcher.stats())
+        stats["pool_started"] = self._pool is not None
+        return stats
+
+
+def create_embedding_provider(
+    api_key: Optional[str], scheduler, breaker, policy, api_base: str = DEFAULT_GEMINI_API_BASE
+) -> EmbeddingProvider:
+    """Väljer motor via EMBEDDING_BACKEND (gemini|local)."""
+    backend = os.getenv("EMBEDDING_BACKEND", "gemini").lower()
+    if backend == "local":
+        return LocalEmbeddingProvider.from_env()
+    return GeminiEmbeddingProvider(api_key, scheduler, breaker, policy, api_base)
+
+
+def create_embed_scheduler() -> QuotaScheduler:
+    """Kvoter för Gemini-inbäddning (GEMINI_EMBED_RPM / _TPM / _CONCURRENCY)."""
+    return QuotaScheduler.from_env("gemini-embed", "GEMINI_EMBED", rpm=1500, tpm=1_000_000, concurrency=16)
+
+
+def create_embedder() -> EmbeddingProvider:
+    """Fristående motor med egen kvot och circuit breaker, för skript som inte ska importera backend.main."""
+    api_base = os.getenv("GEMINI_API_BASE", DEFAULT_GEMINI_API_BASE).rstrip("/")
+    return create_embedding_provider(
+        os.getenv("GEMINI_API_KEY"),
+        create_embed_scheduler(),
+        CircuitBreaker("gemini-embed"),
+        EMBED_RETRY,
+        api_base,
+    )
+
+
+def export_onnx(model_name: str, out_dir: str):
+    """Exporterar en Hugging Face-modell till ONNX och kvantiserar vikterna till int8.
+
+    Kräver torch, transformers och onnxruntime (backend/requirements-export.txt,
+    bara där exporten körs).
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+
+    sample = tokenizer(["query: exempel"], return_tensors="pt")
+    names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    float_path = out / "model_fp32.onnx"
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in names),
+            str(float_path),
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={name: {0: "batch", 1: "sequence"} for name in names + ["last_hidden_state"]},
+            opset_version=17,
+        )
+    quantize_dynamic(str(float_path), str(out / ONNX_FILE), weight_type=QuantType.QInt8)
+    float_path.unlink()
+
+    tokenizer.save_pretrained(str(out))
+    (out / MODEL_INFO_FILE).write_text(json.dumps({
+        "model": model_name,
+        "dimension": model.config.hidden_size,
+        "query_prefix": "query: ",
+        "document_prefix": "passage: ",
+    }, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Exporterade {model_name} till {out / ONNX_FILE}")
+
+
+if __name__ == "__main__":
+    # Användning: python -m backend.utils.embeddings export --out models/e5-base-int8
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Verktyg för den lokala inbäddningsmotorn.")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("--model", default=DEFAULT_LOCAL_MODEL)
+    parser.add_argument("--out", required=True)
+    args = parser.parse_args()
+    export_onnx(args.model, args.out)
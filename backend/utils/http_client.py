@@ -0,0 +1,119 @@
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import httpx
+
+# Delad HTTP-klient för alla utgående anrop (Gemini m.fl.).
+# En enda klient per process återanvänder TLS-sessioner och anslutningar
+# i stället för att göra en ny handskakning för varje inbäddning/generering.
+
+# Gränser för anslutningspoolen (per gunicorn-worker)
+MAX_CONNECTIONS = 50
+MAX_KEEPALIVE_CONNECTIONS = 20
+KEEPALIVE_EXPIRY = 30.0
+
+# Timeouts per slutpunkt. Inbäddning är snabb, generering kan ta längre tid.
+EMBED_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+GENERATE_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+DEFAULT_TIMEOUT = httpx.Timeout(15.0, connect=5.0)
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+class PoolStats:
+    """Enkel mätare för hur mycket av anslutningspoolen som används."""
+
+    def __init__(self, max_connections: int):
+        self.max_connections = max_connections
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_requests = 0
+
+    def acquire(self):
+        self.in_flight += 1
+        self.total_requests += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def release(self):
+        self.in_flight -= 1
+
+    def snapshot(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "total_requests": self.total_requests,
+            "max_connections": self.max_connections,
+            "pool_usage": self.in_flight / self.max_connections,
+        }
+
+
+pool_stats = PoolStats(MAX_CONNECTIONS)
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Skapar den delade klienten med HTTP/2 och keep-alive-gränser."""
+    limits = httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+    try:
+        import h2  # noqa: F401
+        http2 = True
+    except ImportError:
+        print("VARNING: Paketet 'h2' saknas, faller tillbaka till HTTP/1.1.")
+        http2 = False
+
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=limits,
+        timeout=DEFAULT_TIMEOUT,
+    )
+
+
+async def start_http_client() -> httpx.AsyncClient:
+    """Startar den delade klienten (anropas från FastAPI lifespan)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_http_client()
+        print("--- Delad HTTP-klient initierad. ---")
+    return _client
+
+
+async def close_http_client():
+    """Stänger den delade klienten och alla poolade anslutningar."""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+        print("--- Delad HTTP-klient stängd. ---")
+    _client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Returnerar den delade klienten. Skapas vid behov om lifespan inte har körts (t.ex. i skript)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_http_client()
+    return _client
+
+
+async def post(url: str, *, timeout: httpx.Timeout = DEFAULT_TIMEOUT, **kwargs) -> httpx.Response:
+    """POST via den delade klienten och uppdaterar poolmätaren."""
+    client = get_http_client()
+    pool_stats.acquire()
+    try:
+        return await client.post(url, timeout=timeout, **kwargs)
+    finally:
+        pool_stats.release()
+
+
+@asynccontextmanager
+async def stream(method: str, url: str, *, timeout: httpx.Timeout = DEFAULT_TIMEOUT, **kwargs) -> AsyncIterator[httpx.Response]:
+    """Strömmande anrop via den delade klienten (t.ex. streamGenerateContent)."""
+    client = get_http_client()
+    pool_stats.acquire()
+    try:
+        async with client.stream(method, url, timeout=timeout, **kwargs) as response:
+            yield response
+    finally:
+        pool_stats.release()
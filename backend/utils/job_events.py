@@ -0,0 +1,52 @@
+import asyncio
+from contextlib import contextmanager
+from typing import Dict, Iterator, Set
+
+# Pub/sub i processen för jobbstatus. process_activity_job publicerar
+# statusövergångar och SSE-slutpunkten prenumererar per job_id.
+# Händelser för jobb som körs i en annan process syns inte här; där faller
+# SSE-slutpunkten tillbaka på en lätt statusfråga mot databasen.
+
+TERMINAL_STATUSES = ("COMPLETED", "FAILED")
+
+# Max antal oskickade händelser per prenumerant (ett jobb har bara ett fåtal)
+_QUEUE_SIZE = 64
+
+
+class JobEventBus:
+    """Enkel fan-out av händelser per job_id till asyncio-köer."""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self.published = 0
+        self.dropped = 0
+
+    @contextmanager
+    def subscribe(self, job_id: str) -> Iterator[asyncio.Queue]:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=_QUEUE_SIZE)
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            subscribers = self._subscribers.get(job_id)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[job_id]
+
+    def publish(self, job_id: str, event: dict):
+        """Skickar händelsen till alla som lyssnar på jobbet (icke-blockerande)."""
+        self.published += 1
+        for queue in self._subscribers.get(job_id, ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.dropped += 1
+
+    def stats(self) -> dict:
+        return {
+            "subscribed_jobs": len(self._subscribers),
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "published": self.published,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,235 @@
+import json
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from postgrest.types import ReturnMethod
+
+from backend.learning_models import ActivityRequest
+
+# Hållbar jobbkö för activity_jobs.
+# Workers "hyr" PENDING-jobb med en lease (synlighetstimeout). Om en worker dör
+# går leasen ut och jobbet läggs tillbaka som PENDING (eller FAILED efter för många försök).
+
+DEFAULT_LEASE_SECONDS = 120
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+@dataclass
+class ClaimedJob:
+    job_id: str
+    request: ActivityRequest
+    attempts: int
+
+
+def _parse_request(request_data) -> ActivityRequest:
+    if isinstance(request_data, str):
+        return ActivityRequest.model_validate_json(request_data)
+    return ActivityRequest.model_validate(request_data)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class JobQueue:
+    """Gränssnitt för köer som workern kan hämta jobb från."""
+
+    def __init__(self, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        self.max_attempts = max_attempts
+
+    async def claim(self, worker_id: str, limit: int, lease_seconds: int) -> List[ClaimedJob]:
+        raise NotImplementedError
+
+    async def extend_lease(self, job_id: str, worker_id: str, lease_seconds: int) -> bool:
+        raise NotImplementedError
+
+    async def complete(self, job_ids: List[str], result: dict, worker_id: str) -> List[str]:
+        """Markerar jobben som klara om worker_id fortfarande äger dem. Returnerar de jobb som skrevs."""
+        raise NotImplementedError
+
+    async def fail(self, job_ids: List[str], error: str, worker_id: str) -> List[str]:
+        raise NotImplementedError
+
+    async def save_partial(self, job_ids: List[str], partial: dict, worker_id: str):
+        """Sparar ett delresultat (strömmad generering) medan worker_id fortfarande äger jobben."""
+        raise NotImplementedError
+
+    async def recover_expired(self) -> int:
+        """Återställer jobb vars lease har gått ut. Returnerar antalet påverkade jobb."""
+        raise NotImplementedError
+
+
+class SupabaseJobQueue(JobQueue):
+    """Kö direkt på activity_jobs-tabellen (kräver backend/sql/activity_jobs_queue.sql).
+
+    Anropen går via det asynkrona dataåtkomstlagret (SupabaseRepository).
+    """
+
+    def __init__(self, db, max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        super().__init__(max_attempts)
+        self.db = db
+
+    async def claim(self, worker_id: str, limit: int, lease_seconds: int) -> List[ClaimedJob]:
+        rows = await self.db.execute("claim_jobs", lambda c: c.rpc('claim_activity_jobs', {
+            'p_worker_id': worker_id,
+            'p_limit': limit,
+            'p_lease_seconds': lease_seconds,
+        })) or []
+        return [ClaimedJob(row['job_id'], _parse_request(row['request_data']), row['attempts']) for row in rows]
+
+    async def extend_lease(self, job_id: str, worker_id: str, lease_seconds: int) -> bool:
+        rows = await self.db.execute("extend_lease", lambda c: c.table('activity_jobs').update({
+            'lease_expires_at': (_now() + timedelta(seconds=lease_seconds)).isoformat()
+        }).eq('job_id', job_id).eq('status', 'RUNNING').eq('claimed_by', worker_id))
+        return bool(rows)
+
+    async def _finish(self, operation: str, job_ids: List[str], worker_id: str, values: dict) -> List[str]:
+        # Bara jobb som workern fortfarande har leasen för: en övertagen lease ger ingen skrivning
+        rows = await self.db.execute(operation, lambda c: c.table('activity_jobs').update({
+            **values,
+            'lease_expires_at': None,
+            'completed_at': _now().isoformat()
+        }).in_('job_id', job_ids).eq('status', 'RUNNING').eq('claimed_by', worker_id))
+        return [row['job_id'] for row in rows or []]
+
+    async def complete(self, job_ids: List[str], result: dict, worker_id: str) -> List[str]:
+        return await self._finish("complete_jobs", job_ids, worker_id, {'status': 'COMPLETED', 'result_data': result})
+
+    async def fail(self, job_ids: List[str], error: str, worker_id: str) -> List[str]:
+        return await self._finish("fail_jobs", job_ids, worker_id, {'status': 'FAILED', 'error_message': error})
+
+    async def save_partial(self, job_ids: List[str], partial: dict, worker_id: str):
+        await self.db.execute("save_partial", lambda c: c.table('activity_jobs').update({
+            'result_data': partial
+        }, returning=ReturnMethod.minimal).in_('job_id', job_ids).eq('status', 'RUNNING').eq('claimed_by', worker_id))
+
+    async def recover_expired(self) -> int:
+        now = _now().isoformat()
+        exhausted = await self.db.execute("recover_expired", lambda c: c.table('activity_jobs').update({
+            'status': 'FAILED',
+            'error_message': f"Jobbet avbröts {self.max_attempts} gånger (worker slutade svara).",
+            'lease_expires_at': None,
+            'completed_at': now
+        }).eq('status', 'RUNNING').lt('lease_expires_at', now).gte('attempts', self.max_attempts).select('job_id'))
+        requeued = await self.db.execute("recover_expired", lambda c: c.table('activity_jobs').update({
+            'status': 'PENDING',
+            'claimed_by': None,
+            'lease_expires_at': None,
+            'result_data': None
+        }).eq('status', 'RUNNING').lt('lease_expires_at', now).select('job_id'))
+        return len(exhausted or []) + len(requeued or [])
+
+
+class SQLiteJobQueue(JobQueue):
+    """Lokal ersättare för tester och utveckling (":memory:" ger en kö i minnet)."""
+
+    def __init__(self, path: str = ":memory:", max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        super().__init__(max_attempts)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS activity_jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " request_data TEXT NOT NULL,"
+            " result_data TEXT,"
+            " error_message TEXT,"
+            " claimed_by TEXT,"
+            " lease_expires_at REAL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " completed_at REAL)"
+        )
+
+    def enqueue(self, job_id: str, request: ActivityRequest):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO activity_jobs (job_id, status, request_data, created_at) VALUES (?, 'PENDING', ?, ?)",
+                (job_id, request.model_dump_json(), _now().timestamp()),
+            )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM activity_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        if job["result_data"] is not None:
+            job["result_data"] = json.loads(job["result_data"])
+        return job
+
+    async def claim(self, worker_id: str, limit: int, lease_seconds: int) -> List[ClaimedJob]:
+        now = _now().timestamp()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute(
+                    "SELECT job_id, request_data, attempts FROM activity_jobs"
+                    " WHERE status = 'PENDING' ORDER BY created_at LIMIT ?",
+                    (limit,),
+                ).fetchall()
+                for row in rows:
+                    self._db.execute(
+                        "UPDATE activity_jobs SET status = 'RUNNING', claimed_by = ?,"
+                        " lease_expires_at = ?, attempts = attempts + 1 WHERE job_id = ?",
+                        (worker_id, now + lease_seconds, row["job_id"]),
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return [ClaimedJob(row["job_id"], _parse_request(row["request_data"]), row["attempts"] + 1) for row in rows]
+
+    async def extend_lease(self, job_id: str, worker_id: str, lease_seconds: int) -> bool:
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE activity_jobs SET lease_expires_at = ?"
+                " WHERE job_id = ? AND status = 'RUNNING' AND claimed_by = ?",
+                (_now().timestamp() + lease_seconds, job_id, worker_id),
+            )
+        return cursor.rowcount > 0
+
+    def _finish(self, job_ids: List[str], worker_id: str, status: str, result: Optional[dict], error: Optional[str]) -> List[str]:
+        placeholders = ",".join("?" for _ in job_ids)
+        with self._lock:
+            rows = self._db.execute(
+                f"UPDATE activity_jobs SET status = ?, result_data = ?, error_message = ?,"
+                f" lease_expires_at = NULL, completed_at = ?"
+                f" WHERE job_id IN ({placeholders}) AND status = 'RUNNING' AND claimed_by = ? RETURNING job_id",
+                (status, json.dumps(result) if result is not None else None, error, _now().timestamp(), *job_ids, worker_id),
+            ).fetchall()
+        return [row["job_id"] for row in rows]
+
+    async def complete(self, job_ids: List[str], result: dict, worker_id: str) -> List[str]:
+        return self._finish(job_ids, worker_id, "COMPLETED", result, None)
+
+    async def fail(self, job_ids: List[str], error: str, worker_id: str) -> List[str]:
+        return self._finish(job_ids, worker_id, "FAILED", None, error)
+
+    async def save_partial(self, job_ids: List[str], partial: dict, worker_id: str):
+        placeholders = ",".join("?" for _ in job_ids)
+        with self._lock:
+            self._db.execute(
+                f"UPDATE activity_jobs SET result_data = ?"
+                f" WHERE status = 'RUNNING' AND claimed_by = ? AND job_id IN ({placeholders})",
+                (json.dumps(partial), worker_id, *job_ids),
+            )
+
+    async def recover_expired(self) -> int:
+        now = _now().timestamp()
+        with self._lock:
+            exhausted = self._db.execute(
+                "UPDATE activity_jobs SET status = 'FAILED', error_message = ?, lease_expires_at = NULL,"
+                " completed_at = ? WHERE status = 'RUNNING' AND lease_expires_at < ? AND attempts >= ?",
+                (f"Jobbet avbröts {self.max_attempts} gånger (worker slutade svara).", now, now, self.max_attempts),
+            ).rowcount
+            requeued = self._db.execute(
+                "UPDATE activity_jobs SET status = 'PENDING', claimed_by = NULL, lease_expires_at = NULL, result_data = NULL"
+                " WHERE status = 'RUNNING' AND lease_expires_at < ?",
+                (now,),
+            ).rowcount
+        return exhausted + requeued
@@ -0,0 +1,161 @@
+import re
+import math
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# BM25-index i processen över chunkarnas text och rubriker.
+# Används av HybridRetriever (retrievers.py): frågor som nämner en rubrik ur
+# kursplanen ("Imperialism och världskrig") eller ett tydligt sökord besvaras
+# direkt härifrån, utan nätverksanrop till match_chunks.
+
+_TOKEN = re.compile(r"\w+")
+
+# Vanliga svenska småord samt ord som bara beskriver beställningen ("ge mig 3 flashcards")
+STOPWORDS = frozenset("""
+och i att det som en på är av för med till den har de inte om ett han hon men var
+jag vi ni du kan så eller när där hur vad vilka vilken vilket ska skall också även
+från ut upp över under efter mot sig sin sina dess deras detta dessa denna man
+mig dig ge gör göra skapa skriv förklara handlar handla om lite mer några
+quiz quizfrågor quizfråga frågor fråga flashcards flashcard kort begrepp årskurs åk
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Gemener, NFC och ordtecken; stoppord och siffror tas bort."""
+    text = unicodedata.normalize("NFC", text).lower()
+    return [t for t in _TOKEN.findall(text) if t not in STOPWORDS and not t.isdigit()]
+
+
+def heading_phrase(pattern: str) -> str:
+    """Rubrikens kärna ur en rubrik-regex i ALL_CONFIGS: text före första komma/kolon, utan regex-tecken."""
+    text = pattern.lstrip("^").replace("\\", "")
+    return re.split(r"[,:]", text, maxsplit=1)[0].strip().lower()
+
+
+class BM25Index:
+    """Okapi BM25 där rubriktermer räknas `heading_boost` gånger."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, heading_boost: int = 3):
+        self.k1 = k1
+        self.b = b
+        self.heading_boost = heading_boost
+
+        self.keys: List[tuple] = []
+        self.metadata: List[dict] = []
+        self._postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._doc_terms: List[frozenset] = []
+        self._lengths = np.zeros(0, dtype=np.float32)
+        self._avg_length = 0.0
+
+        # rubrikfras -> rubriker (chunkmetadata) som den pekar på
+        self._phrases: Dict[str, set] = {}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def build(self, documents: Iterable[Tuple[tuple, str, dict]], heading_patterns: Iterable[str] = ()):
+        """documents: (nyckel, text, metadata). heading_patterns: rubrik-regexar ur ALL_CONFIGS."""
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = []
+        for doc_id, (key, text, metadata) in enumerate(documents):
+            counts = Counter(tokenize(text))
+            for term in tokenize(metadata.get("heading") or ""):
+                counts[term] += self.heading_boost
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+            self.keys.append(key)
+            self.metadata.append(metadata)
+            self._doc_terms.append(frozenset(counts))
+            lengths.append(sum(counts.values()))
+
+        self._postings = {
+            term: (np.fromiter((d for d, _ in plist), dtype=np.int32, count=len(plist)),
+                   np.fromiter((tf for _, tf in plist), dtype=np.float32, count=len(plist)))
+            for term, plist in postings.items()
+        }
+        self._lengths = np.asarray(lengths, dtype=np.float32)
+        self._avg_length = float(self._lengths.mean()) if len(lengths) else 0.0
+
+        headings = {m.get("heading") for m in self.metadata if m.get("heading")}
+        for pattern in heading_patterns:
+            phrase = heading_phrase(pattern)
+            if len(phrase) < 4:
+                continue
+            matching = {h for h in headings if h.lower().startswith(phrase)}
+            if matching:
+                self._phrases.setdefault(phrase, set()).update(matching)
+
+    def _mask(self, filter: dict) -> Optional[np.ndarray]:
+        if not filter:
+            return None
+        return np.fromiter(
+            (all(m.get(k) == v for k, v in filter.items()) for m in self.metadata),
+            dtype=bool, count=len(self.metadata),
+        )
+
+    def matched_headings(self, query: str) -> set:
+        """Rubriker vars fras ordagrant förekommer i frågan."""
+        normalized = " ".join(unicodedata.normalize("NFC", query).lower().split())
+        found = set()
+        for phrase, headings in self._phrases.items():
+            if phrase in normalized:
+                found |= headings
+        return found
+
+    def scores(self, terms: List[str]) -> np.ndarray:
+        n = len(self.keys)
+        scores = np.zeros(n, dtype=np.float32)
+        if not n:
+            return scores
+        norm = self.k1 * (1 - self.b + self.b * self._lengths / max(self._avg_length, 1e-6))
+        for term in set(terms):
+            posting = self._postings.get(term)
+            if posting is None:
+                continue
+            docs, tf = posting
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + norm[docs])
+        return scores
+
+    def search(self, query: str, k: int, filter: Optional[dict] = None) -> Tuple[List[Tuple[int, float]], bool]:
+        """Returnerar ([(doc_id, poäng)], säker) där säker betyder att lexikal träff räcker.
+
+        Säker är frågan om den nämner en rubrik (träffarna begränsas då till rubriken),
+        eller om bästa chunken innehåller alla sökord och har klar marginal till nästa.
+        """
+        terms = tokenize(query)
+        scores = self.scores(terms)
+        mask = self._mask(filter or {})
+
+        headings = self.matched_headings(query)
+        confident = False
+        if headings:
+            heading_mask = np.fromiter(
+                (m.get("heading") in headings for m in self.metadata), dtype=bool, count=len(self.metadata)
+            )
+            candidate_mask = heading_mask if mask is None else heading_mask & mask
+            if candidate_mask.any():
+                mask = candidate_mask
+                # Inom rubriken: sortera på BM25, men alla rubrikens chunks är kandidater
+                scores = scores + 1.0
+                confident = True
+
+        if mask is not None:
+            scores = np.where(mask, scores, 0.0)
+        hits = int(np.count_nonzero(scores))
+        k = min(k, hits)
+        if k == 0:
+            return [], False
+
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        ranked = sorted(((int(i), float(scores[i])) for i in top if scores[i] > 0), key=lambda r: -r[1])
+
+        if not confident and len(set(terms)) >= 2:
+            best, best_score = ranked[0]
+            runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+            covers_all = set(terms) <= self._doc_terms[best]
+            confident = covers_all and best_score >= 1.5 * runner_up
+        return ranked, confident
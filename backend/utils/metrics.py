@@ -0,0 +1,38 @@
+from collections import deque
+from typing import Deque
+
+# Enkla latensmätare som visas under /metrics.
+# Varje mätare sparar de senaste mätningarna i ett begränsat fönster.
+
+DEFAULT_WINDOW = 1000
+
+
+class LatencyRecorder:
+    """Räknare + percentiler (p50/p95/p99) över de senaste mätningarna i millisekunder."""
+
+    def __init__(self, window: int = DEFAULT_WINDOW):
+        self._samples: Deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.total_ms = 0.0
+
+    def record(self, ms: float):
+        self._samples.append(ms)
+        self.count += 1
+        self.total_ms += ms
+
+    @staticmethod
+    def _percentile(ordered: list, fraction: float) -> float:
+        index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+        return ordered[index]
+
+    def snapshot(self) -> dict:
+        if not self._samples:
+            return {"count": self.count, "avg_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+        ordered = sorted(self._samples)
+        return {
+            "count": self.count,
+            "avg_ms": self.total_ms / self.count,
+            "p50_ms": self._percentile(ordered, 0.50),
+            "p95_ms": self._percentile(ordered, 0.95),
+            "p99_ms": self._percentile(ordered, 0.99),
+        }
@@ -0,0 +1,223 @@
+import os
+import time
+import asyncio
+import contextvars
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Deque, Dict, Iterator, Optional
+
+from backend.utils.metrics import LatencyRecorder
+
+# Global schemaläggare för Gemini-kvoter.
+# Varje endpoint (embedContent, generateContent) har en egen QuotaScheduler med
+# - token-bucket för anrop/minut (RPM) och tokens/minut (TPM)
+# - tak för samtidiga anrop (semafor)
+# - rättvis kö: väntande anrop turas om per nyckel (user_id eller ämne), så att
+#   en användare med många jobb inte tränger undan alla andra.
+
+DEFAULT_FAIR_KEY = "default"
+
+_fair_key: contextvars.ContextVar[str] = contextvars.ContextVar("fair_key", default=DEFAULT_FAIR_KEY)
+
+
+@contextmanager
+def fairness_key(key: Optional[str]) -> Iterator[None]:
+    """Sätter kö-nyckeln för alla anrop i den aktuella asyncio-kontexten."""
+    token = _fair_key.set(key or DEFAULT_FAIR_KEY)
+    try:
+        yield
+    finally:
+        _fair_key.reset(token)
+
+
+def estimate_tokens(text: str) -> int:
+    """Grov uppskattning (~4 tecken per token), räcker för att hålla sig under TPM."""
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """Fylls på kontinuerligt med `per_minute / 60` per sekund upp till `capacity`."""
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = float(capacity if capacity is not None else per_minute)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Sekunder tills `amount` finns i hinken (0 om den räcker redan nu)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        """Korrigerar i efterhand när den verkliga förbrukningen är känd (kan bli negativ = skuld)."""
+        self._refill()
+        self.level = min(self.capacity, self.level - delta)
+
+
+class _Waiter:
+    __slots__ = ("future", "requests", "tokens", "enqueued_at")
+
+    def __init__(self, requests: int, tokens: int):
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.requests = requests
+        self.tokens = tokens
+        self.enqueued_at = time.perf_counter()
+
+
+class Grant:
+    """Ett beviljat anrop. settle() rättar TPM-hinken med verkligt tokenantal."""
+
+    def __init__(self, scheduler: "QuotaScheduler", tokens: int):
+        self._scheduler = scheduler
+        self.tokens = tokens
+
+    def settle(self, actual_tokens: Optional[int]):
+        if actual_tokens is None or self._scheduler.tpm is None:
+            return
+        self._scheduler.tpm.adjust(actual_tokens - self.tokens)
+        self.tokens = actual_tokens
+
+
+class QuotaScheduler:
+    """RPM/TPM-hinkar + samtidighetstak med round-robin mellan kö-nycklar."""
+
+    def __init__(self, name: str, rpm: Optional[float], tpm: Optional[float], max_concurrency: int):
+        self.name = name
+        self.rpm = TokenBucket(rpm) if rpm else None
+        self.tpm = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max_concurrency
+
+        self._queues: Dict[str, Deque[_Waiter]] = {}
+        self._ring: Deque[str] = deque()
+        self._in_flight = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+        self.granted = 0
+        self.wait_time = LatencyRecorder()
+
+    @classmethod
+    def from_env(cls, name: str, prefix: str, rpm: int, tpm: int, concurrency: int) -> "QuotaScheduler":
+        """Läser t.ex. GEMINI_GENERATE_RPM / _TPM / _CONCURRENCY (0 = ingen gräns för RPM/TPM)."""
+        return cls(
+            name,
+            rpm=float(os.getenv(f"{prefix}_RPM", str(rpm))),
+            tpm=float(os.getenv(f"{prefix}_TPM", str(tpm))),
+            max_concurrency=int(os.getenv(f"{prefix}_CONCURRENCY", str(concurrency))),
+        )
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 0, requests: int = 1, key: Optional[str] = None) -> AsyncIterator[Grant]:
+        """Väntar på sin tur i kön och håller en samtidighetsplats tills blocket är klart."""
+        waiter = _Waiter(requests, tokens)
+        key = key or _fair_key.get()
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+            self._ring.append(key)
+        queue.append(waiter)
+        self._ensure_dispatcher()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            # Avbruten i kön (t.ex. jobbets deadline): släpp platsen om den hann beviljas
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release()
+            raise
+
+        self.wait_time.record((time.perf_counter() - waiter.enqueued_at) * 1000)
+        try:
+            yield Grant(self, tokens)
+        finally:
+            self._release()
+
+    def _release(self):
+        self._in_flight -= 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        else:
+            self._wakeup.set()
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        """Nästa väntande anrop i round-robin-ordning; avbrutna anrop hoppas över."""
+        while self._ring:
+            key = self._ring[0]
+            queue = self._queues[key]
+            while queue and queue[0].future.done():
+                queue.popleft()
+            if not queue:
+                self._ring.popleft()
+                del self._queues[key]
+                continue
+            return queue[0]
+        return None
+
+    async def _dispatch(self):
+        while True:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+
+            if self._in_flight >= self.max_concurrency:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            delay = 0.0
+            if self.rpm is not None:
+                delay = max(delay, self.rpm.wait_time(waiter.requests))
+            if self.tpm is not None:
+                delay = max(delay, self.tpm.wait_time(waiter.tokens))
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue  # kön kan ha ändrats under tiden
+
+            key = self._ring.popleft()
+            self._queues[key].popleft()
+            if self._queues[key]:
+                self._ring.append(key)
+            else:
+                del self._queues[key]
+
+            if self.rpm is not None:
+                self.rpm.consume(waiter.requests)
+            if self.tpm is not None:
+                self.tpm.consume(waiter.tokens)
+            self._in_flight += 1
+            self.granted += 1
+            waiter.future.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self._in_flight,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self.queue_depth,
+            "queued_keys": len(self._queues),
+            "granted": self.granted,
+            "rpm_available": round(self.rpm.level, 1) if self.rpm else None,
+            "tpm_available": round(self.tpm.level, 1) if self.tpm else None,
+            "wait": self.wait_time.snapshot(),
+        }
@@ -0,0 +1,190 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from postgrest.types import ReturnMethod
+
+from backend.utils.metrics import LatencyRecorder
+
+# Asynkront dataåtkomstlager mot Supabase (PostgREST).
+# En AsyncClient per process: anslutningarna i dess httpx-pool återanvänds mellan
+# anropen, och inget anrop går via trådpoolen (run_in_threadpool), som annars blir
+# ett dolt tak för samtidigheten (40 trådar i Starlettes standardpool).
+#
+# Alla läsningar anger kolumner explicit och skrivningar som inte behöver svaret
+# använder return=minimal, så att result_data inte skickas tillbaka i onödan.
+
+JOBS_TABLE = "activity_jobs"
+
+# Kolumner per läsning
+JOB_STATUS_COLUMNS = "job_id, status, result_data, error_message"
+JOB_PROGRESS_COLUMNS = "status, error_message"
+JOB_POLL_COLUMNS = "status, error_message, updated_at"  # kräver backend/sql/activity_jobs_updated_at.sql
+JOB_RESULT_COLUMNS = "result_data"
+JOB_WARM_COLUMNS = "job_id, request_data, result_data, completed_at"
+
+# Statusar där ett jobb fortfarande kan få delresultat
+ACTIVE_STATUSES = ["PENDING", "RUNNING"]
+
+DEFAULT_TIMEOUT_SECONDS = 10.0
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class SupabaseRepository:
+    """Asynkrona, mätta anrop mot activity_jobs och match_chunks.
+
+    Klienten skapas vid första anropet (eller i lifespan via connect()) och delas sedan.
+    """
+
+    def __init__(self, url: Optional[str], key: Optional[str], timeout: float = DEFAULT_TIMEOUT_SECONDS):
+        self.url = url
+        self.key = key
+        self.timeout = timeout
+        self._client = None
+        self._connect_lock: Optional[asyncio.Lock] = None
+
+        self.latency: Dict[str, LatencyRecorder] = {}
+        self.errors = 0
+        # Sätts till False om activity_jobs saknar updated_at (migreringen inte körd)
+        self.has_updated_at = True
+
+    @classmethod
+    def from_env(cls) -> "SupabaseRepository":
+        return cls(
+            os.getenv("SUPABASE_URL"),
+            os.getenv("SUPABASE_SERVICE_ROLE_KEY"),
+            timeout=float(os.getenv("SUPABASE_TIMEOUT_SECONDS", str(DEFAULT_TIMEOUT_SECONDS))),
+        )
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.url and self.key)
+
+    async def connect(self):
+        """Skapar den delade AsyncClient-instansen (idempotent)."""
+        if self._client is not None:
+            return self._client
+        if not self.configured:
+            raise RuntimeError("Supabase URL eller Service Key saknas i .env")
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._client is None:
+                from supabase import AsyncClientOptions, acreate_client
+
+                self._client = await acreate_client(
+                    self.url, self.key, options=AsyncClientOptions(postgrest_client_timeout=self.timeout)
+                )
+                print("--- Asynkron Supabase-klient initierad. ---")
+        return self._client
+
+    async def close(self):
+        """Stänger PostgREST-klientens anslutningspool."""
+        if self._client is not None:
+            await self._client.postgrest.aclose()
+            self._client = None
+            print("--- Asynkron Supabase-klient stängd. ---")
+
+    async def execute(self, operation: str, build: Callable[[Any], Any]) -> list:
+        """Bygger frågan med build(klient), kör den och mäter latensen under `operation`."""
+        client = await self.connect()
+        started = time.perf_counter()
+        try:
+            return (await build(client).execute()).data
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            recorder = self.latency.get(operation)
+            if recorder is None:
+                recorder = self.latency[operation] = LatencyRecorder()
+            recorder.record((time.perf_counter() - started) * 1000)
+
+    # --- activity_jobs ---
+
+    async def insert_jobs(self, rows: List[dict]):
+        await self.execute("insert_jobs", lambda c: c.table(JOBS_TABLE).insert(rows, returning=ReturnMethod.minimal))
+
+    async def get_job(self, job_id: str, columns: str = JOB_STATUS_COLUMNS) -> Optional[dict]:
+        rows = await self.execute(
+            "get_job", lambda c: c.table(JOBS_TABLE).select(columns).eq("job_id", job_id).limit(1)
+        )
+        return rows[0] if rows else None
+
+    async def poll_job(self, job_id: str) -> Optional[dict]:
+        """Lätt statusfråga för /status. Utan updated_at-kolumnen faller den tillbaka till status och fel."""
+        if self.has_updated_at:
+            try:
+                return await self.get_job(job_id, JOB_POLL_COLUMNS)
+            except Exception as e:
+                if "updated_at" not in str(e):
+                    raise
+                self.has_updated_at = False
+                print("VARNING: activity_jobs saknar updated_at (kör backend/sql/activity_jobs_updated_at.sql); "
+                      "statusfrågan hämtar då delresultatet för ETag.")
+        return await self.get_job(job_id, JOB_PROGRESS_COLUMNS)
+
+    async def recent_completed(self, limit: int) -> List[dict]:
+        return await self.execute(
+            "recent_completed",
+            lambda c: c.table(JOBS_TABLE)
+            .select(JOB_WARM_COLUMNS)
+            .eq("status", "COMPLETED")
+            .order("completed_at", desc=True)
+            .limit(limit),
+        )
+
+    async def completed_since(self, since: str, limit: int) -> List[dict]:
+        """COMPLETED-jobb som blev klara efter since (ISO-tid), äldst först."""
+        return await self.execute(
+            "completed_since",
+            lambda c: c.table(JOBS_TABLE)
+            .select(JOB_WARM_COLUMNS)
+            .eq("status", "COMPLETED")
+            .gt("completed_at", since)
+            .order("completed_at")
+            .limit(limit),
+        )
+
+    async def complete_jobs(self, job_ids: List[str], result: dict):
+        await self.execute("complete_jobs", lambda c: c.table(JOBS_TABLE).update({
+            "status": "COMPLETED",
+            "result_data": result,
+            "completed_at": _now_iso(),
+        }, returning=ReturnMethod.minimal).in_("job_id", job_ids))
+
+    async def fail_jobs(self, job_ids: List[str], error: str):
+        await self.execute("fail_jobs", lambda c: c.table(JOBS_TABLE).update({
+            "status": "FAILED",
+            "error_message": error,
+            "completed_at": _now_iso(),
+        }, returning=ReturnMethod.minimal).in_("job_id", job_ids))
+
+    async def save_partial(self, job_ids: List[str], partial: dict):
+        """Delresultat skrivs bara så länge jobbet inte har hunnit bli klart."""
+        await self.execute("save_partial", lambda c: c.table(JOBS_TABLE).update({
+            "status": "RUNNING",
+            "result_data": partial,
+        }, returning=ReturnMethod.minimal).in_("job_id", job_ids).in_("status", ACTIVE_STATUSES))
+
+    # --- chunks ---
+
+    async def match_chunks(self, query_embedding: List[float], match_count: int, filter: dict) -> List[dict]:
+        return await self.execute("match_chunks", lambda c: c.rpc("match_chunks", {
+            "query_embedding": query_embedding,
+            "match_count": match_count,
+            "filter": filter,
+        })) or []
+
+    def stats(self) -> dict:
+        return {
+            "connected": self._client is not None,
+            "errors": self.errors,
+            "has_updated_at": self.has_updated_at,
+            "operations": {name: recorder.snapshot() for name, recorder in self.latency.items()},
+        }
@@ -0,0 +1,211 @@
+import time
+import random
+import asyncio
+import contextvars
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Iterator, Optional, TypeVar
+
+import httpx
+
+# Gemensamt resiliens-lager för utgående anrop:
+# - icke-blockerande retry med "full jitter"-backoff (asyncio.sleep, aldrig time.sleep)
+# - Retry-After för 429
+# - circuit breaker som slår ifrån direkt när tjänsten är nere (5xx och nätverksfel);
+#   429 är kvotbegränsning och hanteras genom att vänta, inte genom att bryta
+# - deadline per jobb som delas av alla anrop inom jobbet
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """Kastas när brytaren är öppen och anropet inte ens försöks."""
+
+
+class DeadlineExceeded(Exception):
+    """Kastas när jobbets tidsbudget inte räcker för ett nytt försök."""
+
+
+# --- Deadline per jobb ---
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("job_deadline", default=None)
+
+
+@contextmanager
+def job_deadline(seconds: Optional[float]) -> Iterator[None]:
+    """Sätter en deadline (monotonic) för alla anrop i den aktuella asyncio-kontexten."""
+    token = _deadline.set(time.monotonic() + seconds if seconds else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_budget() -> Optional[float]:
+    """Sekunder kvar av jobbets budget, eller None om ingen deadline är satt."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+# --- Retry-policy ---
+
+class RetryPolicy:
+    """Antal försök och exponentiell backoff med full jitter."""
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Nätverksfel, 429 och 5xx försöks igen; övriga 4xx är permanenta."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    # httpx.TimeoutException ingår i TransportError; asyncio.TimeoutError är jobbets egen deadline
+    return isinstance(exc, httpx.TransportError)
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    return isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code == 429
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """Läser Retry-After (sekunder eller HTTP-datum) från ett 429/503-svar."""
+    if not isinstance(exc, httpx.HTTPStatusError):
+        return None
+    value = exc.response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+# --- Circuit breaker ---
+
+class CircuitBreaker:
+    """Öppnar efter `failure_threshold` fel i rad och släpper igenom ett testanrop efter `reset_timeout`."""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+        self.rejected = 0
+        self.times_opened = 0
+
+    def before_call(self):
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                raise CircuitOpenError(f"{self.name} är tillfälligt avstängd efter upprepade fel.")
+            self.state = "half_open"
+            self._probe_in_flight = False
+        if self.state == "half_open":
+            if self._probe_in_flight:
+                self.rejected += 1
+                raise CircuitOpenError(f"{self.name} testas efter avbrott, försök igen strax.")
+            self._probe_in_flight = True
+
+    def record_success(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def abandon(self):
+        """Anropet avbröts utan svar från tjänsten (t.ex. jobbets deadline): räknas varken som fel eller lyckat."""
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+                print(f"VARNING: Circuit breaker '{self.name}' öppnad ({self.consecutive_failures} fel i rad).")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+# --- Själva anropet ---
+
+async def call_with_resilience(
+    fn: Callable[[], Awaitable[T]],
+    *,
+    breaker: CircuitBreaker,
+    policy: RetryPolicy,
+    name: str = "anrop",
+) -> T:
+    """Kör fn() med retry/backoff, Retry-After, circuit breaker och jobbets deadline."""
+    for attempt in range(policy.max_attempts):
+        budget = remaining_budget()
+        if budget is not None and budget <= 0:
+            raise DeadlineExceeded(f"Tidsbudgeten för jobbet tog slut före {name}.")
+
+        breaker.before_call()
+        try:
+            if budget is not None:
+                result = await asyncio.wait_for(fn(), timeout=budget)
+            else:
+                result = await fn()
+        except asyncio.TimeoutError as e:
+            if budget is None:
+                breaker.record_success()
+                raise
+            # Budgeten tog slut (ev. i kön till kvoten): inget fel hos tjänsten, så brytaren påverkas inte
+            breaker.abandon()
+            raise DeadlineExceeded(f"Tidsbudgeten för jobbet tog slut under {name}.") from e
+        except Exception as e:
+            if not is_retryable(e):
+                # Permanent fel (t.ex. 400/403): tjänsten svarar, så brytaren räknar det inte
+                breaker.record_success()
+                raise
+            if is_rate_limited(e):
+                # Kvoten är slut men tjänsten fungerar: vänta enligt Retry-After utan att räkna ett fel
+                breaker.abandon()
+            else:
+                breaker.record_failure()
+            if attempt == policy.max_attempts - 1 or breaker.state == "open":
+                # Sista försöket, eller brytaren slog just ifrån: ingen idé att vänta
+                raise
+
+            delay = retry_after_seconds(e)
+            if delay is None:
+                delay = policy.backoff(attempt)
+            budget = remaining_budget()
+            if budget is not None and delay >= budget:
+                raise DeadlineExceeded(f"Tidsbudgeten räcker inte för ett nytt försök av {name}: {e}") from e
+
+            print(f"Försök {attempt + 1}/{policy.max_attempts} av {name} misslyckades ({e}), nytt försök om {delay:.2f}s.")
+            await asyncio.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+    raise RuntimeError("call_with_resilience: ogiltig RetryPolicy (max_attempts < 1).")
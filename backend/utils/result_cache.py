@@ -0,0 +1,185 @@
+import os
+import time
+import uuid
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Semantisk resultatcache för hela aktivitetsjobb.
+# Ett tidigare COMPLETED-resultat återanvänds om frågans inbäddning ligger inom
+# en cosinus-tröskel, för samma ämne och samma antal quizfrågor/flashcards.
+# Cachen finns i varje process men fylls från activity_jobs: vid start med de senaste
+# COMPLETED-jobben (warm_limit) och sedan periodiskt med jobb som andra workers har
+# gjort klart (refresh_seconds), så att träffarna inte begränsas till den egna processen.
+# En träff får ett eget response_id; själva innehållet delas med originaljobbet.
+
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_MAX_ENTRIES = 500
+DEFAULT_TTL_SECONDS = 24 * 3600.0
+DEFAULT_WARM_LIMIT = 200
+DEFAULT_REFRESH_SECONDS = 30.0
+
+PartitionKey = Tuple[str, int, int]
+
+
+@dataclass
+class CachedResult:
+    job_id: str
+    result: dict
+    similarity: float
+
+
+class _Partition:
+    """Alla cachade resultat för ett (ämne, antal quiz, antal flashcards)."""
+
+    def __init__(self, dimension: int):
+        self.vectors = np.empty((0, dimension), dtype=np.float32)
+        self.job_ids: List[str] = []
+        self.results: List[dict] = []
+        self.created_at: List[float] = []
+
+    def drop_oldest(self, count: int):
+        self.vectors = self.vectors[count:]
+        del self.job_ids[:count]
+        del self.results[:count]
+        del self.created_at[:count]
+
+
+class SemanticResultCache:
+    """Hittar nära dubbletter av tidigare jobb via cosinuslikhet mellan frågeinbäddningar."""
+
+    def __init__(
+        self,
+        threshold: float = DEFAULT_THRESHOLD,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        warm_limit: int = DEFAULT_WARM_LIMIT,
+        refresh_seconds: float = DEFAULT_REFRESH_SECONDS,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.warm_limit = warm_limit
+        self.refresh_seconds = refresh_seconds
+        self._partitions: Dict[PartitionKey, _Partition] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.loaded = 0
+
+    @classmethod
+    def from_env(cls) -> "SemanticResultCache":
+        """Skapar cachen från miljövariabler (RESULT_CACHE_THRESHOLD, _MAX_ENTRIES, _TTL, _WARM_LIMIT, _REFRESH_SECONDS).
+
+        RESULT_CACHE_WARM_LIMIT=0 och RESULT_CACHE_REFRESH_SECONDS=0 ger en cache som bara ser processens egna jobb.
+        """
+        return cls(
+            threshold=float(os.getenv("RESULT_CACHE_THRESHOLD", DEFAULT_THRESHOLD)),
+            max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+            ttl_seconds=float(os.getenv("RESULT_CACHE_TTL", DEFAULT_TTL_SECONDS)),
+            warm_limit=int(os.getenv("RESULT_CACHE_WARM_LIMIT", DEFAULT_WARM_LIMIT)),
+            refresh_seconds=float(os.getenv("RESULT_CACHE_REFRESH_SECONDS", DEFAULT_REFRESH_SECONDS)),
+        )
+
+    @staticmethod
+    def partition_key(request) -> PartitionKey:
+        return (request.subject, request.quiz_questions, request.flashcard_items)
+
+    @staticmethod
+    def _unit(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _expire(self, partition: _Partition):
+        cutoff = time.time() - self.ttl_seconds
+        expired = 0
+        for created_at in partition.created_at:
+            if created_at >= cutoff:
+                break
+            expired += 1
+        if expired:
+            partition.drop_oldest(expired)
+
+    def lookup(self, request, embedding: List[float]) -> Optional[CachedResult]:
+        """Returnerar det mest lika tidigare resultatet om det ligger över tröskeln."""
+        if getattr(request, "force_regenerate", False):
+            self.bypassed += 1
+            return None
+
+        query = self._unit(embedding)
+        with self._lock:
+            partition = self._partitions.get(self.partition_key(request))
+            if partition is not None:
+                self._expire(partition)
+            if partition is None or not partition.job_ids:
+                self.misses += 1
+                return None
+
+            similarities = partition.vectors @ query
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            # Det nya jobbet är ett eget svar: samma innehåll men nytt response_id
+            return CachedResult(
+                job_id=partition.job_ids[best],
+                result=dict(partition.results[best], response_id=str(uuid.uuid4())),
+                similarity=similarity,
+            )
+
+    def store(
+        self,
+        request,
+        embedding: List[float],
+        job_id: str,
+        result: dict,
+        created_at: Optional[float] = None,
+        skip_covered: bool = False,
+    ) -> bool:
+        """Lägger till ett färdigt (COMPLETED) resultat i cachen. Returnerar False om det inte lades till.
+
+        created_at: när jobbet blev klart (time.time()), för jobb som läses från databasen.
+        skip_covered: hoppa över jobbet om det redan finns i cachen eller om ett cachat
+        resultat redan ligger inom tröskeln (t.ex. jobb som själva var cacheträffar).
+        """
+        created_at = time.time() if created_at is None else created_at
+        if created_at < time.time() - self.ttl_seconds:
+            return False
+        vector = self._unit(embedding)
+        key = self.partition_key(request)
+        with self._lock:
+            partition = self._partitions.get(key)
+            if partition is None:
+                partition = self._partitions[key] = _Partition(vector.shape[0])
+            elif skip_covered and partition.job_ids:
+                if job_id in partition.job_ids or float(np.max(partition.vectors @ vector)) >= self.threshold:
+                    return False
+            partition.vectors = np.vstack([partition.vectors, vector[np.newaxis, :]])
+            partition.job_ids.append(job_id)
+            partition.results.append(result)
+            partition.created_at.append(created_at)
+            overflow = len(partition.job_ids) - self.max_entries
+            if overflow > 0:
+                partition.drop_oldest(overflow)
+            return True
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": sum(len(p.job_ids) for p in self._partitions.values()),
+            "partitions": len(self._partitions),
+            "loaded_from_db": self.loaded,
+            "threshold": self.threshold,
+        }
@@ -0,0 +1,370 @@
+import os
+import json
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from backend.utils.corpus import Corpus
+from backend.utils.lexical_index import BM25Index
+
+# Utbytbara "retrievers" för RAG-hämtningen.
+# Alla backends tar emot samma argument som Supabase-RPC:n match_chunks
+# (query_embedding, match_count, filter) och returnerar rader på formen
+# {"content": str, "similarity": float, "metadata": dict}; det lokala indexet
+# skickar även med radens normaliserade vektor som "embedding".
+# query_text (frågan i klartext) används bara av HybridRetriever.
+
+# Metadatafält som den lokala indexeringen partitionerar på
+PARTITION_KEYS = ("subject", "grade_level")
+
+MANIFEST_FILE = "manifest.json"
+
+
+class Retriever:
+    """Basklass för vektorhämtning med samma filtersemantik som match_chunks."""
+
+    name = "base"
+
+    def __init__(self):
+        self.searches = 0
+        self.total_ms = 0.0
+
+    def load(self):
+        """Förbereder backenden (t.ex. laddar index). Anropas från lifespan."""
+
+    async def _search(self, query_embedding: List[float], match_count: int, filter: dict, query_text: Optional[str] = None) -> List[dict]:
+        raise NotImplementedError
+
+    async def search(self, query_embedding: List[float], match_count: int, filter: dict, query_text: Optional[str] = None) -> List[dict]:
+        started = time.perf_counter()
+        try:
+            return await self._search(query_embedding, match_count, filter, query_text)
+        finally:
+            self.searches += 1
+            self.total_ms += (time.perf_counter() - started) * 1000
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "searches": self.searches,
+            "avg_ms": self.total_ms / self.searches if self.searches else 0.0,
+        }
+
+
+class SupabaseRetriever(Retriever):
+    """Vektorsökning via Supabase-RPC:n match_chunks (ett nätverksanrop per sökning)."""
+
+    name = "supabase"
+
+    def __init__(self, db):
+        super().__init__()
+        self.db = db
+
+    async def _search(self, query_embedding: List[float], match_count: int, filter: dict, query_text: Optional[str] = None) -> List[dict]:
+        if self.db is None or not self.db.configured:
+            raise Exception("Supabase-tjänsten är inte tillgänglig.")
+        return await self.db.match_chunks(query_embedding, match_count, filter)
+
+
+class _LocalPartition:
+    def __init__(self, metadata: dict, vectors: np.ndarray, records: List[dict]):
+        self.metadata = metadata
+        self.vectors = vectors
+        self.records = records
+
+
+class LocalVectorRetriever(Retriever):
+    """Exakt top-k i processen över en minnesmappad ögonblicksbild av chunks-tabellen.
+
+    Ögonblicksbilden är en katalog med manifest.json samt en .npy-matris (float32,
+    normaliserade rader) och en .json-fil med rader per partition (subject, grade_level).
+    Rader med "ref": [ämne, index] i stället för "content" läses ur den minnesmappade
+    korpusen (manifestets corpus_dir) först när de hamnar i ett sökresultat.
+    """
+
+    name = "local"
+
+    def __init__(self, snapshot_dir: str):
+        super().__init__()
+        self.snapshot_dir = Path(snapshot_dir)
+        self._partitions: Optional[List[_LocalPartition]] = None
+        self._corpus: Optional[Corpus] = None
+
+    def load(self):
+        if self._partitions is not None:
+            return
+        manifest = json.loads((self.snapshot_dir / MANIFEST_FILE).read_text(encoding="utf-8"))
+        if manifest.get("corpus_dir"):
+            self._corpus = Corpus(manifest["corpus_dir"])
+        partitions = []
+        for entry in manifest["partitions"]:
+            vectors = np.load(self.snapshot_dir / entry["vectors"], mmap_mode="r")
+            records = json.loads((self.snapshot_dir / entry["records"]).read_text(encoding="utf-8"))
+            partitions.append(_LocalPartition(entry["metadata"], vectors, records))
+        self._partitions = partitions
+        print(f"--- Lokalt vektorindex laddat: {sum(len(p.records) for p in partitions)} chunks i {len(partitions)} partitioner. ---")
+
+    def _matching_partitions(self, filter: dict) -> List[Tuple[_LocalPartition, Optional[np.ndarray]]]:
+        partition_filter = {k: v for k, v in filter.items() if k in PARTITION_KEYS}
+        row_filter = {k: v for k, v in filter.items() if k not in PARTITION_KEYS}
+
+        matches = []
+        for partition in self._partitions:
+            if any(partition.metadata.get(k) != v for k, v in partition_filter.items()):
+                continue
+            mask = None
+            if row_filter:
+                mask = np.array([
+                    all(record["metadata"].get(k) == v for k, v in row_filter.items())
+                    for record in partition.records
+                ], dtype=bool)
+            matches.append((partition, mask))
+        return matches
+
+    def search_sync(self, query_embedding: List[float], match_count: int, filter: dict) -> List[dict]:
+        """Synkron sökning; tar under en millisekund för kursplanens storlek."""
+        self.load()
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        candidates: List[Tuple[float, dict, np.ndarray]] = []
+        for partition, mask in self._matching_partitions(filter or {}):
+            scores = partition.vectors @ query
+            if mask is not None:
+                scores = np.where(mask, scores, -np.inf)
+            k = min(match_count, len(scores))
+            if k == 0:
+                continue
+            if k < len(scores):
+                top = np.argpartition(-scores, k - 1)[:k]
+            else:
+                top = np.arange(len(scores))
+            for i in top:
+                if np.isfinite(scores[i]):
+                    candidates.append((float(scores[i]), partition.records[i], partition.vectors[i]))
+
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        # Vektorn följer med så att kontextbyggaren kan känna igen nära dubbletter
+        return [
+            {"content": self._content(record), "similarity": score, "metadata": record["metadata"], "embedding": vector}
+            for score, record, vector in candidates[:match_count]
+        ]
+
+    def _content(self, record: dict) -> str:
+        if "content" in record:
+            return record["content"]
+        return self._corpus.text(*record["ref"])
+
+    async def _search(self, query_embedding: List[float], match_count: int, filter: dict, query_text: Optional[str] = None) -> List[dict]:
+        # Ingen I/O: körs direkt på event-loopen
+        return self.search_sync(query_embedding, match_count, filter)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        if self._partitions is not None:
+            stats["partitions"] = len(self._partitions)
+            stats["chunks"] = sum(len(p.records) for p in self._partitions)
+        return stats
+
+
+class HybridRetriever(Retriever):
+    """BM25 över korpusen i processen + vektorsökning, sammanvägda med reciprocal rank fusion.
+
+    Är den lexikala träffen säker (en kursplanerubrik i frågan, eller alla sökord i en
+    tydligt bästa chunk) returneras den direkt och vektorsökningen (RPC:n) hoppas över.
+    """
+
+    name = "hybrid"
+
+    def __init__(self, vector: Retriever, corpus: Corpus, heading_patterns: List[str] = (), rrf_k: int = 60):
+        super().__init__()
+        self.vector = vector
+        self.corpus = corpus
+        self.heading_patterns = list(heading_patterns)
+        self.rrf_k = rrf_k
+        self.index: Optional[BM25Index] = None
+
+        self.lexical_only = 0
+        self.fused = 0
+
+    def load(self):
+        self.vector.load()
+        if self.index is not None:
+            return
+        index = BM25Index()
+        index.build(
+            (
+                ((subject, i), self.corpus.text(subject, i), self.corpus.subject(subject).metadata(i))
+                for subject, i in self.corpus.iter_refs()
+            ),
+            self.heading_patterns,
+        )
+        self.index = index
+        print(f"--- Lexikalt index (BM25) laddat: {len(index)} chunks. ---")
+
+    def _lexical_row(self, doc_id: int, similarity: float) -> dict:
+        return {
+            "content": self.corpus.text(*self.index.keys[doc_id]),
+            "similarity": similarity,
+            "metadata": self.index.metadata[doc_id],
+        }
+
+    async def _search(self, query_embedding: List[float], match_count: int, filter: dict, query_text: Optional[str] = None) -> List[dict]:
+        if self.index is None:
+            await run_in_threadpool(self.load)
+        if not query_text or not len(self.index):
+            return await self.vector.search(query_embedding, match_count, filter)
+
+        ranked, confident = self.index.search(query_text, 2 * match_count, filter)
+        if confident:
+            self.lexical_only += 1
+            top_score = ranked[0][1]
+            return [self._lexical_row(doc_id, score / top_score) for doc_id, score in ranked[:match_count]]
+
+        vector_rows = await self.vector.search(query_embedding, match_count, filter)
+        if not ranked:
+            return vector_rows
+        self.fused += 1
+
+        # RRF: 1 / (k + rang) summerat över listorna; samma chunk känns igen på texten.
+        # similarity är vektorlikheten när den finns, annars normaliserad BM25-poäng.
+        fused: Dict[str, Tuple[float, dict]] = {}
+        for rank, row in enumerate(vector_rows, start=1):
+            fused[row["content"]] = (1.0 / (self.rrf_k + rank), row)
+        top_score = ranked[0][1]
+        for rank, (doc_id, score) in enumerate(ranked, start=1):
+            row = self._lexical_row(doc_id, score / top_score)
+            previous, existing = fused.get(row["content"], (0.0, row))
+            fused[row["content"]] = (previous + 1.0 / (self.rrf_k + rank), existing)
+
+        ordered = sorted(fused.values(), key=lambda item: item[0], reverse=True)
+        return [row for _, row in ordered[:match_count]]
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update({
+            "vector": self.vector.stats(),
+            "lexical_only": self.lexical_only,
+            "fused": self.fused,
+            "vector_calls_saved": self.lexical_only / self.searches if self.searches else 0.0,
+        })
+        if self.index is not None:
+            stats["lexical_chunks"] = len(self.index)
+        return stats
+
+
+def write_snapshot(snapshot_dir: str, records: List[dict], embeddings: List[List[float]], corpus: Optional[Corpus] = None):
+    """Skriver en ögonblicksbild för LocalVectorRetriever.
+
+    records är rader på chunks-tabellens form ({"content": ..., "metadata": {...}}),
+    eller {"ref": [ämne, index], "metadata": {...}} för chunks som finns i corpus.
+    """
+    directory = Path(snapshot_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    groups: Dict[tuple, List[int]] = {}
+    for i, record in enumerate(records):
+        key = tuple(record["metadata"].get(k) for k in PARTITION_KEYS)
+        groups.setdefault(key, []).append(i)
+
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = matrix / np.where(norms > 0, norms, 1.0)
+
+    partitions = []
+    for n, (key, indices) in enumerate(sorted(groups.items(), key=lambda g: str(g[0]))):
+        vectors_file = f"partition_{n:03d}.npy"
+        records_file = f"partition_{n:03d}.json"
+        np.save(directory / vectors_file, np.ascontiguousarray(matrix[indices]))
+        (directory / records_file).write_text(
+            json.dumps([records[i] for i in indices], ensure_ascii=False), encoding="utf-8"
+        )
+        partitions.append({
+            "metadata": dict(zip(PARTITION_KEYS, key)),
+            "vectors": vectors_file,
+            "records": records_file,
+        })
+
+    manifest = {"dimension": int(matrix.shape[1]) if len(matrix) else 0, "partitions": partitions}
+    if corpus is not None:
+        manifest["corpus_dir"] = str(corpus.directory.resolve())
+    (directory / MANIFEST_FILE).write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def export_snapshot_from_supabase(supabase, snapshot_dir: str, page_size: int = 500, corpus: Optional[Corpus] = None) -> int:
+    """Hämtar hela chunks-tabellen från Supabase och skriver en lokal ögonblicksbild.
+
+    Med en korpus sparas chunks som finns där som referenser i stället för text.
+    """
+    records, embeddings = [], []
+    columns = 'content, metadata, embedding' + (', content_hash' if corpus is not None else '')
+    offset = 0
+    while True:
+        page = supabase.table('chunks') \
+            .select(columns) \
+            .range(offset, offset + page_size - 1) \
+            .execute().data
+        for row in page:
+            embedding = row['embedding']
+            # pgvector-kolumner kommer som text ("[0.1,0.2,...]") via PostgREST
+            if isinstance(embedding, str):
+                embedding = json.loads(embedding)
+            ref = corpus.find(row['content_hash']) if corpus is not None and row.get('content_hash') else None
+            if ref is not None:
+                records.append({"ref": list(ref), "metadata": row.get('metadata') or {}})
+            else:
+                records.append({"content": row['content'], "metadata": row.get('metadata') or {}})
+            embeddings.append(embedding)
+        if len(page) < page_size:
+            break
+        offset += page_size
+
+    write_snapshot(snapshot_dir, records, embeddings, corpus=corpus)
+    return len(records)
+
+
+def create_retriever(db) -> Retriever:
+    """Väljer backend via RETRIEVER_BACKEND (supabase|local) och LOCAL_INDEX_DIR.
+
+    RETRIEVER_HYBRID (auto|on|off) lägger BM25-indexet framför vektorsökningen;
+    "auto" gör det om korpusen (CORPUS_DIR) är byggd.
+    """
+    backend = os.getenv("RETRIEVER_BACKEND", "supabase").lower()
+    if backend == "local":
+        snapshot_dir = os.getenv("LOCAL_INDEX_DIR")
+        if not snapshot_dir:
+            raise ValueError("RETRIEVER_BACKEND=local kräver att LOCAL_INDEX_DIR är satt.")
+        vector: Retriever = LocalVectorRetriever(snapshot_dir)
+    else:
+        vector = SupabaseRetriever(db)
+
+    hybrid = os.getenv("RETRIEVER_HYBRID", "auto").lower()
+    if hybrid == "off":
+        return vector
+    corpus = Corpus()
+    if not corpus.directory.is_dir() or not corpus.subjects():
+        if hybrid == "on":
+            raise ValueError("RETRIEVER_HYBRID=on kräver en korpus: kör python -m backend.ingest --corpus-only.")
+        return vector
+
+    from backend.title_files.no_so_titles import ALL_CONFIGS
+    patterns = [pattern for config in ALL_CONFIGS for pattern in config["regex_headings"]]
+    return HybridRetriever(vector, corpus, patterns)
+
+
+if __name__ == "__main__":
+    # Användning: python -m backend.utils.retrievers <katalog>
+    import sys
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    load_dotenv()
+    target = sys.argv[1] if len(sys.argv) > 1 else os.getenv("LOCAL_INDEX_DIR", "local_index")
+    client = create_client(os.environ["SUPABASE_URL"], os.environ["SUPABASE_SERVICE_ROLE_KEY"])
+    count = export_snapshot_from_supabase(client, target)
+    print(f"Skrev {count} chunks till {target}")
@@ -0,0 +1,111 @@
+import os
+import time
+import asyncio
+import inspect
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Union
+
+# Tjänstecontainer för processens delade backends (HTTP-klient, databas, retriever, inbäddning ...).
+# Inget av dem byggs vid import: varje tjänst startas en gång, antingen i lifespan
+# (de som står i WARM_SERVICES) eller vid första användningen via ensure().
+# Starttiden sparas, så att /ready kan visa vilka backends som är varma;
+# stängning sker i omvänd registreringsordning.
+
+StartFn = Callable[[], Union[None, Awaitable[None]]]
+
+
+async def _call(fn: Optional[StartFn]):
+    if fn is None:
+        return
+    result = fn()
+    if inspect.isawaitable(result):
+        await result
+
+
+class Service:
+    """En backend med start- och stängfunktion (sync eller async) och dess status."""
+
+    def __init__(self, name: str, start: StartFn, stop: Optional[StartFn] = None):
+        self.name = name
+        self.start = start
+        self.stop = stop
+        self.ready = False
+        self.seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "start_seconds": round(self.seconds, 3) if self.seconds is not None else None,
+            "error": self.error,
+        }
+
+
+class ServiceContainer:
+    """Lat, engångsstart av tjänster med readiness-rapport."""
+
+    def __init__(self, warm: Optional[Iterable[str]] = None):
+        self._services: Dict[str, Service] = {}
+        # None = värm alla registrerade tjänster i lifespan
+        self.warm_names = set(warm) if warm is not None else None
+
+    @classmethod
+    def from_env(cls) -> "ServiceContainer":
+        """WARM_SERVICES: kommaseparerade namn som startas i lifespan ("all" = alla, "" = inga)."""
+        value = os.getenv("WARM_SERVICES", "all").strip().lower()
+        if value == "all":
+            return cls()
+        return cls(name.strip() for name in value.split(",") if name.strip())
+
+    def add(self, name: str, start: StartFn, stop: Optional[StartFn] = None):
+        self._services[name] = Service(name, start, stop)
+
+    def is_warm(self, name: str) -> bool:
+        return self.warm_names is None or name in self.warm_names
+
+    async def ensure(self, name: str):
+        """Startar tjänsten om den inte redan är startad. Billigt efter första anropet."""
+        service = self._services[name]
+        if service.ready:
+            return
+        if service._lock is None:
+            service._lock = asyncio.Lock()
+        async with service._lock:
+            if service.ready:
+                return
+            started = time.perf_counter()
+            try:
+                await _call(service.start)
+            except Exception as e:
+                service.error = str(e)
+                raise
+            service.seconds = time.perf_counter() - started
+            service.error = None
+            service.ready = True
+
+    async def start(self):
+        """Startar tjänsterna i WARM_SERVICES (anropas från lifespan). Fel loggas; tjänsten provas igen vid användning."""
+        for name in self._services:
+            if not self.is_warm(name):
+                continue
+            try:
+                await self.ensure(name)
+            except Exception as e:
+                print(f"VARNING: Kunde inte starta '{name}' vid uppstart: {e}")
+
+    async def close(self):
+        """Stänger alla tjänster i omvänd ordning, även de som startats lazy (stängfunktionerna tål att inget är öppet)."""
+        for service in reversed(list(self._services.values())):
+            service.ready = False
+            try:
+                await _call(service.stop)
+            except Exception as e:
+                print(f"VARNING: Kunde inte stänga '{service.name}': {e}")
+
+    def readiness(self) -> dict:
+        """ready är sant när alla tjänster som ska värmas vid start är igång; övriga startas vid behov."""
+        services = {}
+        for name, service in self._services.items():
+            services[name] = dict(service.status(), warm_on_start=self.is_warm(name))
+        ready = all(s["ready"] for s in services.values() if s["warm_on_start"])
+        return {"ready": ready, "services": services}
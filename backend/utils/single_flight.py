@@ -0,0 +1,62 @@
+import asyncio
+from typing import Dict, Hashable, List, Tuple
+
+# Single-flight för identiska jobb i processen.
+# Det första jobbet för en nyckel (dedup_key i main.py) blir "ledare" och kör
+# pipelinen; identiska jobb som kommer in medan den körs ansluter till ledarens
+# flight i stället för att inbädda, söka och generera samma sak igen.
+# Ledaren skriver sedan resultatet till alla anslutna jobbrader.
+
+
+class Flight:
+    """En pågående beräkning. job_ids växer när identiska jobb ansluter."""
+
+    def __init__(self, key: Hashable, job_ids: List[str]):
+        self.key = key
+        self.job_ids: List[str] = list(job_ids)
+        self.closed = False
+        self._done = asyncio.Event()
+
+    async def wait(self):
+        await self._done.wait()
+
+
+class SingleFlight:
+    """Register över pågående flights per nyckel, med träffräknare för /metrics."""
+
+    def __init__(self):
+        self._flights: Dict[Hashable, Flight] = {}
+        self.leaders = 0
+        self.coalesced_jobs = 0
+
+    def join(self, key: Hashable, job_ids: List[str]) -> Tuple[Flight, bool]:
+        """Returnerar (flight, ledare). Är ledare False har jobben anslutits till en pågående flight."""
+        flight = self._flights.get(key)
+        if flight is not None:
+            flight.job_ids.extend(job_ids)
+            self.coalesced_jobs += len(job_ids)
+            return flight, False
+        flight = self._flights[key] = Flight(key, job_ids)
+        self.leaders += 1
+        return flight, True
+
+    def close(self, flight: Flight) -> List[str]:
+        """Stänger flighten för nya jobb (innan resultatet skrivs) och returnerar alla dess job_ids."""
+        if not flight.closed:
+            flight.closed = True
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        return flight.job_ids
+
+    def release(self, flight: Flight):
+        self.close(flight)
+        flight._done.set()
+
+    def stats(self) -> dict:
+        total = self.leaders + self.coalesced_jobs
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced_jobs": self.coalesced_jobs,
+            "hit_rate": self.coalesced_jobs / total if total else 0.0,
+        }
@@ -0,0 +1,107 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# Cache i processen för färdiga jobb i /status/{job_id}.
+# COMPLETED och FAILED ändras aldrig, så svaret serialiseras en gång och
+# återanvänds. ETag för ett färdigt jobb beror bara på job_id och status;
+# en klient som redan har sett jobbet färdigt får 304 utan databasfråga
+# när jobbet finns i cachen, annars efter den lätta statusfrågan.
+
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+# Ungefärlig fast kostnad per post (nyckel, tupel, OrderedDict-nod)
+_ENTRY_OVERHEAD_BYTES = 128
+
+
+def finished_etag(job_id: str, status: str) -> str:
+    return f'"{job_id}:{status}"'
+
+
+def progress_etag(job_id: str, status: str, updated_at: Optional[str]) -> Optional[str]:
+    """ETag medan jobbet pågår; None om raden saknar updated_at."""
+    if not updated_at:
+        return None
+    return f'"{job_id}:{status}:{updated_at}"'
+
+
+def content_etag(job_id: str, status: str, body: bytes) -> str:
+    """ETag från själva svaret, när updated_at saknas (databasen utan activity_jobs_updated_at.sql)."""
+    return f'"{job_id}:{status}:{hashlib.sha1(body).hexdigest()[:16]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """Jämför en If-None-Match-header (ev. lista, ev. W/-prefix) med en ETag.
+
+    "*" räknas inte: den skulle ge 304 för jobb som inte finns eller inte har ändrats som klienten tror.
+    """
+    if not if_none_match or not etag:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class FinishedJobCache:
+    """LRU med bytebudget: job_id -> (ETag, serialiserat JSON-svar)."""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_env(cls) -> "FinishedJobCache":
+        return cls(max_bytes=int(os.getenv("STATUS_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)))
+
+    @staticmethod
+    def _size(job_id: str, etag: str, body: bytes) -> int:
+        return len(job_id) + len(etag) + len(body) + _ENTRY_OVERHEAD_BYTES
+
+    def get(self, job_id: str) -> Optional[Tuple[str, bytes]]:
+        with self._lock:
+            entry = self._entries.get(job_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(job_id)
+            self.hits += 1
+            return entry
+
+    def put(self, job_id: str, etag: str, body: bytes):
+        size = self._size(job_id, etag, body)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(job_id, None)
+            if old is not None:
+                self._bytes -= self._size(job_id, *old)
+            self._entries[job_id] = (etag, body)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                evicted_id, evicted = self._entries.popitem(last=False)
+                self._bytes -= self._size(evicted_id, *evicted)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,129 @@
+import json
+from typing import Callable, List, Optional, Tuple
+
+# Inkrementell JSON-parser för strömmade LLM-svar.
+# Texten matas in bit för bit; så fort ett värde på en bevakad sökväg är komplett
+# (t.ex. ett helt quiz-objekt) returneras det, utan att vänta på resten av svaret.
+#
+# Sökvägar är tupler av nycklar, där "*" står för ett element i en lista:
+#   ("explanation",), ("quiz", "questions", "*"), ("flashcards", "items", "*")
+
+Path = Tuple[str, ...]
+
+_WHITESPACE = " \t\r\n"
+
+
+class _Frame:
+    __slots__ = ("kind", "path", "start", "state", "key")
+
+    def __init__(self, kind: str, path: Path, start: int, state: str):
+        self.kind = kind      # "object" eller "array"
+        self.path = path
+        self.start = start
+        self.state = state    # object: key/colon/value/comma, array: value/comma
+        self.key: Optional[str] = None
+
+
+class IncrementalJsonParser:
+    """Returnerar kompletta strängar, objekt och listor på bevakade sökvägar allteftersom de blir klara."""
+
+    def __init__(self, watch: Callable[[Path], bool]):
+        self.watch = watch
+        self.buffer = ""
+        self._pos = 0
+        self._stack: List[_Frame] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._string_is_key = False
+        self._string_path: Path = ()
+        self._in_primitive = False
+
+    def _value_path(self) -> Optional[Path]:
+        """Sökvägen för ett värde som börjar nu, eller None om vi inte står på en värdeposition."""
+        if not self._stack:
+            return ()
+        top = self._stack[-1]
+        if top.state != "value":
+            return None
+        if top.kind == "object":
+            return top.path + (top.key,)
+        return top.path + ("*",)
+
+    def _emit(self, path: Path, start: int, end: int, out: list):
+        if self.watch(path):
+            out.append((path, json.loads(self.buffer[start:end])))
+
+    def feed(self, text: str) -> List[Tuple[Path, object]]:
+        self.buffer += text
+        out: List[Tuple[Path, object]] = []
+        buf = self.buffer
+
+        for i in range(self._pos, len(buf)):
+            c = buf[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._string_is_key:
+                        top = self._stack[-1]
+                        top.key = json.loads(buf[self._string_start:i + 1])
+                        top.state = "colon"
+                    else:
+                        self._emit(self._string_path, self._string_start, i + 1, out)
+                continue
+
+            if self._in_primitive:
+                if c not in ",]}" and c not in _WHITESPACE:
+                    continue
+                self._in_primitive = False
+
+            if c in _WHITESPACE:
+                continue
+
+            top = self._stack[-1] if self._stack else None
+            value_path = self._value_path()
+
+            if top is not None and top.kind == "array" and top.state == "value" and c == "]":
+                # Tom lista
+                self._close(i, out)
+            elif value_path is not None:
+                if top is not None:
+                    top.state = "comma"
+                if c == "{":
+                    self._stack.append(_Frame("object", value_path, i, "key"))
+                elif c == "[":
+                    self._stack.append(_Frame("array", value_path, i, "value"))
+                elif c == '"':
+                    self._in_string = True
+                    self._string_is_key = False
+                    self._string_start = i
+                    self._string_path = value_path
+                else:
+                    self._in_primitive = True
+            elif top.kind == "object" and top.state == "key":
+                if c == '"':
+                    self._in_string = True
+                    self._string_is_key = True
+                    self._string_start = i
+                elif c == "}":
+                    self._close(i, out)
+            elif top.kind == "object" and top.state == "colon":
+                if c == ":":
+                    top.state = "value"
+            elif top.state == "comma":
+                if c == ",":
+                    top.state = "key" if top.kind == "object" else "value"
+                elif c in "}]":
+                    self._close(i, out)
+
+        self._pos = len(buf)
+        return out
+
+    def _close(self, i: int, out: list):
+        frame = self._stack.pop()
+        self._emit(frame.path, frame.start, i + 1, out)
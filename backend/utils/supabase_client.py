@@ -1,19 +1,28 @@
 import os
+from typing import Optional
+
 from dotenv import load_dotenv
-from backend.utils.supabase_client import create_client, Client
 
-# Ladda miljövariabler från .env-filen (om den finns)
-# Detta är standard i Python-projekt
-load_dotenv()
+# Synkron Supabase-klient för skript och badge-logiken.
+# Klienten skapas vid första get_supabase()-anropet i stället för vid import, så att
+# moduler som importerar den här filen inte kräver miljövariablerna eller nätverk.
+
+_client = None
 
-# Hämta variabler från miljön
-SUPABASE_URL = os.environ.get("SUPABASE_URL")
-SUPABASE_SERVICE_ROLE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
 
-if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
-    raise EnvironmentError(
-        "Fel: SUPABASE_URL och SUPABASE_SERVICE_ROLE_KEY måste vara satta i miljövariabler (eller .env-fil)."
-    )
+def get_supabase():
+    """Returnerar den delade synkrona klienten (skapas en gång)."""
+    global _client
+    if _client is None:
+        # Ladda miljövariabler från .env-filen (om den finns)
+        load_dotenv()
+        url: Optional[str] = os.environ.get("SUPABASE_URL")
+        key: Optional[str] = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+        if not url or not key:
+            raise EnvironmentError(
+                "Fel: SUPABASE_URL och SUPABASE_SERVICE_ROLE_KEY måste vara satta i miljövariabler (eller .env-fil)."
+            )
+        from supabase import create_client
 
-# Instansiera klienten en gång och exportera den
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
\ No newline at end of file
+        _client = create_client(url, key)
+    return _client
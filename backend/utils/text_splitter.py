@@ -0,0 +1,214 @@
+import re
+from collections import deque
+from typing import Callable, Deque, Iterable, Iterator, List, Optional, Tuple, TypeVar, Union
+
+# Strömmande uppdelning av text i chunks med tokenbudget och överlapp.
+# Texten delas på meningsgränser; varje chunk består av hela meningar upp till
+# max_tokens och börjar med de sista meningarna (upp till overlap_tokens) från
+# föregående chunk. Allt är generatorer och längder hålls som löpande summor,
+# så tiden är linjär i textens längd.
+#
+# split_spans ger chunks som (start, slut)-offsets i texten; chunkens text är
+# avsnittet med normaliserade blanksteg (se normalize_whitespace).
+#
+# Ett ord som ensamt är större än max_tokens (t.ex. en lång URL eller base64)
+# delas mitt i ordet, så att ingen chunk blir större än max_tokens.
+
+T = TypeVar("T")
+
+DEFAULT_MAX_TOKENS = 300
+DEFAULT_OVERLAP_TOKENS = 50
+
+# En mening slutar med . ! ? … (ev. följt av citattecken/parentes) och blanksteg,
+# eller vid en tom rad (stycke/rubrik utan punkt).
+_SENTENCE_END = re.compile(r"[.!?…]+[\"”’)\]]*(?=\s)|\n[ \t]*\n")
+
+# Vid strömmad text släpps text utan meningsslut vidare i bitar av högst så här
+# många tecken, så att bufferten inte växer (och skannas om) obegränsat
+_MAX_CARRY = 8192
+
+_WORD = re.compile(r"\S+")
+
+
+def approx_tokens(text: str) -> int:
+    """Ungefärligt antal tokens (~4 tecken per token), utan riktig tokenizer."""
+    return max(1, (len(text) + 3) // 4)
+
+
+def normalize_whitespace(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _sentence_spans(text: str, start: int, end: int) -> Iterator[Tuple[int, int, str]]:
+    """(start, slut, normaliserad mening) för varje mening i text[start:end]."""
+    for match in _SENTENCE_END.finditer(text, start, end):
+        sentence = normalize_whitespace(text[start:match.end()])
+        if sentence:
+            yield start, match.end(), sentence
+        start = match.end()
+    sentence = normalize_whitespace(text[start:end])
+    if sentence:
+        yield start, end, sentence
+
+
+def iter_sentences(text: Union[str, Iterable[str]], start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+    """Ger meningar med normaliserade blanksteg.
+
+    Tar en sträng (ev. bara text[start:end], utan att kopiera avsnittet) eller
+    en ström av textbitar (t.ex. rader från en fil).
+    """
+    if isinstance(text, str):
+        for _, _, sentence in _sentence_spans(text, start, len(text) if end is None else end):
+            yield sentence
+        return
+
+    carry = ""
+    for piece in text:
+        buffer = carry + piece
+        offset = 0
+        for match in _SENTENCE_END.finditer(buffer):
+            sentence = normalize_whitespace(buffer[offset:match.end()])
+            if sentence:
+                yield sentence
+            offset = match.end()
+        carry = buffer[offset:]
+        while len(carry) > _MAX_CARRY:
+            cut = carry.rfind(" ", 0, _MAX_CARRY)
+            cut = cut if cut > 0 else _MAX_CARRY
+            sentence = normalize_whitespace(carry[:cut])
+            if sentence:
+                yield sentence
+            carry = carry[cut:]
+    sentence = normalize_whitespace(carry)
+    if sentence:
+        yield sentence
+
+
+def _word_pieces(word: str, max_tokens: int, length_fn: Callable[[str], int]) -> Iterator[Tuple[int, int]]:
+    """(start, slut) inom ordet: hela ordet, eller bitar om högst max_tokens om ordet ensamt är för stort."""
+    if length_fn(word) <= max_tokens:
+        yield 0, len(word)
+        return
+    # ~4 tecken per token (som approx_tokens); krymp biten om length_fn räknar annorlunda
+    step = max(1, max_tokens * 4)
+    start = 0
+    while start < len(word):
+        end = min(len(word), start + step)
+        if length_fn(word[start:end]) > max_tokens:
+            # Binärsök den längsta biten som ryms (minst ett tecken)
+            low, high = start + 1, end - 1
+            while low < high:
+                middle = (low + high + 1) // 2
+                if length_fn(word[start:middle]) <= max_tokens:
+                    low = middle
+                else:
+                    high = middle - 1
+            end = low
+        yield start, end
+        start = end
+
+
+def _group_words(words: Iterable[Tuple[T, str]], max_tokens: int, length_fn: Callable[[str], int]) -> Iterator[Tuple[List[T], int]]:
+    """Grupperar ord (nyckel, ord) i bitar om högst max_tokens; för meningar som ensamma är för stora.
+
+    Orden måste redan vara delade med _word_pieces, annars kan ett enskilt ord överskrida budgeten.
+    """
+    group, total = [], 0
+    for key, word in words:
+        size = length_fn(word)
+        if group and total + size > max_tokens:
+            yield group, total
+            group, total = [], 0
+        group.append(key)
+        total += size
+    if group:
+        yield group, total
+
+
+def _pack(parts: Iterable[Tuple[T, int]], max_tokens: int, overlap_tokens: int) -> Iterator[List[T]]:
+    """Packar delar (värde, tokens) i fönster om högst max_tokens med överlapp."""
+    if overlap_tokens >= max_tokens:
+        raise ValueError("overlap_tokens måste vara mindre än max_tokens.")
+
+    window: Deque[Tuple[T, int]] = deque()
+    window_tokens = 0
+    fresh = False  # innehåller fönstret något som inte redan skickats?
+
+    for part, part_tokens in parts:
+        if window and window_tokens + part_tokens > max_tokens:
+            if fresh:
+                yield [p for p, _ in window]
+                fresh = False
+            # Behåll slutet av fönstret som överlapp, men lämna plats åt nästa del
+            while window and (
+                window_tokens > overlap_tokens or window_tokens + part_tokens > max_tokens
+            ):
+                window_tokens -= window.popleft()[1]
+        window.append((part, part_tokens))
+        window_tokens += part_tokens
+        fresh = True
+
+    if fresh:
+        yield [p for p, _ in window]
+
+
+def split_spans(
+    text: str,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+    length_fn: Callable[[str], int] = approx_tokens,
+    start: int = 0,
+    end: Optional[int] = None,
+) -> Iterator[Tuple[int, int]]:
+    """Som split_text men ger (start, slut)-offsets i texten i stället för kopierade strängar."""
+    def parts():
+        for s, e, sentence in _sentence_spans(text, start, len(text) if end is None else end):
+            size = length_fn(sentence)
+            if size <= max_tokens:
+                yield (s, e), size
+                continue
+            words = (
+                ((m.start() + a, m.start() + b), m.group()[a:b])
+                for m in _WORD.finditer(text, s, e)
+                for a, b in _word_pieces(m.group(), max_tokens, length_fn)
+            )
+            for group, total in _group_words(words, max_tokens, length_fn):
+                yield (group[0][0], group[-1][1]), total
+
+    for window in _pack(parts(), max_tokens, overlap_tokens):
+        yield window[0][0], window[-1][1]
+
+
+def split_text(
+    text: Union[str, Iterable[str]],
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+    length_fn: Callable[[str], int] = approx_tokens,
+    start: int = 0,
+    end: Optional[int] = None,
+) -> Iterator[str]:
+    """Ger chunks om högst max_tokens (enligt length_fn) med overlap_tokens överlapp mellan grannar.
+
+    start/end begränsar en sträng till ett avsnitt (offsets från t.ex. chunkerns scanner).
+    """
+    if isinstance(text, str):
+        for s, e in split_spans(text, max_tokens, overlap_tokens, length_fn, start, end):
+            yield normalize_whitespace(text[s:e])
+        return
+
+    def parts():
+        for sentence in iter_sentences(text):
+            size = length_fn(sentence)
+            if size <= max_tokens:
+                yield sentence, size
+                continue
+            words = (
+                (word[a:b], word[a:b])
+                for word in sentence.split(" ")
+                for a, b in _word_pieces(word, max_tokens, length_fn)
+            )
+            for group, total in _group_words(words, max_tokens, length_fn):
+                yield " ".join(group), total
+
+    for window in _pack(parts(), max_tokens, overlap_tokens):
+        yield " ".join(window)
@@ -0,0 +1,188 @@
+import os
+import uuid
+import signal
+import socket
+import asyncio
+import argparse
+from typing import List, Set
+
+from backend import main
+from backend.utils.job_queue import (
+    JobQueue,
+    ClaimedJob,
+    SupabaseJobQueue,
+    SQLiteJobQueue,
+    DEFAULT_LEASE_SECONDS,
+    DEFAULT_MAX_ATTEMPTS,
+)
+
+# Separat worker-process som kör activity_jobs utanför webbservern.
+# Starta med: python -m backend.worker --concurrency 8
+# och sätt JOB_EXECUTION_MODE=worker för API:et så att det bara köar jobben.
+
+
+class Worker:
+    """Hämtar PENDING-jobb med lease, kör dem med begränsad samtidighet och återställer hängda jobb."""
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        concurrency: int = 4,
+        lease_seconds: int = DEFAULT_LEASE_SECONDS,
+        poll_interval: float = 1.0,
+        recover_interval: float = 30.0,
+    ):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.recover_interval = recover_interval
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+        self._running: Set[asyncio.Task] = set()
+        self._stopping = asyncio.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    async def _heartbeat(self, owned: Set[str]):
+        """Förlänger leasen medan jobbet körs så att det inte tas av en annan worker.
+
+        Jobb vars lease inte längre går att förlänga (de har återställts och kanske tagits av
+        en annan worker) tas bort ur owned, så att resultatet inte skrivs för dem.
+        """
+        while owned:
+            await asyncio.sleep(self.lease_seconds / 3)
+            for job_id in list(owned):
+                try:
+                    if not await self.queue.extend_lease(job_id, self.worker_id, self.lease_seconds):
+                        owned.discard(job_id)
+                        print(f"VARNING: Worker {self.worker_id} har förlorat leasen för jobb {job_id}; resultatet skrivs inte.")
+                except Exception as e:
+                    # Tillfälligt fel: försök igen vid nästa slag, leasen räcker ett par intervall till
+                    print(f"VARNING: Kunde inte förlänga leasen för jobb {job_id}: {e}")
+
+    async def _run_group(self, jobs: List[ClaimedJob]):
+        job_ids = [job.job_id for job in jobs]
+        request = jobs[0].request
+        owned = set(job_ids)
+        heartbeat = asyncio.create_task(self._heartbeat(owned))
+        try:
+            print(f"\n--- WORKER {self.worker_id}: JOBB {job_ids[0]} STARTAR ({len(job_ids)} st): {request.query} ---")
+            partial_writer = main.PartialResultWriter(
+                job_ids, lambda ids, partial: self.queue.save_partial(ids, partial, self.worker_id)
+            )
+            activities_data = await main.run_activity_pipeline(job_ids[0], request, on_partial=partial_writer)
+            await partial_writer.drain()
+            finished = await self._finish(owned, self.queue.complete, activities_data)
+            print(f"--- WORKER: JOBB {job_ids[0]} AVSLUTAT (Status: COMPLETED, {len(finished)}/{len(job_ids)} skrivna) ---")
+        except Exception as e:
+            print(f"--- WORKER: JOBB {job_ids[0]} MISSLYCKADES: {e} ---")
+            try:
+                await self._finish(owned, self.queue.fail, str(e))
+            except Exception as finish_error:
+                print(f"FEL: Kunde inte markera jobb {job_ids[0]} som misslyckat: {finish_error}")
+        finally:
+            heartbeat.cancel()
+
+    async def _finish(self, owned: Set[str], finish, value) -> List[str]:
+        """Skriver slutstatus för jobben som workern fortfarande äger. Kön ignorerar övertagna jobb."""
+        if not owned:
+            return []
+        finished = await finish(sorted(owned), value, self.worker_id)
+        for job_id in owned.difference(finished):
+            print(f"VARNING: Jobb {job_id} ägs inte längre av {self.worker_id}; slutstatusen ignorerades.")
+        return finished
+
+    def _spawn(self, jobs: List[ClaimedJob]):
+        task = asyncio.create_task(self._run_group(jobs))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def run_once(self) -> int:
+        """Hämtar och startar så många jobb som det finns lediga platser för."""
+        free = self.concurrency - len(self._running)
+        if free <= 0:
+            return 0
+        claimed = await self.queue.claim(self.worker_id, free, self.lease_seconds)
+
+        # Identiska förfrågningar i samma hämtning körs som en generering
+        groups = {}
+        for job in claimed:
+            groups.setdefault(main.dedup_key(job.request), []).append(job)
+        for jobs in groups.values():
+            self._spawn(jobs)
+        return len(claimed)
+
+    async def run(self):
+        print(f"--- Worker {self.worker_id} startad (samtidighet {self.concurrency}, lease {self.lease_seconds}s) ---")
+        loop = asyncio.get_running_loop()
+        last_recover = 0.0
+        while not self._stopping.is_set():
+            if loop.time() - last_recover >= self.recover_interval:
+                last_recover = loop.time()
+                try:
+                    recovered = await self.queue.recover_expired()
+                    if recovered:
+                        print(f"--- Worker: återställde {recovered} hängda jobb ---")
+                except Exception as e:
+                    print(f"VARNING: Kunde inte återställa hängda jobb: {e}")
+
+            try:
+                claimed = await self.run_once()
+            except Exception as e:
+                print(f"VARNING: Kunde inte hämta jobb: {e}")
+                claimed = 0
+
+            # Vänta bara om kön var tom eller alla platser är upptagna
+            if not claimed:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+        if self._running:
+            print(f"--- Worker: väntar på {len(self._running)} pågående jobb ---")
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+
+def create_queue(spec: str) -> JobQueue:
+    """'supabase' eller 'sqlite:<sökväg>' (t.ex. sqlite::memory: för tester)."""
+    max_attempts = int(os.getenv("WORKER_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS))
+    if spec.startswith("sqlite:"):
+        return SQLiteJobQueue(spec[len("sqlite:"):], max_attempts=max_attempts)
+    if not main.db.configured:
+        raise SystemExit("FEL: Supabase är inte konfigurerat (SUPABASE_URL/SUPABASE_SERVICE_ROLE_KEY).")
+    return SupabaseJobQueue(main.db, max_attempts=max_attempts)
+
+
+async def _main(args):
+    queue = create_queue(args.queue)
+    worker = Worker(
+        queue,
+        concurrency=args.concurrency,
+        lease_seconds=args.lease,
+        poll_interval=args.poll_interval,
+    )
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+
+    main.log_configuration()
+    await main.services.start()
+    try:
+        await worker.run()
+    finally:
+        await main.services.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Kör activity_jobs från kön utanför API-processen.")
+    parser.add_argument("--queue", default=os.getenv("WORKER_QUEUE", "supabase"))
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("WORKER_CONCURRENCY", "4")))
+    parser.add_argument("--lease", type=int, default=int(os.getenv("WORKER_LEASE_SECONDS", DEFAULT_LEASE_SECONDS)))
+    parser.add_argument("--poll-interval", type=float, default=float(os.getenv("WORKER_POLL_INTERVAL", "1.0")))
+    try:
+        asyncio.run(_main(parser.parse_args()))
+    except KeyboardInterrupt:
+        print("--- Worker stoppad ---")